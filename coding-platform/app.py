@@ -1,10 +1,16 @@
 import os
+import hmac
+import json
+import uuid
+import queue
+import atexit
 import logging
-from flask import Flask, render_template, request, jsonify
+import threading
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 from config import Config
 
 # Import core modules AFTER config validation potentially happens
-from core import runner, ai_coder # Assuming runner and ai_coder exist now
+from core import runner, ai_coder, ai_cache, ai_gateway, analyzer, optimizer, pool, hosts, docker_client, compile_cache, jobs, instrumentation, result_cache, backends
 
 # Basic logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
@@ -20,10 +26,165 @@ except Exception as e:
      # Optionally exit if config is invalid
      # exit(1)
 
+# Start warming sandbox containers in the background, on every Docker host
+if Config.POOL_ENABLED:
+    for container_pool in pool.get_pools(Config):
+        try:
+            container_pool.start()
+            atexit.register(container_pool.shutdown)
+        except Exception as e:
+            app.logger.error(f"Could not start container pool on {container_pool.base_url or 'default'}, runs there will use one-off containers: {e}")
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+SSE_KEEPALIVE_SECONDS = 15
+
+def _sse(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+def _sse_response(events):
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _busy_response(e):
+    response = jsonify({'error': 'The server is busy, please retry shortly.', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+def _rejected_response(e):
+    """429 or 503 for an AI call the gateway did not admit (core/ai_gateway.py)."""
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, e.status
+
+def _instrument_options(data):
+    """Reads the boolean `profile`/`memory` run options. Returns (profile, memory, None) or (None, None, error)."""
+    profile, memory = data.get('profile', False), data.get('memory', False)
+    if not isinstance(profile, bool) or not isinstance(memory, bool):
+        return None, None, "'profile' and 'memory' must be booleans"
+    if profile and memory:
+        return None, None, "'profile' and 'memory' cannot be combined"
+    return profile, memory, None
+
+def _is_int(value, low, high=None):
+    """True for a JSON integer (not a boolean) of at least `low` and at most `high` (if given)."""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= low and (high is None or value <= high)
+
+def _complexity_options(data):
+    """Reads and bounds the `complexity` run options. Returns (options or None, None) or (None, error)."""
+    options = data.get('complexity')
+    if options is None:
+        return None, None
+    if not isinstance(options, dict):
+        return None, "'complexity' must be an object"
+
+    max_size = Config.COMPLEXITY_MAX_SIZE
+    sizes = options.get('sizes')
+    if sizes is not None and (not isinstance(sizes, list) or len(sizes) > Config.COMPLEXITY_MAX_STEPS
+                              or not all(_is_int(n, 1, max_size) for n in sizes)):
+        return None, f"'complexity.sizes' must be a list of at most {Config.COMPLEXITY_MAX_STEPS} integers between 1 and {max_size}"
+    if not _is_int(options.get('start', 1), 1, max_size):
+        return None, f"'complexity.start' must be an integer between 1 and {max_size}"
+    if not _is_int(options.get('steps', 1), 1, Config.COMPLEXITY_MAX_STEPS):
+        return None, f"'complexity.steps' must be an integer between 1 and {Config.COMPLEXITY_MAX_STEPS}"
+    factor = options.get('factor', 2)
+    if isinstance(factor, bool) or not isinstance(factor, (int, float)) or not 1 < factor <= 16:
+        return None, "'complexity.factor' must be a number above 1 and at most 16"
+    if not _is_int(options.get('repeats', 1), 1, 5):
+        return None, "'complexity.repeats' must be an integer between 1 and 5"
+    if not _is_int(options.get('target_size', 1), 1, 10 ** 18):
+        return None, "'complexity.target_size' must be a positive integer"
+    size_param = options.get('size_param')
+    if size_param is not None and not isinstance(size_param, str):
+        return None, "'complexity.size_param' must be a string"
+    return options, None
+
+def _trusted_request():
+    """True if the request carries TRUSTED_CLIENT_TOKEN, which selects the TRUSTED_EXECUTION_BACKEND_* backends."""
+    token = request.headers.get('X-Trusted-Client')
+    if not (Config.TRUSTED_CLIENT_TOKEN and token):
+        return False
+    try:
+        # Headers arrive decoded as latin-1; compare_digest only takes ASCII strings, so compare the raw bytes
+        return hmac.compare_digest(token.encode('latin-1'), Config.TRUSTED_CLIENT_TOKEN.encode('utf-8'))
+    except UnicodeEncodeError:
+        return False
+
+def _client_id():
+    """Who an AI request is rate limited as: the remote address."""
+    return request.remote_addr or 'unknown'
+
+def _run_job(code, language, on_output=None, stdin=None, profile=False, memory=False, timings=False, trusted=False, cancelled=None):
+    result = runner.execute_code(code, language, Config, on_output=on_output, stdin=stdin, profile=profile, memory=memory,
+                                 timings=timings, trusted=trusted, cancelled=cancelled)
+    analysis = analyzer.analyze_submission(code, language, Config)
+    if analysis is not None:
+        result['analysis'] = analysis
+    app.logger.info(f"Execution result for run_id {result.get('run_id')}: Status {'OK' if not result.get('error') else 'ERROR'}, Runtime: {result.get('metrics',{}).get('runtime_ms')}ms")
+    return result
+
+def _result_cache_key(data, code, language, stdin, delivery, instrumented, trusted):
+    """Result cache key for a plain run, or None when its result must neither come from nor go to the cache.
+
+    Returns (key, None) or (None, error) if the `cache` option is not a boolean.
+    """
+    use_cache = data.get('cache', True)
+    if not isinstance(use_cache, bool):
+        return None, "'cache' must be a boolean"
+    if not Config.RESULT_CACHE_ENABLED or not use_cache or instrumented:
+        return None, None
+    reason = result_cache.nondeterminism(code, language)
+    if reason:
+        app.logger.info(f"Not caching {language} run: the submission {reason}")
+        return None, None
+    return result_cache.result_key(code, language, stdin, delivery, Config, trusted), None
+
+def _run_cached_job(key, code, language, stdin, trusted):
+    result = None
+    try:
+        result = _run_job(code, language, None, stdin, trusted=trusted)
+        return result
+    finally:
+        result_cache.get_cache(Config).finish(key, result)
+
+def _submit_cached_run(key, code, language, stdin, trusted):
+    """Answers /run from the result cache (an already finished job), joins an identical run that is
+    still queued or running, or submits a run whose result fills the cache. Raises QueueFullError."""
+    cache = result_cache.get_cache(Config)
+    scheduler = jobs.get_scheduler(Config)
+    entry = cache.get(key)
+    if entry is not None:
+        job = scheduler.record(language, result_cache.replay(entry, str(uuid.uuid4())))
+        return jsonify({**job.to_dict(), 'status_url': f"/jobs/{job.id}"}), 200
+    flight, leader = cache.begin(key)
+    if not leader:
+        # The leader may not have queued its job yet; then this run simply goes ahead uncached
+        job = flight.job or scheduler.submit(language, _run_job, code, language, None, stdin, False, False, False, trusted)
+        return jsonify({'job_id': job.id, 'status': job.status, 'status_url': f"/jobs/{job.id}", 'coalesced': job is flight.job}), 202
+    try:
+        flight.job = scheduler.submit(language, _run_cached_job, key, code, language, stdin, trusted)
+    except jobs.QueueFullError:
+        cache.finish(key)
+        raise
+    return jsonify({'job_id': flight.job.id, 'status': flight.job.status, 'status_url': f"/jobs/{flight.job.id}"}), 202
+
+def _replay_stream(entry):
+    for stream_name, text in entry["chunks"] or ():
+        yield _sse(stream_name, {'text': text})
+    yield _sse('result', result_cache.replay(entry, str(uuid.uuid4())))
+
+def _follow_flight(flight):
+    """SSE events for a /run/stream request coalesced onto an identical run: the leader's output once it finishes."""
+    while not flight.done.wait(SSE_KEEPALIVE_SECONDS):
+        yield ": keepalive\n\n"
+    entry = flight.reusable_entry()
+    if entry is None:
+        yield _sse('error', {'error': 'An identical run that this request was waiting on did not complete, please retry.'})
+        return
+    yield from _replay_stream(entry)
+
 @app.route('/run', methods=['POST'])
 def run_code_route():
     try:
@@ -40,16 +201,221 @@ def run_code_route():
         if language not in ['python', 'cpp']:
             return jsonify({'error': 'Unsupported language'}), 400
 
-        app.logger.info(f"Received request to run {language} (code length: {len(code)})")
-        result = runner.execute_code(code, language, app.config)
-        app.logger.info(f"Execution result for run_id {result.get('run_id')}: Status {'OK' if not result.get('error') else 'ERROR'}, Runtime: {result.get('metrics',{}).get('runtime_ms')}ms")
+        complexity_options, option_error = _complexity_options(data)
+        if option_error:
+            return jsonify({'error': option_error}), 400
+        stdin = data.get('stdin')
+        if stdin is not None and not isinstance(stdin, str):
+            return jsonify({'error': "'stdin' must be a string"}), 400
+        profile, memory, option_error = _instrument_options(data)
+        if option_error:
+            return jsonify({'error': option_error}), 400
+        timings = data.get('timings', False)
+        if not isinstance(timings, bool):
+            return jsonify({'error': "'timings' must be a boolean"}), 400
+        trusted = _trusted_request()
+        cache_key, option_error = _result_cache_key(data, code, language, stdin, 'collect',
+                                                    profile or memory or timings or complexity_options is not None, trusted)
+        if option_error:
+            return jsonify({'error': option_error}), 400
 
-        return jsonify(result)
+        app.logger.info(f"Received request to run {language} (code length: {len(code)}, complexity analysis: {complexity_options is not None})")
+        try:
+            if complexity_options is not None:
+                job = jobs.get_scheduler(Config).submit(language, runner.analyze_complexity, code, language, Config, complexity_options)
+            elif cache_key:
+                return _submit_cached_run(cache_key, code, language, stdin, trusted)
+            else:
+                job = jobs.get_scheduler(Config).submit(language, _run_job, code, language, None, stdin, profile, memory, timings, trusted)
+        except jobs.QueueFullError as e:
+            app.logger.warning(f"Rejected /run: {e}")
+            return _busy_response(e)
+
+        return jsonify({'job_id': job.id, 'status': job.status, 'status_url': f"/jobs/{job.id}"}), 202
 
     except Exception as e:
         app.logger.error(f"Error in /run endpoint: {e}", exc_info=True) # Log full traceback
         return jsonify({'error': 'An internal server error occurred during execution.'}), 500
 
+@app.route('/benchmark', methods=['POST'])
+def benchmark_route():
+    """Queues a benchmark (warmups + repeated timed runs in one sandbox); poll the returned status_url for the result."""
+    data = request.get_json(silent=True)
+    if not data:
+        app.logger.warning("Received empty/invalid JSON payload in /benchmark")
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+
+    code = data.get('code', '')
+    language = data.get('language', 'python')
+    if not code:
+        return jsonify({'error': 'No code provided'}), 400
+    if language not in ['python', 'cpp']:
+        return jsonify({'error': 'Unsupported language'}), 400
+    runs, warmups = data.get('runs'), data.get('warmups')
+    if any(value is not None and not _is_int(value, 0) for value in (runs, warmups)):
+        return jsonify({'error': "'runs' and 'warmups' must be non-negative integers"}), 400
+
+    app.logger.info(f"Received request to benchmark {language} (code length: {len(code)}, runs: {runs}, warmups: {warmups})")
+    try:
+        job = jobs.get_scheduler(Config).submit(language, runner.benchmark_code, code, language, Config, runs, warmups)
+    except jobs.QueueFullError as e:
+        app.logger.warning(f"Rejected /benchmark: {e}")
+        return _busy_response(e)
+    return jsonify({'job_id': job.id, 'status': job.status, 'status_url': f"/jobs/{job.id}"}), 202
+
+@app.route('/run/batch', methods=['POST'])
+def run_batch_route():
+    """Queues one program against many test cases in a single sandbox; poll the returned status_url.
+
+    Body: code, language, cases ([{stdin, expected}]), and optionally stop_on_failure,
+    case_timeout and timeout (seconds, capped by the server's limits).
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        app.logger.warning("Received empty/invalid JSON payload in /run/batch")
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+
+    code = data.get('code', '')
+    language = data.get('language', 'python')
+    cases = data.get('cases')
+    if not code:
+        return jsonify({'error': 'No code provided'}), 400
+    if language not in ['python', 'cpp']:
+        return jsonify({'error': 'Unsupported language'}), 400
+    if not isinstance(cases, list) or not cases:
+        return jsonify({'error': "'cases' must be a non-empty list"}), 400
+    if len(cases) > Config.BATCH_MAX_CASES:
+        return jsonify({'error': f"Too many cases (max {Config.BATCH_MAX_CASES})"}), 400
+    total_bytes = 0
+    for case in cases:
+        if not isinstance(case, dict) or not all(isinstance(case.get(field), (str, type(None))) for field in ('stdin', 'expected')):
+            return jsonify({'error': "Each case must be an object with string 'stdin' and optional string 'expected'"}), 400
+        total_bytes += len((case.get('stdin') or '').encode('utf-8')) + len((case.get('expected') or '').encode('utf-8'))
+    if total_bytes > Config.BATCH_MAX_INPUT_MB * 1024 * 1024:
+        return jsonify({'error': f"Test cases exceed {Config.BATCH_MAX_INPUT_MB} MiB"}), 413
+    case_timeout, timeout = data.get('case_timeout'), data.get('timeout')
+    if any(value is not None and not _is_int(value, 1) for value in (case_timeout, timeout)):
+        return jsonify({'error': "'case_timeout' and 'timeout' must be positive integers"}), 400
+
+    app.logger.info(f"Received request to batch-run {language} (code length: {len(code)}, cases: {len(cases)})")
+    try:
+        job = jobs.get_scheduler(Config).submit(language, runner.run_testcases, code, language, Config, cases,
+                                                bool(data.get('stop_on_failure')), case_timeout, timeout)
+    except jobs.QueueFullError as e:
+        app.logger.warning(f"Rejected /run/batch: {e}")
+        return _busy_response(e)
+    return jsonify({'job_id': job.id, 'status': job.status, 'status_url': f"/jobs/{job.id}"}), 202
+
+@app.route('/run/stream', methods=['POST'])
+def run_stream_route():
+    """Runs code like /run, streaming stdout/stderr as Server-Sent Events while the program executes.
+
+    Events: `queued` (job ID), `stdout`/`stderr` (text chunks), then `result` (exit status and metrics,
+    plus `profile` or `memory` with `"profile": true` / `"memory": true`, and the per-stage latency
+    breakdown with `"timings": true`) or `error`. Disconnecting cancels the run. With the result
+    cache enabled, a deterministic submission seen before (or running right now) replays that run's
+    output and a `result` marked `cached`, without a `queued` event; `"cache": false` opts out.
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        app.logger.warning("Received empty/invalid JSON payload in /run/stream")
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+
+    code = data.get('code', '')
+    language = data.get('language', 'python')
+    if not code:
+        return jsonify({'error': 'No code provided'}), 400
+    if language not in ['python', 'cpp']:
+        return jsonify({'error': 'Unsupported language'}), 400
+    stdin = data.get('stdin')
+    if stdin is not None and not isinstance(stdin, str):
+        return jsonify({'error': "'stdin' must be a string"}), 400
+    profile, memory, option_error = _instrument_options(data)
+    if option_error:
+        return jsonify({'error': option_error}), 400
+    timings = data.get('timings', False)
+    if not isinstance(timings, bool):
+        return jsonify({'error': "'timings' must be a boolean"}), 400
+    trusted = _trusted_request()
+    cache_key, option_error = _result_cache_key(data, code, language, stdin, 'stream', profile or memory or timings, trusted)
+    if option_error:
+        return jsonify({'error': option_error}), 400
+
+    if cache_key:
+        cache = result_cache.get_cache(Config)
+        entry = cache.get(cache_key)
+        if entry is not None:
+            return _sse_response(_replay_stream(entry))
+        flight, leader = cache.begin(cache_key)
+        if not leader:
+            return _sse_response(_follow_flight(flight))
+
+    events = queue.Queue()
+    cancelled = threading.Event()
+    chunks = [] if cache_key else None # Output kept for replay from the result cache
+
+    def on_output(stream_name, text):
+        if cancelled.is_set():
+            raise runner.RunCancelled()
+        if chunks is not None:
+            chunks.append([stream_name, text])
+        events.put((stream_name, {'text': text}))
+
+    def stream_job():
+        result = None
+        try:
+            if cancelled.is_set(): # The client went away while the run was queued
+                app.logger.info("Skipping a stream run whose client disconnected while it was queued")
+                return None
+            result = _run_job(code, language, on_output, stdin, profile, memory, timings, trusted, cancelled.is_set)
+        except Exception:
+            events.put(('error', {'error': 'An internal server error occurred during execution.'}))
+            raise
+        finally:
+            if cache_key:
+                result_cache.get_cache(Config).finish(cache_key, result, chunks)
+        events.put(('result', result))
+        return result
+
+    app.logger.info(f"Received request to stream-run {language} (code length: {len(code)})")
+    try:
+        job = jobs.get_scheduler(Config).submit(language, stream_job)
+    except jobs.QueueFullError as e:
+        app.logger.warning(f"Rejected /run/stream: {e}")
+        if cache_key:
+            result_cache.get_cache(Config).finish(cache_key)
+        return _busy_response(e)
+
+    def generate():
+        try:
+            yield _sse('queued', {'job_id': job.id, 'position': jobs.get_scheduler(Config).position(job)})
+            while True:
+                try:
+                    event, payload = events.get(timeout=SSE_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n" # Comment line; also surfaces client disconnects
+                    continue
+                yield _sse(event, payload)
+                if event in ('result', 'error'):
+                    break
+        finally:
+            cancelled.set() # No-op after the result; stops the run if the client went away
+
+    return _sse_response(generate())
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status_route(job_id):
+    for scheduler in (jobs.get_scheduler(Config), jobs.get_search_scheduler(Config)):
+        job = scheduler.get(job_id)
+        if job:
+            break
+    else:
+        return jsonify({'error': 'Unknown or expired job ID'}), 404
+    data = job.to_dict()
+    if job.status == 'queued':
+        data['position'] = scheduler.position(job)
+    return jsonify(data)
+
 @app.route('/generate', methods=['POST'])
 def generate_code_route():
     try:
@@ -69,18 +435,147 @@ def generate_code_route():
              return jsonify({'error': 'AI code generation is not configured on the server.'}), 501
 
         app.logger.info(f"Received request to generate code for prompt: {prompt[:50]}...")
-        generated_code = ai_coder.generate_via_gemini(prompt, language, app.config['GEMINI_API_KEY'])
+        generated_code = ai_coder.generate_via_gemini(prompt, language, app.config['GEMINI_API_KEY'], Config, _client_id())
         app.logger.info(f"AI generation completed (output length: {len(generated_code)})")
 
         return jsonify({'generated_code': generated_code})
 
+    except ai_gateway.Rejected as e:
+        return _rejected_response(e)
     except Exception as e:
         app.logger.error(f"Error in /generate endpoint: {e}", exc_info=True)
         return jsonify({'error': 'An internal server error occurred during AI generation.'}), 500
 
+def _ai_stream_response(events, cancelled, on_done=None, first=()):
+    """Relays (event, payload) pairs from ai_coder's streaming functions as SSE.
+
+    `first` (event, payload) pairs are sent before anything else. Then `delta` events carry {text},
+    then `done` {code} or `error` {error}. `on_done(code)` may return extra (event, payload) pairs to
+    send after `done`. If the client disconnects, Flask closes this generator, which sets
+    `cancelled` and closes the model stream.
+    """
+    def generate():
+        try:
+            for extra in first:
+                yield _sse(*extra)
+            for event, payload in events:
+                if event == 'delta':
+                    yield _sse('delta', {'text': payload})
+                elif event == 'done':
+                    yield _sse('done', {'code': payload})
+                    for extra in (on_done(payload) if on_done else ()):
+                        yield _sse(*extra)
+                else:
+                    yield _sse('error', {'error': payload})
+        finally:
+            cancelled.set()
+            events.close()
+
+    return _sse_response(generate())
+
+@app.route('/generate/stream', methods=['POST'])
+def generate_stream_route():
+    """Like /generate, but streams the code as Server-Sent Events while the model writes it."""
+    data = request.get_json(silent=True)
+    if not data:
+        app.logger.warning("Received empty/invalid JSON payload in /generate/stream")
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+    prompt = data.get('prompt', '')
+    language = data.get('language', 'python')
+    if not prompt:
+        return jsonify({'error': 'No prompt provided'}), 400
+    if not app.config['GEMINI_API_KEY']:
+        app.logger.warning("Attempted /generate/stream without GEMINI_API_KEY set.")
+        return jsonify({'error': 'AI code generation is not configured on the server.'}), 501
+
+    app.logger.info(f"Received request to stream generated code for prompt: {prompt[:50]}...")
+    cancelled = threading.Event()
+    events = ai_coder.generate_stream(prompt, language, app.config['GEMINI_API_KEY'], Config, cancelled.is_set, _client_id())
+    return _ai_stream_response(events, cancelled)
+
+@app.route('/optimize/stream', methods=['POST'])
+def optimize_stream_route():
+    """Like /optimize, but streams the AI's candidate as Server-Sent Events. The static analysis comes
+    first as an `analysis` event; with verification on, `done` is followed by a `verify` event with
+    the job that checks the candidate (see /optimize)."""
+    data = request.get_json(silent=True)
+    if not data:
+        app.logger.warning("Received empty/invalid JSON payload in /optimize/stream")
+        return jsonify({'error': 'Invalid JSON payload'}), 400
+    code = data.get('code', '')
+    language = data.get('language', 'python')
+    if not code:
+        return jsonify({'error': 'No code provided for optimization'}), 400
+    if language not in ['python', 'cpp']:
+        return jsonify({'error': 'Unsupported language for optimization'}), 400
+    if not app.config['GEMINI_API_KEY']:
+        app.logger.warning("Attempted /optimize/stream without GEMINI_API_KEY set.")
+        return jsonify({'error': 'AI code optimization is not configured on the server.'}), 501
+    verify = data.get('verify', Config.OPTIMIZE_VERIFY)
+    if not isinstance(verify, bool):
+        return jsonify({'error': "'verify' must be a boolean"}), 400
+
+    def start_verification(candidate):
+        if not verify:
+            return []
+        try:
+            job = jobs.get_scheduler(Config).submit(language, optimizer.choose_candidate, code, candidate, language, Config)
+        except jobs.QueueFullError as e:
+            app.logger.warning(f"Rejected /optimize/stream verification: {e}")
+            return [('error', {'error': 'The server is busy, the optimization could not be verified.', 'retry_after': e.retry_after})]
+        return [('verify', {'job_id': job.id, 'status_url': f"/jobs/{job.id}"})]
+
+    app.logger.info(f"Received request to stream-optimize {language} code (length: {len(code)}, verify: {verify})")
+    analysis = analyzer.analyze_submission(code, language, Config)
+    cancelled = threading.Event()
+    events = ai_coder.optimize_stream(code, language, app.config['GEMINI_API_KEY'], Config, cancelled.is_set, analysis, _client_id())
+    return _ai_stream_response(events, cancelled, start_verification, [('analysis', analysis)] if analysis else ())
+
+def _component_stats():
+    stats = {'docker': docker_client.get_manager(Config).stats(), 'jobs': jobs.get_scheduler(Config).stats(),
+             'search_jobs': jobs.get_search_scheduler(Config).stats()}
+    if Config.POOL_ENABLED:
+        stats['pool'] = pool.get_pool(Config).stats()
+    if Config.DOCKER_HOSTS: # Per-host health, load and pools; 'docker' and 'pool' above cover the first host
+        stats['hosts'] = hosts.get_hosts(Config).stats()
+        stats['docker_hosts'] = {url: docker_client.get_manager(Config, url).stats() for url in docker_client.host_urls(Config)}
+        if Config.POOL_ENABLED:
+            stats['pools'] = {container_pool.base_url: container_pool.stats() for container_pool in pool.get_pools(Config)}
+    if Config.COMPILE_CACHE_ENABLED:
+        stats['compile_cache'] = compile_cache.get_cache(Config).stats()
+    if Config.AI_CACHE_ENABLED:
+        stats['ai_cache'] = ai_cache.get_cache(Config).stats()
+    if Config.AI_GATEWAY_ENABLED:
+        stats['ai_gateway'] = ai_gateway.get_gateway(Config).stats()
+    if Config.RESULT_CACHE_ENABLED:
+        stats['result_cache'] = result_cache.get_cache(Config).stats()
+    for name, backend_stats in backends.stats().items():
+        stats[f'backend_{name}'] = backend_stats
+    return stats
+
+@app.route('/stats', methods=['GET'])
+def stats_route():
+    stats = _component_stats()
+    stats['latency'] = instrumentation.get_registry().latency_summary()
+    return jsonify(stats)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus text exposition: stage/operation latency histograms, run and Gemini counters, and the /stats numbers as gauges."""
+    if not Config.METRICS_ENABLED:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(instrumentation.get_registry().render(_component_stats()), mimetype='text/plain; version=0.0.4')
+
 # --- New Route for Optimization ---
 @app.route('/optimize', methods=['POST'])
 def optimize_code_route():
+    """AI optimization. The AI is asked on the request thread; with verification (OPTIMIZE_VERIFY, or
+    `verify` in the body) a job that runs, compares and benchmarks both versions is then queued and
+    the answer is 202 with a status_url, otherwise the AI's code is returned directly. With `search` in the body the job is a multi-round, measurement-guided
+    search instead (optimizer.search_optimizations; `rounds` and `candidates` per round are optional),
+    queued on the search scheduler so its AI calls never hold a sandbox job worker, whose result
+    carries every candidate's measurements. Either way the result includes the static
+    `analysis` of the submitted code."""
     try:
         data = request.get_json()
         if not data:
@@ -99,16 +594,46 @@ def optimize_code_route():
              app.logger.warning("Attempted /optimize without GEMINI_API_KEY set.")
              return jsonify({'error': 'AI code optimization is not configured on the server.'}), 501
 
-        app.logger.info(f"Received request to optimize {language} code (length: {len(code)})")
-        optimized_code = ai_coder.optimize_via_gemini(code, language, app.config['GEMINI_API_KEY'])
+        search, rounds, candidates = data.get('search', False), data.get('rounds'), data.get('candidates')
+        if not isinstance(search, bool):
+            return jsonify({'error': "'search' must be a boolean"}), 400
+        if any(value is not None and not _is_int(value, 1) for value in (rounds, candidates)):
+            return jsonify({'error': "'rounds' and 'candidates' must be positive integers"}), 400
+        if search:
+            app.logger.info(f"Received request to search optimizations of {language} code (length: {len(code)}, rounds: {rounds}, candidates: {candidates})")
+            try:
+                job = jobs.get_search_scheduler(Config).submit(language, optimizer.search_optimizations, code, language, Config,
+                                                               _client_id(), rounds, candidates)
+            except jobs.QueueFullError as e:
+                app.logger.warning(f"Rejected /optimize search: {e}")
+                return _busy_response(e)
+            return jsonify({'job_id': job.id, 'status': job.status, 'status_url': f"/jobs/{job.id}"}), 202
+
+        verify = data.get('verify', Config.OPTIMIZE_VERIFY)
+        if not isinstance(verify, bool):
+            return jsonify({'error': "'verify' must be a boolean"}), 400
+        app.logger.info(f"Received request to optimize {language} code (length: {len(code)}, verify: {verify})")
+        analysis = analyzer.analyze_submission(code, language, Config)
+        optimized_code = ai_coder.optimize_via_gemini(code, language, app.config['GEMINI_API_KEY'], Config, analysis, _client_id())
         app.logger.info(f"AI optimization completed (output length: {len(optimized_code)})")
 
         # Check if optimization failed or returned an error message
         if optimized_code.startswith("Error:"):
-             return jsonify({'error': optimized_code}), 500 # Return AI's error message
+             return jsonify({'error': optimized_code, 'analysis': analysis}), 500 # Return AI's error message
+
+        if verify:
+            # Only the runs and benchmarks of both versions are queued like /run, so a job worker never waits on the AI
+            try:
+                job = jobs.get_scheduler(Config).submit(language, optimizer.choose_candidate, code, optimized_code, language, Config, analysis)
+            except jobs.QueueFullError as e:
+                app.logger.warning(f"Rejected /optimize verification: {e}")
+                return _busy_response(e)
+            return jsonify({'job_id': job.id, 'status': job.status, 'status_url': f"/jobs/{job.id}"}), 202
 
-        return jsonify({'optimized_code': optimized_code})
+        return jsonify({'optimized_code': optimized_code, 'analysis': analysis})
 
+    except ai_gateway.Rejected as e:
+        return _rejected_response(e)
     except Exception as e:
         app.logger.error(f"Error in /optimize endpoint: {e}", exc_info=True)
         return jsonify({'error': 'An internal server error occurred during AI optimization.'}), 500
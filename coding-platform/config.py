@@ -1,4 +1,6 @@
 import os
+import sys
+import tempfile
 from dotenv import load_dotenv
 
 # Ensure paths are absolute, relative to this config file's directory
@@ -25,21 +27,165 @@ class Config:
     FLASK_DEBUG = os.getenv('FLASK_DEBUG', 'False').lower() in ('true', '1', 't')
     GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
-    DOCKER_PYTHON_IMAGE = os.getenv('DOCKER_PYTHON_IMAGE', "python:3.10-slim")
-    DOCKER_CPP_IMAGE = os.getenv('DOCKER_CPP_IMAGE', "gcc:11")
+    DOCKER_PYTHON_IMAGE = os.getenv('DOCKER_PYTHON_IMAGE', "python:3.10-slim") # Used unless MANAGED_IMAGES replaces it
+    DOCKER_CPP_IMAGE = os.getenv('DOCKER_CPP_IMAGE', "gcc:11") # Used unless MANAGED_IMAGES replaces it
     DOCKER_TIMEOUT_SECONDS = int(os.getenv('DOCKER_TIMEOUT_SECONDS', 10))
     DOCKER_MEM_LIMIT = os.getenv('DOCKER_MEM_LIMIT', "128m")
     DOCKER_CPUS = float(os.getenv('DOCKER_CPUS', 0.5))
-    # Ensure TEMP_CODE_DIR is absolute path within the project structure
-    TEMP_CODE_DIR = os.path.join(project_root, 'temp_code') # Relative to project root
+    SANDBOX_MAX_PROCESSES = int(os.getenv('SANDBOX_MAX_PROCESSES', 64)) # Processes and threads a run may create (Docker pids limit, local RLIMIT_NPROC)
+    DOCKER_CLIENT_POOL_SIZE = int(os.getenv('DOCKER_CLIENT_POOL_SIZE', 16)) # Reused HTTP connections to the daemon
+    DOCKER_HEALTHCHECK_SECONDS = int(os.getenv('DOCKER_HEALTHCHECK_SECONDS', 15))
+
+    # Project sandbox images built from dockerfiles/ (see core/images.py)
+    MANAGED_IMAGES = os.getenv('MANAGED_IMAGES', 'True').lower() in ('true', '1', 't') # Build at startup and replace DOCKER_*_IMAGE
+    IMAGE_CPP_PCH_HEADERS = os.getenv('IMAGE_CPP_PCH_HEADERS', "bits/stdc++.h iostream") # Headers precompiled into the C++ image
+    IMAGE_PYTHON_PACKAGES = os.getenv('IMAGE_PYTHON_PACKAGES', "") # pip requirements preinstalled in the Python image, e.g. "numpy"
+
+    # Docker hosts runs are dispatched across (see core/hosts.py)
+    DOCKER_HOSTS = os.getenv('DOCKER_HOSTS', '') # Comma-separated daemon URLs, e.g. unix:///var/run/docker.sock,tcp://10.0.0.2:2375; empty: DOCKER_HOST
+    DOCKER_HOST_PLACEMENT = os.getenv('DOCKER_HOST_PLACEMENT', 'p2c') # "p2c" (power of two random choices) or "least_loaded"
+    DOCKER_HOST_EJECT_FAILURES = int(os.getenv('DOCKER_HOST_EJECT_FAILURES', 3)) # Consecutive infrastructure failures before ejecting a host
+    DOCKER_HOST_EJECT_SECONDS = int(os.getenv('DOCKER_HOST_EJECT_SECONDS', 30))
+    DOCKER_DISPATCH_RETRIES = int(os.getenv('DOCKER_DISPATCH_RETRIES', 2)) # Other hosts tried when one cannot provide a sandbox
+
+    # Per-run CPU/memory telemetry (see core/metrics.py)
+    TELEMETRY_ENABLED = os.getenv('TELEMETRY_ENABLED', 'True').lower() in ('true', '1', 't')
+    TELEMETRY_INTERVAL_MS = int(os.getenv('TELEMETRY_INTERVAL_MS', 50))
+    TELEMETRY_MAX_OVERHEAD_PCT = float(os.getenv('TELEMETRY_MAX_OVERHEAD_PCT', 2.0)) # Sampler backs off above this
+    TELEMETRY_MAX_POINTS = int(os.getenv('TELEMETRY_MAX_POINTS', 60)) # Time series length in the response
+    CGROUP_ROOT = os.getenv('CGROUP_ROOT', '/sys/fs/cgroup')
+
+    # Empirical complexity analysis (runner.analyze_complexity)
+    COMPLEXITY_START_SIZE = int(os.getenv('COMPLEXITY_START_SIZE', 1000))
+    COMPLEXITY_STEPS = int(os.getenv('COMPLEXITY_STEPS', 6)) # Sizes start * 2^k for k < steps
+    COMPLEXITY_MAX_STEPS = int(os.getenv('COMPLEXITY_MAX_STEPS', 12))
+    COMPLEXITY_MAX_SIZE = int(os.getenv('COMPLEXITY_MAX_SIZE', 1_000_000_000)) # Largest input size a request may ask for
+    COMPLEXITY_REPEATS = int(os.getenv('COMPLEXITY_REPEATS', 3)) # Runs per size; the fastest is kept
+    COMPLEXITY_TIME_BUDGET_SECONDS = int(os.getenv('COMPLEXITY_TIME_BUDGET_SECONDS', 60))
+    COMPLEXITY_TARGET_SIZE = int(os.getenv('COMPLEXITY_TARGET_SIZE', 1_000_000)) # "Production" n for scaling warnings
+
+    # Statistical benchmark mode (runner.benchmark_code)
+    BENCHMARK_RUNS = int(os.getenv('BENCHMARK_RUNS', 20)) # Timed runs by default; more are added while results are noisy
+    BENCHMARK_WARMUPS = int(os.getenv('BENCHMARK_WARMUPS', 3))
+    BENCHMARK_MAX_RUNS = int(os.getenv('BENCHMARK_MAX_RUNS', 200))
+    BENCHMARK_TIME_BUDGET_SECONDS = int(os.getenv('BENCHMARK_TIME_BUDGET_SECONDS', 60))
+    BENCHMARK_TARGET_CI_PCT = float(os.getenv('BENCHMARK_TARGET_CI_PCT', 2.5)) # Median CI half-width to aim for
+
+    # Multi-testcase batches (runner.run_testcases)
+    BATCH_MAX_CASES = int(os.getenv('BATCH_MAX_CASES', 200))
+    BATCH_MAX_INPUT_MB = int(os.getenv('BATCH_MAX_INPUT_MB', 16)) # All stdin + expected output; lives in the sandbox tmpfs
+    BATCH_TIME_BUDGET_SECONDS = int(os.getenv('BATCH_TIME_BUDGET_SECONDS', 60))
+    BATCH_OUTPUT_LIMIT_BYTES = int(os.getenv('BATCH_OUTPUT_LIMIT_BYTES', 4096)) # stdout/stderr returned per case
+
+    # Bounded capture of a run's stdout/stderr (see core/output_capture.py)
+    OUTPUT_HEAD_BYTES = int(os.getenv('OUTPUT_HEAD_BYTES', 64 * 1024)) # Kept from the start of stdout and of stderr
+    OUTPUT_TAIL_BYTES = int(os.getenv('OUTPUT_TAIL_BYTES', 16 * 1024)) # Kept from the end of each; the middle is left out
+    OUTPUT_LIMIT_BYTES = int(os.getenv('OUTPUT_LIMIT_BYTES', 8 * 1024 * 1024)) # stdout + stderr before the program is killed; 0: no limit
+
+    # /optimize verification (see core/optimizer.py)
+    OPTIMIZE_VERIFY = os.getenv('OPTIMIZE_VERIFY', 'True').lower() in ('true', '1', 't')
+    OPTIMIZE_VERIFY_RUNS = int(os.getenv('OPTIMIZE_VERIFY_RUNS', 3)) # Output/memory runs per version before benchmarking
+    OPTIMIZE_VERIFY_ALLOCATIONS = os.getenv('OPTIMIZE_VERIFY_ALLOCATIONS', 'True').lower() in ('true', '1', 't') # Compare traced peak heap too
+    OPTIMIZE_SEARCH_ROUNDS = int(os.getenv('OPTIMIZE_SEARCH_ROUNDS', 3)) # Default rounds of `search` on /optimize
+    OPTIMIZE_SEARCH_CANDIDATES = int(os.getenv('OPTIMIZE_SEARCH_CANDIDATES', 2)) # Default AI candidates requested in parallel per round
+    OPTIMIZE_SEARCH_MAX_ROUNDS = int(os.getenv('OPTIMIZE_SEARCH_MAX_ROUNDS', 5)) # Caps on what a request may ask for
+    OPTIMIZE_SEARCH_MAX_CANDIDATES = int(os.getenv('OPTIMIZE_SEARCH_MAX_CANDIDATES', 4))
+    OPTIMIZE_SEARCH_WORKERS = int(os.getenv('OPTIMIZE_SEARCH_WORKERS', 2)) # Concurrent searches; their AI calls never hold a sandbox job worker
+    OPTIMIZE_SEARCH_QUEUE_MAX = int(os.getenv('OPTIMIZE_SEARCH_QUEUE_MAX', 10)) # Beyond this a search answers 429
+
+    # Profile mode (`profile` on /run, see core/profiler.py)
+    PROFILE_SAMPLE_INTERVAL_US = int(os.getenv('PROFILE_SAMPLE_INTERVAL_US', 1000)) # CPU time between stack samples
+    PROFILE_MAX_FUNCTIONS = int(os.getenv('PROFILE_MAX_FUNCTIONS', 50))
+    PROFILE_MAX_LINES = int(os.getenv('PROFILE_MAX_LINES', 30))
+    PROFILE_MAX_STACKS = int(os.getenv('PROFILE_MAX_STACKS', 2000)) # Collapsed-stack lines for flame graphs
+
+    # Memory mode (`memory` on /run, see core/profiler.py)
+    MEMORY_SAMPLE_INTERVAL_MS = int(os.getenv('MEMORY_SAMPLE_INTERVAL_MS', 10)) # Heap timeline resolution
+    MEMORY_MAX_POINTS = int(os.getenv('MEMORY_MAX_POINTS', 200)) # Timeline length in the response
+    MEMORY_MAX_SITES = int(os.getenv('MEMORY_MAX_SITES', 20)) # Allocation sites reported
+
+    # Static performance analysis (see core/analyzer.py), returned by /run and /optimize
+    ANALYZER_ENABLED = os.getenv('ANALYZER_ENABLED', 'True').lower() in ('true', '1', 't')
+    ANALYZER_MAX_FINDINGS = int(os.getenv('ANALYZER_MAX_FINDINGS', 50))
+    ANALYZER_PROMPT_HINTS = int(os.getenv('ANALYZER_PROMPT_HINTS', 8)) # Most severe findings passed to the optimize prompt
+
+    # Latency instrumentation (see core/instrumentation.py)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() in ('true', '1', 't') # Prometheus text on /metrics
+    TIMINGS_IN_RESPONSE = os.getenv('TIMINGS_IN_RESPONSE', 'False').lower() in ('true', '1', 't') # Always attach `timings` to /run results
+
+    # Asynchronous /run jobs (see core/jobs.py)
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', os.cpu_count() or 2)) # Max concurrent sandbox runs per Docker host
+    JOB_QUEUE_MAX = int(os.getenv('JOB_QUEUE_MAX', 100)) # Beyond this /run answers 429
+    JOB_RESULT_TTL_SECONDS = int(os.getenv('JOB_RESULT_TTL_SECONDS', 300))
+
+    # Content-addressed cache of compiled C++ binaries (see core/compile_cache.py)
+    COMPILE_CACHE_ENABLED = os.getenv('COMPILE_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    COMPILE_CACHE_DIR = os.getenv('COMPILE_CACHE_DIR', os.path.join(project_root, 'compile_cache'))
+    COMPILE_CACHE_MAX_MB = int(os.getenv('COMPILE_CACHE_MAX_MB', 256))
+
+    # Cache of AI model responses (see core/ai_cache.py)
+    AI_CACHE_ENABLED = os.getenv('AI_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+    AI_CACHE_DIR = os.getenv('AI_CACHE_DIR', os.path.join(project_root, 'ai_cache'))
+    AI_CACHE_MAX_MB = int(os.getenv('AI_CACHE_MAX_MB', 32))
+    AI_CACHE_MEMORY_ENTRIES = int(os.getenv('AI_CACHE_MEMORY_ENTRIES', 256)) # Hottest responses also kept in memory
+    AI_CACHE_TTL_SECONDS = int(os.getenv('AI_CACHE_TTL_SECONDS', 7 * 24 * 3600))
+
+    # Admission control, retries and coalescing for Gemini calls (see core/ai_gateway.py)
+    AI_GATEWAY_ENABLED = os.getenv('AI_GATEWAY_ENABLED', 'True').lower() in ('true', '1', 't')
+    AI_RATE_LIMIT_RPM = float(os.getenv('AI_RATE_LIMIT_RPM', 15)) # Model calls per minute for the whole server; match the API key's quota
+    AI_RATE_LIMIT_BURST = int(os.getenv('AI_RATE_LIMIT_BURST', 5))
+    AI_CLIENT_RATE_LIMIT_RPM = float(os.getenv('AI_CLIENT_RATE_LIMIT_RPM', 6)) # Per remote address
+    AI_CLIENT_RATE_LIMIT_BURST = int(os.getenv('AI_CLIENT_RATE_LIMIT_BURST', 3))
+    AI_MAX_CONCURRENCY = int(os.getenv('AI_MAX_CONCURRENCY', 4)) # Model calls in progress at once
+    AI_ADMISSION_TIMEOUT_SECONDS = float(os.getenv('AI_ADMISSION_TIMEOUT_SECONDS', 10)) # Longest wait for a global token or a free slot
+    AI_RETRY_ATTEMPTS = int(os.getenv('AI_RETRY_ATTEMPTS', 3)) # Attempts in all on quota (resource_exhausted) and deadline errors
+    AI_RETRY_BASE_MS = int(os.getenv('AI_RETRY_BASE_MS', 500))
+    AI_RETRY_MAX_MS = int(os.getenv('AI_RETRY_MAX_MS', 8000))
+    AI_BREAKER_FAILURES = int(os.getenv('AI_BREAKER_FAILURES', 5)) # Consecutive upstream failures that open the circuit
+    AI_BREAKER_RESET_SECONDS = float(os.getenv('AI_BREAKER_RESET_SECONDS', 30)) # Fail fast this long, then try one call
+
+    # Opt-in cache of deterministic /run results (see core/result_cache.py)
+    RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', 'False').lower() in ('true', '1', 't')
+    RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR', os.path.join(project_root, 'result_cache'))
+    RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', 64))
+    RESULT_CACHE_MEMORY_ENTRIES = int(os.getenv('RESULT_CACHE_MEMORY_ENTRIES', 512)) # Hottest results also kept in memory
+    RESULT_CACHE_TTL_SECONDS = int(os.getenv('RESULT_CACHE_TTL_SECONDS', 24 * 3600))
+
+    # Execution backends (see core/backends.py): "docker" containers or "local" processes (core/local_sandbox.py)
+    EXECUTION_BACKEND_PYTHON = os.getenv('EXECUTION_BACKEND_PYTHON', 'docker')
+    EXECUTION_BACKEND_CPP = os.getenv('EXECUTION_BACKEND_CPP', 'docker')
+    TRUSTED_EXECUTION_BACKEND_PYTHON = os.getenv('TRUSTED_EXECUTION_BACKEND_PYTHON', 'local') # For requests carrying TRUSTED_CLIENT_TOKEN
+    TRUSTED_EXECUTION_BACKEND_CPP = os.getenv('TRUSTED_EXECUTION_BACKEND_CPP', 'local')
+    TRUSTED_CLIENT_TOKEN = os.getenv('TRUSTED_CLIENT_TOKEN') # Sent as the X-Trusted-Client header; unset: every request is untrusted
+    LOCAL_SANDBOX_ROOT = os.getenv('LOCAL_SANDBOX_ROOT', os.path.join(tempfile.gettempdir(), 'coding-platform-sandboxes'))
+    LOCAL_PYTHON = os.getenv('LOCAL_PYTHON', sys.executable) # Interpreter for local sandboxes; defaults to the app's own
+    LOCAL_SANDBOX_FILE_LIMIT = os.getenv('LOCAL_SANDBOX_FILE_LIMIT', '64m') # Largest file a process may write, like the tmpfs size
+    LOCAL_SANDBOX_NETWORK_ISOLATION = os.getenv('LOCAL_SANDBOX_NETWORK_ISOLATION', 'True').lower() in ('true', '1', 't') # Network namespace per process
+
+    # Warm container pool (see core/pool.py)
+    POOL_ENABLED = os.getenv('POOL_ENABLED', 'True').lower() in ('true', '1', 't')
+    POOL_SIZE_PYTHON = int(os.getenv('POOL_SIZE_PYTHON', 2))
+    POOL_SIZE_CPP = int(os.getenv('POOL_SIZE_CPP', 2))
+    POOL_MAX_USES = int(os.getenv('POOL_MAX_USES', 50)) # Replace a container after this many runs
+    POOL_WARMUP = os.getenv('POOL_WARMUP', 'True').lower() in ('true', '1', 't') # Fill the pool at startup
+    POOL_HEALTHCHECK_SECONDS = int(os.getenv('POOL_HEALTHCHECK_SECONDS', 30))
 
     @staticmethod
     def validate():
         print("--- Configuration ---")
         print(f"FLASK_DEBUG: {Config.FLASK_DEBUG}")
-        print(f"TEMP_CODE_DIR: {Config.TEMP_CODE_DIR}")
         print(f"DOCKER_PYTHON_IMAGE: {Config.DOCKER_PYTHON_IMAGE}")
         print(f"DOCKER_CPP_IMAGE: {Config.DOCKER_CPP_IMAGE}")
+        print(f"JOB_WORKERS: {Config.JOB_WORKERS} per Docker host (queue max {Config.JOB_QUEUE_MAX})")
+        if Config.DOCKER_HOSTS:
+            print(f"DOCKER_HOSTS: {Config.DOCKER_HOSTS} (placement: {Config.DOCKER_HOST_PLACEMENT})")
+        print(f"EXECUTION_BACKEND: python={Config.EXECUTION_BACKEND_PYTHON}, cpp={Config.EXECUTION_BACKEND_CPP}"
+              + (f" (trusted: python={Config.TRUSTED_EXECUTION_BACKEND_PYTHON}, cpp={Config.TRUSTED_EXECUTION_BACKEND_CPP})"
+                 if Config.TRUSTED_CLIENT_TOKEN else ""))
+        if Config.POOL_ENABLED:
+            print(f"POOL: python={Config.POOL_SIZE_PYTHON}, cpp={Config.POOL_SIZE_CPP}, max uses={Config.POOL_MAX_USES}")
+        else:
+            print("POOL: Disabled (one container per run)")
         if not Config.GEMINI_API_KEY:
             print("Warning: GEMINI_API_KEY is not set.")
         else:
@@ -48,11 +194,39 @@ class Config:
              print("Warning: FLASK_SECRET_KEY is not set or using the default.")
         else:
              print("FLASK_SECRET_KEY: Set (length > 0)")
+        if Config.COMPLEXITY_TIME_BUDGET_SECONDS <= 0:
+            print(f"Warning: COMPLEXITY_TIME_BUDGET_SECONDS must be positive (got {Config.COMPLEXITY_TIME_BUDGET_SECONDS}), using 60.")
+            Config.COMPLEXITY_TIME_BUDGET_SECONDS = 60
         print("---------------------")
-        # Create temp dir if it doesn't exist during validation
+        if Config.COMPILE_CACHE_ENABLED:
+            # Must exist before sandboxes bind-mount it, or Docker would create it owned by root
+            os.makedirs(Config.COMPILE_CACHE_DIR, exist_ok=True)
+            print(f"COMPILE_CACHE_DIR: {Config.COMPILE_CACHE_DIR} (max {Config.COMPILE_CACHE_MAX_MB} MiB)")
+        if Config.AI_CACHE_ENABLED:
+            print(f"AI_CACHE_DIR: {Config.AI_CACHE_DIR} (max {Config.AI_CACHE_MAX_MB} MiB, TTL {Config.AI_CACHE_TTL_SECONDS}s)")
+        if Config.AI_GATEWAY_ENABLED:
+            print(f"AI_GATEWAY: {Config.AI_RATE_LIMIT_RPM:g}/min ({Config.AI_CLIENT_RATE_LIMIT_RPM:g}/min per client), "
+                  f"{Config.AI_MAX_CONCURRENCY} concurrent, {Config.AI_RETRY_ATTEMPTS} attempts")
+        if Config.RESULT_CACHE_ENABLED:
+            print(f"RESULT_CACHE_DIR: {Config.RESULT_CACHE_DIR} (max {Config.RESULT_CACHE_MAX_MB} MiB, TTL {Config.RESULT_CACHE_TTL_SECONDS}s)")
+        # Connect every host's shared Docker client and fill its image cache so /run never checks images itself
         try:
-            os.makedirs(Config.TEMP_CODE_DIR, exist_ok=True)
-            print(f"Ensured temporary code directory exists: {Config.TEMP_CODE_DIR}")
-        except OSError as e:
-            print(f"Error creating temporary code directory {Config.TEMP_CODE_DIR}: {e}")
-            raise # Reraise the error as this directory is critical
\ No newline at end of file
+            from core import hosts
+            host_set = hosts.get_hosts(Config)
+            host_set.start()
+            if Config.MANAGED_IMAGES:
+                from core import images
+                healthy = [host.manager for host in host_set.hosts if host.manager.healthy]
+                for language, outcome in images.use_managed_images(Config, healthy).items():
+                    print(f"{images.IMAGE_SETTINGS[language]}: {outcome}" if not outcome.startswith("Error:")
+                          else f"Warning: Could not build the {language} image, using {getattr(Config, images.IMAGE_SETTINGS[language])}: {outcome}")
+            for host in host_set.hosts:
+                manager = host.manager
+                if manager.healthy:
+                    for image_name in (Config.DOCKER_PYTHON_IMAGE, Config.DOCKER_CPP_IMAGE):
+                        manager.ensure_image(image_name)
+                    print(f"Docker images ready on {manager.name}.")
+                else:
+                    print(f"Warning: Docker host {manager.name} is not reachable: {manager.last_error}")
+        except Exception as e:
+            print(f"Warning: Could not prepare Docker images: {e}")
\ No newline at end of file
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Canonical form of a prompt: unified newlines, no trailing whitespace, no leading/trailing blank lines."""
+    lines = prompt.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def prompt_key(prompt: str, model_name: str, settings: str) -> str:
+    """Content address of a model call: normalized prompt, model name and generation/safety settings."""
+    digest = hashlib.sha256()
+    for part in (normalize_prompt(prompt), model_name, settings):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    """Two-level cache of AI model responses keyed by `prompt_key()`, also used for serialized run results.
+
+    Every entry is a `<key>.json` file (response text, creation time and how long the model call
+    took), bounded by `max_bytes` and expired after `ttl_seconds`; the most recently used
+    `memory_entries` responses are also kept in memory. Like the compile cache, on-disk recency
+    is mirrored in file mtimes so the LRU order survives restarts.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl_seconds: int, memory_entries: int, name: str = "AI response"):
+        self.cache_dir = cache_dir
+        self.name = name # For log messages
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self._entries = OrderedDict() # key -> (size_bytes, created_at, latency_ms), least recently used first
+        self._memory = OrderedDict() # key -> response text for the hottest entries
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "memory_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0, "latency_saved_ms": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            try:
+                stat = os.stat(self._path(key))
+                with open(self._path(key), encoding='utf-8') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            found.append((stat.st_mtime, key, stat.st_size, entry.get("created_at", 0), entry.get("latency_ms", 0)))
+        for _, key, size, created_at, latency_ms in sorted(found):
+            self._entries[key] = (size, created_at, latency_ms)
+            self._total_bytes += size
+        logger.info(f"{self.name} cache loaded {len(self._entries)} entries ({self._total_bytes / 1024:.0f} KiB) from {self.cache_dir}")
+
+    def get(self, key: str):
+        """Returns the cached response text, or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] > self.ttl_seconds:
+                self._drop(key)
+                self.counters["expirations"] += 1
+                entry = None
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            response = self._memory.get(key)
+            if response is not None:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+        if response is None:
+            try:
+                with open(self._path(key), encoding='utf-8') as f:
+                    response = json.load(f)["response"]
+                os.utime(self._path(key))
+            except (OSError, ValueError, KeyError):
+                with self._lock: # Removed or corrupted behind our back
+                    if key in self._entries:
+                        self._drop(key)
+                    self.counters["misses"] += 1
+                return None
+            with self._lock:
+                self._remember(key, response)
+        with self._lock:
+            self.counters["hits"] += 1
+            self.counters["latency_saved_ms"] += entry[2]
+        return response
+
+    def put(self, key: str, response: str, latency_ms: int):
+        """Stores a successful response; callers must not pass error strings."""
+        created_at = time.time()
+        payload = json.dumps({"response": response, "created_at": created_at, "latency_ms": latency_ms})
+        size = len(payload.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not store {self.name} {key[:12]} in cache: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][0]
+            self._entries[key] = (size, created_at, latency_ms)
+            self._entries.move_to_end(key)
+            self._total_bytes += size
+            self._remember(key, response)
+            self.counters["stores"] += 1
+            while self._total_bytes > self.max_bytes and self._entries:
+                self._drop(next(iter(self._entries)))
+                self.counters["evictions"] += 1
+
+    def _remember(self, key: str, response: str):
+        self._memory[key] = response
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _drop(self, key: str):
+        size, _, _ = self._entries.pop(key)
+        self._memory.pop(key, None)
+        self._total_bytes -= size
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_ratio": round(self.counters["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "memory_entries": len(self._memory),
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(config) -> ResponseCache:
+    """Returns the process-wide response cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(config.AI_CACHE_DIR, config.AI_CACHE_MAX_MB * 1024 * 1024,
+                                   config.AI_CACHE_TTL_SECONDS, config.AI_CACHE_MEMORY_ENTRIES)
+        return _cache
@@ -1,8 +1,13 @@
 import google.generativeai as genai
 import os
+import time
+import itertools
+import threading
 import traceback
 import logging
 
+from core import ai_cache, ai_gateway, analyzer, instrumentation
+
 logger = logging.getLogger(__name__)
 
 # Common safety settings
@@ -19,102 +24,463 @@ GENERATION_CONFIG = genai.types.GenerationConfig(
     # max_output_tokens=1024, # Limit output length
 )
 
+# Use a capable model, e.g., 1.5 flash or pro
+MODEL_NAME = 'gemini-1.5-flash'
+
+_model = None
+_model_api_key = None
+_model_lock = threading.Lock()
+
+
+def _get_model(api_key: str):
+    """Returns the shared GenerativeModel, configuring the client only when the API key changes."""
+    global _model, _model_api_key
+    with _model_lock:
+        if _model is None or _model_api_key != api_key:
+            genai.configure(api_key=api_key)
+            _model = genai.GenerativeModel(
+                MODEL_NAME,
+                safety_settings=SAFETY_SETTINGS,
+                generation_config=GENERATION_CONFIG
+                )
+            _model_api_key = api_key
+        return _model
+
+
+class FenceStripper:
+    """Incremental markdown code-fence remover for model output that arrives in chunks.
+
+    `feed()` returns the text that can be shown so far and `finish()` the remainder. An opening
+    ```lang line is dropped, and everything from the matching closing ``` line on (usually prose
+    the model adds after the code) is discarded. Only a line that might turn into a closing
+    fence, and line breaks that might turn out to be trailing, are held back. Leading and
+    trailing blank lines are trimmed. Text without an opening fence is passed through.
+    """
+
+    FENCE = "```"
+
+    def __init__(self):
+        self._state = "start" # start -> fenced | plain -> done (closing fence seen)
+        self._line = "" # Current, incomplete line
+        self._emitted = 0 # How much of _line has already been returned
+        self._held = "" # Line breaks not yet returned (they may be trailing)
+        self._started = False
+
+    @property
+    def closed(self) -> bool:
+        """True once the closing fence has been seen; later input is discarded."""
+        return self._state == "done"
+
+    def feed(self, text: str) -> str:
+        out = []
+        for i, part in enumerate(text.split("\n")):
+            if i > 0:
+                out.append(self._end_line())
+            self._line += part
+            out.append(self._flush_partial())
+        return "".join(out)
+
+    def finish(self) -> str:
+        line, self._line = self._line, ""
+        if self._state == "done" or line.strip() == "" or (self._state == "start" and line.lstrip().startswith(self.FENCE)):
+            return ""
+        if self._state == "fenced" and line.strip() == self.FENCE:
+            return ""
+        rest = line[self._emitted:] if self._emitted else line.strip()
+        return self._emit(rest.rstrip()) if rest.strip() else ""
+
+    def _emit(self, text: str) -> str:
+        if not self._started:
+            text = text.lstrip()
+        out = (self._held if self._started else "") + text
+        self._held, self._started = "", True
+        return out
+
+    def _may_become_fence(self) -> bool:
+        return self._state == "fenced" and self.FENCE.startswith(self._line.strip())
+
+    def _flush_partial(self) -> str:
+        stripped = self._line.strip()
+        if self._state == "done" or not stripped:
+            return ""
+        if self._state == "start":
+            if self.FENCE.startswith(stripped) or stripped.startswith(self.FENCE):
+                return "" # Wait for the rest of a possible opening fence line
+            self._state = "plain"
+        if self._may_become_fence():
+            return ""
+        text = self._line[self._emitted:]
+        self._emitted = len(self._line)
+        return self._emit(text)
+
+    def _end_line(self) -> str:
+        line, emitted = self._line, self._emitted
+        self._line, self._emitted = "", 0
+        if self._state == "done":
+            return ""
+        if self._state == "start":
+            if line.lstrip().startswith(self.FENCE):
+                self._state = "fenced" # Drop the ```lang line
+                return ""
+            if not line.strip():
+                return "" # Leading blank line
+            self._state = "plain"
+        if self._state == "fenced" and line.strip() == self.FENCE:
+            self._state = "done"
+            return ""
+        out = self._emit(line[emitted:]) if line[emitted:].strip() or emitted else ""
+        if self._started:
+            self._held += "\n"
+        return out
+
+
+def strip_code_fences(text: str) -> str:
+    stripper = FenceStripper()
+    return (stripper.feed(text) + stripper.finish()).strip()
+
+
+def _cache_for(config):
+    return ai_cache.get_cache(config) if config is not None and config.AI_CACHE_ENABLED else None
+
+
+def _cache_key(prompt: str) -> str:
+    return ai_cache.prompt_key(prompt, MODEL_NAME, repr((GENERATION_CONFIG, SAFETY_SETTINGS)))
+
 
-def _call_gemini(prompt: str, api_key: str) -> str:
-    """Internal function to handle the Gemini API call and error parsing."""
+def _count_error(error_class: str):
+    instrumentation.count("gemini_errors_total", {"error_class": error_class})
+
+
+def _gateway_for(config):
+    return ai_gateway.get_gateway(config) if config is not None and config.AI_GATEWAY_ENABLED else None
+
+
+def _call_gemini(prompt: str, api_key: str, config=None, client: str = None) -> str:
+    """Gemini call behind the response cache (core/ai_cache.py) and the AI gateway (core/ai_gateway.py) when `config` enables them.
+
+    Only successful responses are cached; "Error: ..." strings never are. Through the gateway, the
+    call is admitted against `client`'s and the global rate limits, raising ai_gateway.Rejected if
+    it is not, and identical prompts already in flight share that call. Stages are timed under
+    the "gemini" operation (core/instrumentation.py).
+    """
+    timings = instrumentation.Timings("gemini", {"mode": "blocking"})
+    outcome = "error"
+    try:
+        cache = _cache_for(config)
+        key = _cache_key(prompt)
+        if cache:
+            with timings.span("cache_lookup"):
+                cached = cache.get(key)
+            if cached is not None:
+                logger.info(f"AI response cache hit (key {key[:12]}).")
+                outcome = "cache_hit"
+                return cached
+
+        gateway = _gateway_for(config)
+        produce = lambda stop=None: _produce_blocking(prompt, api_key, gateway, cache, key, timings)
+        events = gateway.run(key, client, produce) if gateway else produce()
+        try:
+            for event, payload in events:
+                if event in ("done", "error"): # A streaming leader's deltas are skipped
+                    outcome = "ok" if event == "done" else "error"
+                    return payload
+        except ai_gateway.Rejected:
+            outcome = "rejected"
+            raise
+        finally:
+            events.close()
+        return "Error: The AI model returned no response."
+    finally:
+        instrumentation.count("gemini_requests_total", {"mode": "blocking", "outcome": outcome})
+        timings.finish()
+
+
+def _produce_blocking(prompt: str, api_key: str, gateway, cache, key: str, timings):
+    """One non-streaming model call as events: ("done", text) or ("error", "Error: ...")."""
+    start_time = time.monotonic()
+    with timings.span("request"):
+        response_text = _request_gemini(prompt, api_key, gateway)
+    if response_text.startswith("Error:"):
+        yield "error", response_text
+        return
+    if cache:
+        with timings.span("cache_store"):
+            cache.put(key, response_text, round((time.monotonic() - start_time) * 1000))
+    yield "done", response_text
+
+
+def _block_reason(response, default: str) -> str:
     try:
-        genai.configure(api_key=api_key)
-        # Use a capable model, e.g., 1.5 flash or pro
-        model = genai.GenerativeModel(
-            'gemini-1.5-flash',
-            safety_settings=SAFETY_SETTINGS,
-            generation_config=GENERATION_CONFIG
-            )
+        if response.prompt_feedback and response.prompt_feedback.block_reason:
+            return response.prompt_feedback.block_reason.name
+    except Exception: pass # Ignore errors checking block reason
+    return default
+
+
+def _api_error_message(e: Exception) -> str:
+    error_message = f"Error: Failed to communicate with the AI model. Details: {type(e).__name__}"
+    # More specific error messages
+    err_str = str(e).lower()
+    if "api key not valid" in err_str or "permission_denied" in err_str:
+        error_message = "Error: Invalid or missing Gemini API Key configured on the server."
+    elif "quota" in err_str or "resource_exhausted" in err_str:
+         error_message = "Error: API quota exceeded for the AI model."
+    elif "deadlineexceeded" in err_str:
+         error_message = "Error: Request to AI model timed out."
+    elif "invalid argument" in err_str:
+         error_message = f"Error: Invalid argument sent to AI model (check prompt/config). Details: {e}"
+    return error_message
+
+
+def _request_gemini(prompt: str, api_key: str, gateway=None) -> str:
+    """Internal function to handle the Gemini API call and error parsing. `gateway` retries quota and deadline errors."""
+    try:
+        model = _get_model(api_key)
 
         logger.info(f"Sending prompt to Gemini (first 80 chars): {prompt[:80]}...")
-        response = model.generate_content(prompt)
+        response = gateway.call(lambda: model.generate_content(prompt)) if gateway else model.generate_content(prompt)
 
         # Enhanced response checking
         if not response.candidates:
-             block_reason = "Unknown reason"
-             try:
-                 if response.prompt_feedback and response.prompt_feedback.block_reason:
-                     block_reason = response.prompt_feedback.block_reason.name
-             except Exception: pass # Ignore errors checking block reason
+             block_reason = _block_reason(response, "Unknown reason")
              logger.warning(f"Gemini response blocked or empty. Reason: {block_reason}")
+             _count_error("blocked")
              return f"Error: Code generation failed. The response was blocked (Reason: {block_reason}). Please modify your prompt or code."
 
         # Extract text safely
         try:
-            generated_text = response.text
             # Basic cleaning: remove markdown code fences if present
-            if generated_text.strip().startswith("```") and generated_text.strip().endswith("```"):
-                 lines = generated_text.strip().splitlines()
-                 if len(lines) > 1:
-                    # Check if first line is language hint (e.g., ```python)
-                    if lines[0].strip() == f"```{lines[0].strip().split('```')[1]}":
-                         generated_text = "\n".join(lines[1:-1])
-                    else:
-                          generated_text = "\n".join(lines[1:-1]) # Assume simple fences
-                 else: # Only fences, return empty
-                      generated_text = ""
-
+            generated_text = strip_code_fences(response.text)
             logger.info("Successfully received response from Gemini.")
-            return generated_text.strip()
+            return generated_text
 
         except ValueError as ve: # Often indicates blocked content in response parts
-            block_reason = "Content filtering or generation issue"
-            try:
-                if response.prompt_feedback and response.prompt_feedback.block_reason:
-                    block_reason = response.prompt_feedback.block_reason.name
-            except Exception: pass
+            block_reason = _block_reason(response, "Content filtering or generation issue")
             logger.warning(f"ValueError extracting Gemini text. Block reason: {block_reason}. Full response parts likely blocked.")
+            _count_error("blocked_content")
             return f"Error: Failed to extract generated text. Response may have been blocked (Reason: {block_reason})."
         except Exception as text_extract_err:
              logger.error(f"Error extracting text from Gemini response: {text_extract_err}", exc_info=True)
+             _count_error("response_parse")
              return f"Error: Could not process the response from the AI model. Details: {text_extract_err}"
 
     except Exception as e:
         logger.error(f"Gemini API Error: {e}", exc_info=True)
-        error_message = f"Error: Failed to communicate with the AI model. Details: {type(e).__name__}"
-        # More specific error messages
-        err_str = str(e).lower()
-        if "api key not valid" in err_str or "permission_denied" in err_str:
-            error_message = "Error: Invalid or missing Gemini API Key configured on the server."
-        elif "quota" in err_str or "resource_exhausted" in err_str:
-             error_message = "Error: API quota exceeded for the AI model."
-        elif "deadlineexceeded" in err_str:
-             error_message = "Error: Request to AI model timed out."
-        elif "invalid argument" in err_str:
-             error_message = f"Error: Invalid argument sent to AI model (check prompt/config). Details: {e}"
-
-        return error_message
-
-
-def generate_via_gemini(prompt: str, language: str, api_key: str) -> str:
-    """Generates code based on a natural language prompt."""
+        _count_error(type(e).__name__)
+        return _api_error_message(e)
+
+
+def _stream_gemini(prompt: str, api_key: str, config=None, cancelled=None, client: str = None):
+    """Streaming counterpart of _call_gemini. Yields ("delta", text) as fence-stripped code arrives,
+    then ("done", full_text) or ("error", "Error: ...").
+
+    `cancelled` is an optional callable; once it returns True (or the consumer closes this
+    generator) the model stream is abandoned and nothing is cached, unless identical requests
+    coalesced through the gateway are still reading it. Cache hits are replayed as a single
+    delta, and so is the result of a coalesced non-streaming call. A call the gateway does not
+    admit ends in ("error", ...). Stages, including the time to the first chunk, are timed under "gemini".
+    """
+    timings = instrumentation.Timings("gemini", {"mode": "stream"})
+    outcome = "cancelled" # Unless the stream reaches one of the outcomes below
+    try:
+        cache = _cache_for(config)
+        key = _cache_key(prompt)
+        with timings.span("cache_lookup"):
+            cached = cache.get(key) if cache else None
+        if cached is not None:
+            logger.info(f"AI response cache hit (key {key[:12]}).")
+            outcome = "cache_hit"
+            yield "delta", cached
+            yield "done", cached
+            return
+
+        gateway = _gateway_for(config)
+        if gateway:
+            events = gateway.run(key, client, lambda stop: _produce_stream(prompt, api_key, gateway, cache, key, timings, stop))
+        else:
+            events = _produce_stream(prompt, api_key, None, cache, key, timings, cancelled)
+        streamed = False
+        try:
+            for event, payload in events:
+                if cancelled and cancelled():
+                    logger.info("AI stream cancelled by the client.")
+                    return
+                if event == "done" and not streamed:
+                    yield "delta", payload
+                outcome = {"done": "ok", "error": "error"}.get(event, outcome)
+                streamed = streamed or event == "delta"
+                yield event, payload
+        except ai_gateway.Rejected as e:
+            outcome = "rejected"
+            yield "error", f"Error: {e} Please retry in {e.retry_after}s."
+        finally:
+            events.close()
+    finally:
+        instrumentation.count("gemini_requests_total", {"mode": "stream", "outcome": outcome})
+        timings.finish()
+
+
+def _open_stream(model, prompt: str):
+    """Starts a streaming request and waits for its first chunk, so that errors starting it (quota, deadline) can be retried.
+
+    Returns (response, chunks), `chunks` including the first one.
+    """
+    response = model.generate_content(prompt, stream=True)
+    chunks = iter(response)
+    first = next(chunks, None)
+    return response, itertools.chain([] if first is None else [first], chunks)
+
+
+def _produce_stream(prompt: str, api_key: str, gateway, cache, key: str, timings, stop=None):
+    """One streaming model call as _stream_gemini's events; gives up without a result once `stop()` returns True."""
+    start_time = time.monotonic()
+    stripper = FenceStripper()
+    parts = []
+    first_chunk = True
+    try:
+        model = _get_model(api_key)
+        logger.info(f"Streaming prompt to Gemini (first 80 chars): {prompt[:80]}...")
+        response, chunks = gateway.call(lambda: _open_stream(model, prompt), stop) if gateway else _open_stream(model, prompt)
+        for chunk in chunks:
+            if first_chunk:
+                timings.record("first_chunk", time.monotonic() - start_time)
+                first_chunk = False
+            if stop and stop():
+                logger.info("AI stream abandoned: nobody is reading it any more.")
+                return
+            if not chunk.candidates:
+                block_reason = _block_reason(response, "Unknown reason")
+                logger.warning(f"Gemini stream blocked. Reason: {block_reason}")
+                _count_error("blocked")
+                yield "error", f"Error: Code generation failed. The response was blocked (Reason: {block_reason}). Please modify your prompt or code."
+                return
+            try:
+                text = stripper.feed(chunk.text)
+            except ValueError: # Chunk without text parts, e.g. blocked mid-stream
+                block_reason = _block_reason(response, "Content filtering or generation issue")
+                _count_error("blocked_content")
+                yield "error", f"Error: Failed to extract generated text. Response may have been blocked (Reason: {block_reason})."
+                return
+            if text:
+                parts.append(text)
+                yield "delta", text
+            if stripper.closed:
+                break # Only prose follows the closing fence
+    except Exception as e:
+        logger.error(f"Gemini API Error: {e}", exc_info=True)
+        if gateway and not first_chunk: # Failures before the first chunk were already reported by gateway.call()
+            gateway.report(e)
+        _count_error(type(e).__name__)
+        yield "error", _api_error_message(e)
+        return
+    finally:
+        timings.record("stream", time.monotonic() - start_time)
+
+    tail = stripper.finish()
+    if tail:
+        parts.append(tail)
+        yield "delta", tail
+    generated_text = "".join(parts).strip()
+    logger.info("Successfully streamed response from Gemini.")
+    if cache:
+        with timings.span("cache_store"):
+            cache.put(key, generated_text, round((time.monotonic() - start_time) * 1000))
+    yield "done", generated_text
+
+
+def _generate_prompt(prompt: str, language: str) -> str:
+    return f"Generate a code snippet in {language.capitalize()} for the following task. Provide only the raw code, without any introduction, explanation, or markdown formatting unless the code itself requires comments.\n\nTask: {prompt}"
+
+
+def _optimize_prompt(code: str, language: str, hints: str = "") -> str:
+    if hints:
+        hints = f"\nA static analysis flagged these likely hotspots; address them first where it is safe to do so:\n{hints}\n"
+    return f"""Analyze the following {language.capitalize()} code and provide an optimized version. Focus on improving performance (speed) and potentially memory efficiency where applicable, without changing the core functionality or output for standard inputs.
+{hints}
+Provide *only* the optimized code, without any introduction, explanation of changes, or markdown formatting. If the code is already reasonably optimized or cannot be significantly improved without changing functionality, return the original code.
+{code}
+"""
+
+
+def _refine_prompt(code: str, language: str, feedback: str, strategy: str = "") -> str:
+    return f"""The following {language.capitalize()} code is being optimized for speed. Every version is run and benchmarked in a sandbox; this is what was measured so far:
+{feedback}
+
+Write a faster version of the code below that prints exactly the same output for the same input. {strategy}
+Provide *only* the code, without any introduction, explanation of changes, or markdown formatting.
+{code}
+"""
+
+
+def _optimization_hints(code: str, language: str, config, analysis=None) -> str:
+    """Static analyzer findings for the optimize prompt; empty without `config` or with the analyzer off."""
+    if config is None:
+        return ""
+    if analysis is None:
+        analysis = analyzer.analyze_submission(code, language, config)
+    return analyzer.format_hints(analysis, config.ANALYZER_PROMPT_HINTS) if analysis else ""
+
+
+def generate_via_gemini(prompt: str, language: str, api_key: str, config=None, client: str = None) -> str:
+    """Generates code based on a natural language prompt.
+
+    Raises ai_gateway.Rejected if the gateway does not admit the call for `client`.
+    """
     if not api_key:
         logger.warning("generate_via_gemini called without API key.")
         return "Error: Gemini API key is not configured on the server."
     if not prompt:
         return "Error: Prompt cannot be empty."
 
-    full_prompt = f"Generate a code snippet in {language.capitalize()} for the following task. Provide only the raw code, without any introduction, explanation, or markdown formatting unless the code itself requires comments.\n\nTask: {prompt}"
+    return _call_gemini(_generate_prompt(prompt, language), api_key, config, client)
 
-    return _call_gemini(full_prompt, api_key)
 
+def optimize_via_gemini(code: str, language: str, api_key: str, config=None, analysis=None, client: str = None) -> str:
+    """Attempts to optimize the given code using Gemini.
 
-def optimize_via_gemini(code: str, language: str, api_key: str) -> str:
-    """Attempts to optimize the given code using Gemini."""
+    Findings from the static analyzer (`analysis`, computed here if not given) are added to the
+    prompt as targeted hints. Raises ai_gateway.Rejected if the gateway does not admit the call for `client`.
+    """
     if not api_key:
         logger.warning("optimize_via_gemini called without API key.")
         return "Error: Gemini API key is not configured on the server."
     if not code:
         return "Error: Cannot optimize empty code."
 
-    full_prompt = f"""Analyze the following {language.capitalize()} code and provide an optimized version. Focus on improving performance (speed) and potentially memory efficiency where applicable, without changing the core functionality or output for standard inputs.
+    return _call_gemini(_optimize_prompt(code, language, _optimization_hints(code, language, config, analysis)), api_key, config, client)
 
-Provide *only* the optimized code, without any introduction, explanation of changes, or markdown formatting. If the code is already reasonably optimized or cannot be significantly improved without changing functionality, return the original code.
-{code}
-"""
-    return _call_gemini(full_prompt, api_key)
\ No newline at end of file
+
+def refine_via_gemini(code: str, language: str, api_key: str, feedback: str, strategy: str = "", config=None, client: str = None) -> str:
+    """Asks Gemini for a faster version of `code`, given `feedback` on measured earlier versions (see optimizer.search_optimizations).
+
+    `strategy` steers the attempt, so parallel requests for the same code explore different rewrites.
+    Raises ai_gateway.Rejected if the gateway does not admit the call for `client`.
+    """
+    if not api_key:
+        logger.warning("refine_via_gemini called without API key.")
+        return "Error: Gemini API key is not configured on the server."
+    if not code:
+        return "Error: Cannot optimize empty code."
+
+    return _call_gemini(_refine_prompt(code, language, feedback, strategy), api_key, config, client)
+
+
+def generate_stream(prompt: str, language: str, api_key: str, config=None, cancelled=None, client: str = None):
+    """Streaming generate_via_gemini; yields the events described in _stream_gemini."""
+    if not api_key:
+        yield "error", "Error: Gemini API key is not configured on the server."
+    elif not prompt:
+        yield "error", "Error: Prompt cannot be empty."
+    else:
+        yield from _stream_gemini(_generate_prompt(prompt, language), api_key, config, cancelled, client)
+
+
+def optimize_stream(code: str, language: str, api_key: str, config=None, cancelled=None, analysis=None, client: str = None):
+    """Streaming optimize_via_gemini; yields the events described in _stream_gemini."""
+    if not api_key:
+        yield "error", "Error: Gemini API key is not configured on the server."
+    elif not code:
+        yield "error", "Error: Cannot optimize empty code."
+    else:
+        hints = _optimization_hints(code, language, config, analysis)
+        yield from _stream_gemini(_optimize_prompt(code, language, hints), api_key, config, cancelled, client)
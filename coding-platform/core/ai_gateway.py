@@ -0,0 +1,332 @@
+import math
+import time
+import random
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# google.api_core exception classes worth retrying: quota (429) and deadline (504) errors
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "DeadlineExceeded", "GatewayTimeout"}
+# Errors that say the upstream itself is unhealthy, as opposed to a bad request or API key
+UPSTREAM_ERRORS = RETRYABLE_ERRORS | {"ServiceUnavailable", "InternalServerError", "BadGateway", "Unknown"}
+MAX_CLIENTS = 10000 # Per-client buckets kept; the least recently seen are dropped first
+
+
+def is_retryable(e: Exception) -> bool:
+    err_str = str(e).lower()
+    return type(e).__name__ in RETRYABLE_ERRORS or "resource_exhausted" in err_str or "deadline" in err_str
+
+
+def is_upstream_failure(e: Exception) -> bool:
+    return is_retryable(e) or type(e).__name__ in UPSTREAM_ERRORS or isinstance(e, (ConnectionError, TimeoutError))
+
+
+class Rejected(Exception):
+    """Raised when a model call is not admitted: `status` 429 (rate limit, no free slot) or 503 (circuit open)."""
+
+    def __init__(self, message: str, retry_after: float, status: int = 429):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status = status
+
+
+class TokenBucket:
+    """`per_minute` tokens a minute, up to `burst` saved up. Not thread-safe: the gateway holds its lock."""
+
+    def __init__(self, per_minute: float, burst: int):
+        self.rate = per_minute / 60
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """Takes a token and returns 0, or returns the seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def refund(self):
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+
+class CircuitBreaker:
+    """Fails calls fast while the upstream is unhealthy.
+
+    Closed until `threshold` consecutive upstream failures, then open for `reset_seconds`. After
+    that a single trial call is let through (half-open): its success closes the breaker, its
+    failure opens it again, and if it never reports back another trial is allowed after
+    `reset_seconds`. Not thread-safe: the gateway holds its lock.
+    """
+
+    def __init__(self, threshold: int, reset_seconds: float):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed" # closed | open | half_open
+        self.failures = 0
+        self.opened_at = 0.0 # When the breaker opened, or when the current trial call started
+        self.opens = 0
+
+    def retry_after(self) -> float:
+        """Seconds until a call may be tried, 0 if one may be tried now."""
+        if self.state == "closed":
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Like `retry_after() == 0`, but a breaker past its reset time hands out its one trial call."""
+        if self.retry_after() > 0:
+            return False
+        if self.state != "closed":
+            self.state, self.opened_at = "half_open", time.monotonic()
+        return True
+
+    def record(self, ok: bool):
+        if ok:
+            self.state, self.failures = "closed", 0
+            return
+        self.failures += 1
+        if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+            self.state, self.opened_at = "open", time.monotonic()
+            self.opens += 1
+            logger.warning(f"AI circuit breaker opened after {self.failures} consecutive upstream failures.")
+
+
+class Flight:
+    """One model call in progress: its (event, payload) pairs so far, replayed to every caller following it."""
+
+    def __init__(self):
+        self.events = []
+        self.finished = False
+        self.consumers = 0 # Callers still reading; the producer gives up when this drops to 0
+        self.cond = threading.Condition()
+
+    def publish(self, event: str, payload):
+        with self.cond:
+            self.events.append((event, payload))
+            self.cond.notify_all()
+
+    def finish(self):
+        with self.cond:
+            self.finished = True
+            self.cond.notify_all()
+
+    def follow(self):
+        """Yields every event, waiting for new ones until the flight finishes."""
+        seen = 0
+        while True:
+            with self.cond:
+                while seen == len(self.events) and not self.finished:
+                    self.cond.wait()
+                pending, finished = self.events[seen:], self.finished
+            seen += len(pending)
+            yield from pending
+            if finished and seen == len(self.events):
+                return
+
+
+class AIGateway:
+    """Admission control and coalescing in front of the model (used by core/ai_coder.py).
+
+    A call is admitted once it gets a token from its client's bucket (AI_CLIENT_RATE_LIMIT_*,
+    rejected at once when empty), a token from the global bucket matched to the model quota
+    (AI_RATE_LIMIT_*) and one of AI_MAX_CONCURRENCY slots, waiting at most
+    AI_ADMISSION_TIMEOUT_SECONDS for the latter two, and only while the circuit breaker lets
+    calls through. Identical calls (same prompt key) arriving while one is in flight follow its
+    events instead of being admitted themselves. `call()` retries quota and deadline errors with
+    full-jitter exponential backoff and feeds the breaker.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.global_bucket = TokenBucket(config.AI_RATE_LIMIT_RPM, config.AI_RATE_LIMIT_BURST)
+        self.breaker = CircuitBreaker(config.AI_BREAKER_FAILURES, config.AI_BREAKER_RESET_SECONDS)
+        self._client_buckets = OrderedDict() # client -> TokenBucket, least recently seen first
+        self._slots = threading.BoundedSemaphore(config.AI_MAX_CONCURRENCY)
+        self._flights = {} # key -> Flight
+        self._lock = threading.Lock()
+        self.counters = {"admitted": 0, "coalesced": 0, "retries": 0, "rejected_client": 0, "rejected_quota": 0,
+                         "rejected_busy": 0, "rejected_open": 0}
+
+    # --- Admission ---
+
+    def _client_bucket(self, client: str) -> TokenBucket:
+        bucket = self._client_buckets.get(client)
+        if bucket is None:
+            bucket = self._client_buckets[client] = TokenBucket(self.config.AI_CLIENT_RATE_LIMIT_RPM, self.config.AI_CLIENT_RATE_LIMIT_BURST)
+            if len(self._client_buckets) > MAX_CLIENTS:
+                self._client_buckets.popitem(last=False)
+        self._client_buckets.move_to_end(client)
+        return bucket
+
+    def _reject(self, counter: str, message: str, retry_after: float, status: int = 429):
+        with self._lock:
+            self.counters[counter] += 1
+        logger.warning(f"AI call rejected: {message} (retry after {retry_after:.1f}s)")
+        raise Rejected(message, retry_after, status)
+
+    def _take_global_token(self, deadline: float) -> float:
+        """Waits for a global token until `deadline`. Returns 0 once taken, else the seconds still missing."""
+        while True:
+            with self._lock:
+                wait = self.global_bucket.take()
+            if not wait:
+                return 0.0
+            if time.monotonic() + wait > deadline:
+                return wait
+            time.sleep(wait)
+
+    def admit(self, client: str = None):
+        """Takes the tokens and concurrency slot for one call, or raises Rejected. Pair with `release()`."""
+        deadline = time.monotonic() + self.config.AI_ADMISSION_TIMEOUT_SECONDS
+        with self._lock:
+            open_for = self.breaker.retry_after()
+        if open_for:
+            self._reject("rejected_open", "The AI model is temporarily unavailable.", open_for, 503)
+        client_bucket = None
+        if client is not None:
+            with self._lock:
+                client_bucket = self._client_bucket(client)
+                wait = client_bucket.take()
+            if wait:
+                self._reject("rejected_client", "Too many AI requests from this client.", wait)
+
+        def refund():
+            if client_bucket is not None:
+                with self._lock:
+                    client_bucket.refund()
+
+        wait = self._take_global_token(deadline)
+        if wait:
+            refund()
+            self._reject("rejected_quota", "The AI request quota is used up for now.", wait)
+        if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            refund()
+            with self._lock:
+                self.global_bucket.refund()
+            self._reject("rejected_busy", "Too many AI requests are in progress.", 1)
+        with self._lock:
+            allowed = self.breaker.allow() # Claims the half-open trial, if that is where the breaker is
+            open_for = self.breaker.retry_after()
+        if not allowed:
+            self._slots.release()
+            refund()
+            self._reject("rejected_open", "The AI model is temporarily unavailable.", open_for, 503)
+        with self._lock:
+            self.counters["admitted"] += 1
+
+    def release(self):
+        self._slots.release()
+
+    # --- Calls ---
+
+    def call(self, fn, stop=None):
+        """Returns fn(), retrying quota and deadline errors up to AI_RETRY_ATTEMPTS times in all.
+
+        Retries wait a random delay of up to AI_RETRY_BASE_MS * 2^retry (at most AI_RETRY_MAX_MS) and
+        take a global token each; they stop early if the breaker opens or `stop()` turns True.
+        """
+        attempt = 0
+        while True:
+            try:
+                result = fn()
+            except Exception as e:
+                self.report(e)
+                attempt += 1
+                with self._lock:
+                    breaker_open = self.breaker.state == "open"
+                if not is_retryable(e) or attempt >= self.config.AI_RETRY_ATTEMPTS or breaker_open or (stop and stop()):
+                    raise
+                delay = random.uniform(0, min(self.config.AI_RETRY_MAX_MS, self.config.AI_RETRY_BASE_MS * 2 ** (attempt - 1))) / 1000
+                logger.warning(f"Retrying AI call in {delay:.2f}s (attempt {attempt + 1}/{self.config.AI_RETRY_ATTEMPTS}) after: {e}")
+                with self._lock:
+                    self.counters["retries"] += 1
+                time.sleep(delay)
+                if self._take_global_token(time.monotonic() + self.config.AI_ADMISSION_TIMEOUT_SECONDS):
+                    raise
+                continue
+            with self._lock:
+                self.breaker.record(True)
+            return result
+
+    def report(self, e: Exception):
+        """Feeds an error from the model into the breaker: only upstream failures count against it."""
+        with self._lock:
+            self.breaker.record(not is_upstream_failure(e))
+
+    def run(self, key: str, client: str, produce):
+        """Yields the (event, payload) pairs of the call identified by `key` (the prompt's cache key).
+
+        The first caller for a key leads: it is admitted (raising Rejected) and `produce(stop)` runs
+        on a background thread, publishing its events. Callers with the same key arriving meanwhile
+        follow those events instead. `stop()` turns True once every caller has stopped reading, and
+        the producer should then give up. If the leader is rejected, its followers start over.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+                else:
+                    self.counters["coalesced"] += 1
+            with flight.cond:
+                flight.consumers += 1
+            try:
+                if leader:
+                    try:
+                        self.admit(client)
+                    except Rejected:
+                        self._land(key, flight)
+                        raise
+                    threading.Thread(target=self._produce, args=(key, flight, produce), name="ai-gateway", daemon=True).start()
+                completed = False
+                for event, payload in flight.follow():
+                    completed = event in ("done", "error")
+                    yield event, payload
+                if completed or leader:
+                    return
+            finally:
+                with flight.cond:
+                    flight.consumers -= 1
+
+    def _produce(self, key: str, flight: Flight, produce):
+        try:
+            for event, payload in produce(lambda: flight.consumers == 0):
+                flight.publish(event, payload)
+        except Exception as e:
+            logger.error(f"AI call failed: {e}", exc_info=True)
+            flight.publish("error", f"Error: Failed to communicate with the AI model. Details: {type(e).__name__}")
+        finally:
+            self.release()
+            self._land(key, flight)
+
+    def _land(self, key: str, flight: Flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "in_flight": len(self._flights), "breaker_state": self.breaker.state,
+                    "breaker_open": self.breaker.state != "closed", "breaker_opens": self.breaker.opens,
+                    "global_tokens": round(self.global_bucket.tokens, 2), "clients": len(self._client_buckets)}
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway(config) -> AIGateway:
+    """Returns the process-wide gateway, creating it on first use."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = AIGateway(config)
+        return _gateway
@@ -0,0 +1,547 @@
+import re
+import ast
+import time
+import bisect
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+SEVERITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+
+CACHE_DECORATORS = {"cache", "lru_cache", "cached", "memoize", "memoized"}
+MEMO_NAME = re.compile(r"memo|cache|dp|seen|visited", re.IGNORECASE) # Names suggesting a recursion is already memoized
+
+NESTED_LOOP_MESSAGE = ("Nested loop over `{}` inside another loop over it: O(n^2) or worse. "
+                       "Consider a hash map/set lookup, sorting, or a single pass.")
+RECURSION_MESSAGE = ("`{}` calls itself {} times without memoization, which can recompute the same subproblems "
+                     "exponentially often. {}")
+
+
+def _finding(rule: str, severity: str, line: int, column: int, loop_depth: int, message: str) -> dict:
+    return {"rule": rule, "severity": severity, "line": line, "column": column, "loop_depth": loop_depth, "message": message}
+
+
+# --- Python -----------------------------------------------------------------
+
+def _call_name(call: ast.Call):
+    if isinstance(call.func, ast.Name):
+        return call.func.id
+    if isinstance(call.func, ast.Attribute):
+        return call.func.attr
+    return None
+
+
+def _value_kind(value):
+    """"list" or "str" if an assigned value is obviously one, else None."""
+    if isinstance(value, (ast.List, ast.ListComp)):
+        return "list"
+    if isinstance(value, ast.JoinedStr) or (isinstance(value, ast.Constant) and isinstance(value.value, str)):
+        return "str"
+    if isinstance(value, ast.Call) and isinstance(value.func, ast.Name) and value.func.id in ("list", "str"):
+        return value.func.id
+    return None
+
+
+def _iterated_collection(node):
+    """Name of the collection a loop walks: `x` for `in x`, `range(len(x))`, `enumerate(x)`, `x.items()`, ..."""
+    while isinstance(node, ast.Call):
+        name = _call_name(node)
+        if isinstance(node.func, ast.Attribute) and name in ("items", "keys", "values"):
+            node = node.func.value
+        elif name in ("range", "len", "enumerate", "reversed", "sorted", "iter") and node.args:
+            node = node.args[-1] if name == "range" else node.args[0]
+        else:
+            return None
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+        return f"{node.value.id}.{node.attr}"
+    return None
+
+
+class _PythonAnalyzer:
+    """One walk over the AST, in source order.
+
+    Variable kinds ("list"/"str") are learned from assignments as they are passed, so a name counts
+    as a list once it was assigned one and never anything else. Dispatch is cached per node type
+    because ast.NodeVisitor's getattr-per-node dominates on large inputs.
+    """
+
+    def __init__(self):
+        self.kinds = {} # name -> "list", "str" or None once assignments disagree
+        self.loops = [] # (collection name or None, Counter of len() calls) per enclosing loop
+        self.functions = [] # (name, Counter of calls by name) per enclosing def
+        self.findings = []
+        self.max_loop_depth = 0
+        self._dispatch = {}
+
+    def add(self, rule, severity, node, message, loop_depth=None):
+        depth = len(self.loops) if loop_depth is None else loop_depth
+        self.findings.append(_finding(rule, severity, node.lineno, node.col_offset + 1, depth, message))
+
+    def visit(self, node):
+        method = self._dispatch.get(type(node))
+        if method is None:
+            method = getattr(self, f"visit_{type(node).__name__}", self.generic_visit)
+            self._dispatch[type(node)] = method
+        method(node)
+
+    def generic_visit(self, node):
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(item, ast.AST):
+                        self.visit(item)
+            elif isinstance(value, ast.AST):
+                self.visit(value)
+
+    def _enter_loop(self, node, iterable):
+        collection = _iterated_collection(iterable) if iterable is not None else None
+        if collection and any(outer == collection for outer, _ in self.loops):
+            self.add("nested-loop-same-collection", "high", node, NESTED_LOOP_MESSAGE.format(collection), len(self.loops) + 1)
+        self.loops.append((collection, Counter()))
+        self.max_loop_depth = max(self.max_loop_depth, len(self.loops))
+
+    def _loop(self, node, iterable, body_nodes):
+        self._enter_loop(node, iterable)
+        for child in body_nodes:
+            self.visit(child)
+        _, lens = self.loops[-1]
+        for name, count in lens.items():
+            if count > 1:
+                self.add("repeated-len", "low", node, f"`len({name})` is evaluated {count} times per iteration; compute it once outside the loop.")
+        self.loops.pop()
+
+    def visit_For(self, node):
+        self.visit(node.iter) # Evaluated once, outside the loop
+        self._loop(node, node.iter, [node.target, *node.body])
+        for child in node.orelse:
+            self.visit(child)
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node):
+        self._loop(node, None, [node.test, *node.body])
+        for child in node.orelse:
+            self.visit(child)
+
+    def _comprehension(self, node):
+        depth = len(self.loops)
+        for generator in node.generators:
+            self.visit(generator.iter)
+            self._enter_loop(generator.iter, generator.iter)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for child in (node.key, node.value) if isinstance(node, ast.DictComp) else (node.elt,):
+            self.visit(child)
+        del self.loops[depth:]
+
+    visit_ListComp = visit_SetComp = visit_GeneratorExp = visit_DictComp = _comprehension
+
+    def visit_FunctionDef(self, node):
+        for child in node.decorator_list + node.args.defaults + node.args.kw_defaults:
+            if child is not None:
+                self.visit(child)
+        outer_loops, self.loops = self.loops, [] # The body runs when called, not per iteration of enclosing loops
+        self.functions.append((node.name, Counter()))
+        for child in node.body:
+            self.visit(child)
+        _, calls = self.functions.pop()
+        self.loops = outer_loops
+        decorators = {_call_name(d) if isinstance(d, ast.Call) else getattr(d, "attr", getattr(d, "id", None)) for d in node.decorator_list}
+        params = [arg.arg for arg in node.args.args + node.args.kwonlyargs]
+        if calls[node.name] > 1 and not decorators & CACHE_DECORATORS and not any(MEMO_NAME.search(p) for p in params):
+            self.add("recursion-without-memoization", "high", node,
+                     RECURSION_MESSAGE.format(node.name, calls[node.name], "Consider functools.lru_cache or a bottom-up table."))
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def _remember_kind(self, target, value):
+        if isinstance(target, ast.Name):
+            kind = _value_kind(value)
+            self.kinds[target.id] = kind if self.kinds.get(target.id, kind) == kind else None
+
+    def visit_Assign(self, node):
+        value = node.value
+        if self.loops and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name) and isinstance(value, ast.BinOp) \
+                and isinstance(value.op, ast.Add) and isinstance(value.left, ast.Name) and value.left.id == node.targets[0].id:
+            self._concat(node, value.left.id, value.right)
+        self.generic_visit(node)
+        for target in node.targets:
+            self._remember_kind(target, value)
+
+    def visit_AnnAssign(self, node):
+        self.generic_visit(node)
+        if node.value is not None:
+            self._remember_kind(node.target, node.value)
+
+    def visit_AugAssign(self, node):
+        if self.loops and isinstance(node.op, ast.Add) and isinstance(node.target, ast.Name) and self.kinds.get(node.target.id) != "list":
+            self._concat(node, node.target.id, node.value)
+        self.generic_visit(node)
+
+    def _concat(self, node, name, value):
+        kind = self.kinds.get(name)
+        if kind is None and isinstance(value, (ast.JoinedStr, ast.Constant)) and isinstance(getattr(value, "value", ""), str):
+            kind = "str"
+        if kind:
+            fix = "collect the parts in a list and ''.join() them" if kind == "str" else "use append()/extend()"
+            self.add("concat-in-loop", "medium", node, f"Building `{name}` with + in a loop copies it every time; {fix}.")
+
+    def visit_Compare(self, node):
+        if self.loops:
+            for op, comparator in zip(node.ops, node.comparators):
+                if isinstance(op, (ast.In, ast.NotIn)) and isinstance(comparator, ast.Name) and self.kinds.get(comparator.id) == "list":
+                    self.add("list-membership-in-loop", "medium", node,
+                             f"`in {comparator.id}` scans the list on every iteration; use a set for membership tests.")
+        self.generic_visit(node)
+
+    def visit_Call(self, node):
+        name = _call_name(node)
+        if self.functions and isinstance(node.func, ast.Name):
+            self.functions[-1][1][name] += 1
+        if self.loops:
+            owner = node.func.value.id if isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name) else None
+            first_arg_zero = bool(node.args) and isinstance(node.args[0], ast.Constant) and node.args[0].value == 0
+            if owner and self.kinds.get(owner) == "list" and (name in ("index", "count", "remove")
+                                                             or (name in ("insert", "pop") and first_arg_zero)):
+                self.add("linear-list-op-in-loop", "medium", node,
+                         f"`{owner}.{name}()` is O(n) and runs on every iteration; consider a dict/set index or collections.deque.")
+            elif name == "len" and owner is None and len(node.args) == 1 and isinstance(node.args[0], ast.Name):
+                self.loops[-1][1][node.args[0].id] += 1
+            elif (owner is None and name in ("list", "sorted") and node.args and isinstance(node.args[0], ast.Name)) \
+                    or name in ("copy", "deepcopy"):
+                self.add("copy-in-loop", "medium", node, f"`{name}()` copies a collection on every iteration; hoist it out of the loop if it does not change.")
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        if self.loops and isinstance(node.slice, ast.Slice) and node.slice.lower is None and node.slice.upper is None \
+                and node.slice.step is None and isinstance(node.ctx, ast.Load):
+            self.add("copy-in-loop", "medium", node, "`[:]` copies the whole sequence on every iteration.")
+        self.generic_visit(node)
+
+
+def _analyze_python(code: str):
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return [], 0, f"Could not parse Python code: {e.msg} (line {e.lineno})"
+    analyzer = _PythonAnalyzer()
+    analyzer.visit(tree)
+    return analyzer.findings, analyzer.max_loop_depth, ""
+
+
+# --- C++ --------------------------------------------------------------------
+
+# Comments, preprocessor lines, literals, identifiers, numbers, then operators (longest first)
+_CPP_TOKEN = re.compile(r"""//[^\n]*|/\*.*?\*/|\#(?:\\\n|[^\n])*|R"([^(\s]*)\(.*?\)\1"|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'"""
+                        r"""|[A-Za-z_]\w*|\.?\d[\w.']*|::|->|<<=|>>=|\+\+|--|[-+*/%&|^!=<>]=|&&|\|\||<<|>>|\S""", re.DOTALL)
+
+CPP_CONTAINERS = {"string", "vector", "map", "set", "unordered_map", "unordered_set", "multimap", "multiset",
+                  "list", "deque", "basic_string", "valarray"}
+CPP_NOT_FUNCTIONS = {"if", "for", "while", "switch", "catch", "return", "sizeof", "decltype", "alignof", "static_assert"}
+CPP_SPECIFIERS = ("const", "noexcept", "override", "final", "mutable")
+
+
+def _cpp_tokens(code: str) -> list:
+    """(kind, text, offset) for every token; comments and preprocessor lines are dropped and literals emptied."""
+    tokens = []
+    for match in _CPP_TOKEN.finditer(code):
+        text = match.group()
+        first = text[0]
+        if first == "#" or text[:2] in ("//", "/*"):
+            continue
+        if first in "\"'" or text[:2] == 'R"':
+            tokens.append(("str", '""', match.start()))
+        elif first.isalpha() or first == "_":
+            tokens.append(("id", text, match.start()))
+        else:
+            tokens.append(("num" if first.isdigit() or text[1:2].isdigit() else "op", text, match.start()))
+    return tokens
+
+
+def _matching(tokens: list, start: int) -> int:
+    """Index of the bracket closing tokens[start] (or the last token if unbalanced)."""
+    opening = tokens[start][1]
+    closing = {"(": ")", "[": "]", "{": "}"}[opening]
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i][1] == opening:
+            depth += 1
+        elif tokens[i][1] == closing:
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(tokens) - 1
+
+
+def _split_top_level(tokens: list) -> list:
+    """Splits a token list on commas outside (), [], {} and <>."""
+    parts, current, depth = [], [], 0
+    for token in tokens:
+        text = token[1]
+        if text in ("(", "[", "{", "<"):
+            depth += 1
+        elif text in (")", "]", "}", ">"):
+            depth -= 1
+        elif text == ">>":
+            depth -= 2
+        elif text == "," and depth == 0:
+            parts.append(current)
+            current = []
+            continue
+        current.append(token)
+    if current:
+        parts.append(current)
+    return parts
+
+
+class _CppAnalyzer:
+    """Single pass over the token stream with a stack of open scopes.
+
+    Each scope is a `{}` block or, for loop bodies without braces, a virtual scope that ends with its
+    statement. Loop scopes remember the collection their header walks; function scopes count the
+    calls made from their body to spot unmemoized recursion.
+    """
+
+    def __init__(self, code: str):
+        self.tokens = _cpp_tokens(code)
+        self.line_starts = [0] + [match.end() for match in re.finditer("\n", code)]
+        self.findings = []
+        self.scopes = []
+        self.loop_depth = 0
+        self.max_loop_depth = 0
+        self.last_closed = None
+
+    def add(self, rule, severity, token, message, loop_depth=None):
+        line = bisect.bisect_right(self.line_starts, token[2])
+        column = token[2] - self.line_starts[line - 1] + 1
+        depth = self.loop_depth if loop_depth is None else loop_depth
+        self.findings.append(_finding(rule, severity, line, column, depth, message))
+
+    def run(self) -> list:
+        tokens = self.tokens
+        pending_loop = None # Loop whose header was just read, waiting for its body
+        i = 0
+        while i < len(tokens):
+            kind, text, _ = tokens[i]
+            if pending_loop is not None:
+                pending_loop["virtual"] = text != "{"
+                self._open(pending_loop)
+                pending_loop = None
+                if text == "{":
+                    i += 1
+                    continue
+            if kind == "id":
+                if text in ("for", "while") and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+                    close = _matching(tokens, i + 1)
+                    if text == "while" and close + 1 < len(tokens) and tokens[close + 1][1] == ";" \
+                            and tokens[i - 1][1] == "}" and self.last_closed and self.last_closed.get("do"):
+                        self._end_statement() # Tail of a do-while; its body was the `do` block
+                        i = close + 2
+                        continue
+                    pending_loop = self._loop_header(text, i, close)
+                    i = close + 1
+                    continue
+                if text == "do":
+                    pending_loop = {"loop": True, "collection": None, "do": True}
+                else:
+                    self._check_identifier(i)
+            elif text == "{":
+                self._open({"loop": False, "definition": self._definition(i)})
+            elif text == "}":
+                while self.scopes and self.scopes[-1]["virtual"]:
+                    self._close()
+                if self.scopes:
+                    self._close()
+                self._end_statement()
+            elif text == ";":
+                self._end_statement()
+            i += 1
+        return self.findings
+
+    def _open(self, scope: dict):
+        scope.setdefault("virtual", False)
+        definition = scope.get("definition")
+        if definition:
+            scope["calls"] = Counter()
+        # Innermost enclosing function body, which collects calls and memo hints
+        scope["function"] = scope if definition else (self.scopes[-1]["function"] if self.scopes else None)
+        self.scopes.append(scope)
+        if scope["loop"]:
+            self.loop_depth += 1
+            self.max_loop_depth = max(self.max_loop_depth, self.loop_depth)
+
+    def _close(self):
+        scope = self.scopes.pop()
+        self.last_closed = scope
+        if scope["loop"]:
+            self.loop_depth -= 1
+        if scope.get("definition"):
+            name, token = scope["definition"]
+            calls = scope["calls"][name]
+            if calls > 1 and not scope.get("memo"):
+                self.add("recursion-without-memoization", "high", token,
+                         RECURSION_MESSAGE.format(name, calls, "Cache results in a table indexed by the arguments."))
+
+    def _end_statement(self):
+        # A `;` or a closed block ends the statement forming a brace-less loop body
+        while self.scopes and self.scopes[-1]["virtual"]:
+            self._close()
+
+    def _loop_header(self, keyword: str, start: int, close: int) -> dict:
+        header = self.tokens[start + 2:close]
+        texts = [t[1] for t in header]
+        keyword_token = self.tokens[start]
+        depth = self.loop_depth + 1 # Headers are evaluated on every iteration of the new loop
+        collection = None
+        if keyword == "for" and ";" not in texts and ":" in texts:
+            colon = texts.index(":")
+            if colon == len(texts) - 2:
+                collection = texts[-1]
+            declared = texts[:colon]
+            if not {"&", "&&", "*"} & set(declared):
+                container = next((t for t in declared if t in CPP_CONTAINERS), None)
+                if container or "auto" in declared:
+                    self.add("copy-in-loop", "medium" if container else "low", keyword_token,
+                             "Range-for copies each element; iterate by `const auto&` unless a copy is needed.", depth)
+        else:
+            for k in range(len(texts) - 3):
+                if texts[k + 1] in (".", "->") and texts[k + 2] in ("size", "length") and texts[k + 3] == "(":
+                    collection = texts[k]
+                    break
+        if collection and any(scope["loop"] and scope["collection"] == collection for scope in self.scopes):
+            self.add("nested-loop-same-collection", "high", keyword_token, NESTED_LOOP_MESSAGE.format(collection), depth)
+        for k in range(len(texts) - 1):
+            if texts[k] == "strlen" and texts[k + 1] == "(":
+                self.add("repeated-len", "medium", header[k],
+                         "`strlen` in a loop header rescans the string on every iteration; compute it once.", depth)
+        return {"loop": True, "collection": collection}
+
+    def _definition(self, brace: int):
+        """(name, token) of the function whose body starts at tokens[brace], or None for other blocks.
+
+        Also flags containers the function takes by value.
+        """
+        tokens = self.tokens
+        j = brace - 1
+        while j >= 0 and tokens[j][1] in CPP_SPECIFIERS:
+            j -= 1
+        if j < 1 or tokens[j][1] != ")":
+            return None
+        close, depth = j, 0
+        while j >= 0:
+            depth += {")": 1, "(": -1}.get(tokens[j][1], 0)
+            if depth == 0:
+                break
+            j -= 1
+        if j < 1 or tokens[j - 1][0] != "id" or tokens[j - 1][1] in CPP_NOT_FUNCTIONS:
+            return None
+        name = tokens[j - 1][1]
+        for param in _split_top_level(tokens[j + 1:close]):
+            texts = [t[1] for t in param]
+            container = next((t for t in texts if t in CPP_CONTAINERS), None)
+            if container and param[-1][0] == "id" and not {"&", "&&", "*", "="} & set(texts):
+                self.add("pass-by-value", "medium", param[0],
+                         f"`{name}` takes `{param[-1][1]}` ({container}) by value, copying it on every call; "
+                         "pass it as `const&` (or move it in if it is consumed).")
+        return name, tokens[j - 1]
+
+    def _check_identifier(self, i: int):
+        tokens = self.tokens
+        text = tokens[i][1]
+        previous = tokens[i - 1][1] if i else ""
+        following = [t[1] for t in tokens[i + 1:i + 5]]
+        function = self.scopes[-1]["function"] if self.scopes else None
+        if function is not None:
+            if MEMO_NAME.search(text):
+                function["memo"] = True
+            if following[:1] == ["("] and previous not in (".", "->"):
+                function["calls"][text] += 1
+        if not self.loop_depth:
+            return
+        if text == "endl" and previous in ("::", "<<"):
+            self.add("endl-in-loop", "medium", tokens[i], "`std::endl` flushes the stream on every iteration; write '\\n' instead.")
+        elif text in ("find", "count") and previous not in (".", "->") and following[:1] == ["("]:
+            self.add("linear-search-in-loop", "medium", tokens[i],
+                     f"`std::{text}` scans the range on every iteration; consider an unordered_set/map or sorting plus binary search.")
+        elif text in ("erase", "insert") and previous in (".", "->") and i > 1 \
+                and following[:4] == ["(", tokens[i - 2][1], ".", "begin"]:
+            self.add("linear-list-op-in-loop", "medium", tokens[i],
+                     f"`{text}` at the front of a vector shifts every element; consider std::deque or building in reverse.")
+        elif following[:3] == ["=", text, "+"] and previous in (";", "{", "}", ")"):
+            self.add("concat-in-loop", "medium", tokens[i], f"`{text} = {text} + ...` builds a new object every iteration; use `{text} +=` instead.")
+        elif text in CPP_CONTAINERS and previous not in ("(", ",", "<"):
+            self._check_container_copy(i)
+
+    def _check_container_copy(self, i: int):
+        """Flags `vector<T> name = other;` / `string name(other);` declarations inside loops."""
+        tokens = self.tokens
+        j = i + 1
+        if j < len(tokens) and tokens[j][1] == "<":
+            depth = 0
+            while j < len(tokens):
+                depth += {"<": 1, ">": -1, ">>": -2}.get(tokens[j][1], 0)
+                j += 1
+                if depth <= 0:
+                    break
+        rest = [t[1] for t in tokens[j:j + 4]]
+        if len(rest) == 4 and tokens[j][0] == "id" and tokens[j + 2][0] == "id" \
+                and ((rest[1] == "=" and rest[3] == ";") or (rest[1] == "(" and rest[3] == ")")):
+            self.add("copy-in-loop", "medium", tokens[i],
+                     f"`{rest[0]}` copies `{rest[2]}` on every iteration; reuse one buffer or take a reference.")
+
+
+def _analyze_cpp(code: str):
+    analyzer = _CppAnalyzer(code)
+    return analyzer.run(), analyzer.max_loop_depth, ""
+
+
+ANALYZERS = {"python": _analyze_python, "cpp": _analyze_cpp}
+
+
+def analyze_code(code: str, language: str, max_findings: int = 100) -> dict:
+    """Static performance analysis of a submission; nothing is executed.
+
+    Returns {"findings", "max_loop_depth", "truncated", "elapsed_ms", "error"}. Each finding has
+    `rule`, `severity` (high/medium/low), `line`, `column`, `loop_depth` (loops the flagged code
+    runs in, counted from the enclosing function body) and a `message` suggesting a fix. Findings
+    are sorted by severity, then position. `error` is set if the code could not be parsed.
+    """
+    start_time = time.perf_counter()
+    analyze = ANALYZERS.get(language)
+    if analyze is None:
+        return {"findings": [], "max_loop_depth": 0, "truncated": False, "elapsed_ms": 0, "error": f"No static analyzer for {language}"}
+    try:
+        findings, max_loop_depth, error = analyze(code)
+    except RecursionError:
+        findings, max_loop_depth, error = [], 0, "Code is nested too deeply to analyze"
+    unique = {(f["rule"], f["line"], f["column"]): f for f in findings}
+    findings = sorted(unique.values(), key=lambda f: (SEVERITY_ORDER[f["severity"]], f["line"], f["column"]))
+    elapsed_ms = round((time.perf_counter() - start_time) * 1000, 2)
+    logger.debug(f"Static analysis of {len(code)} chars of {language}: {len(findings)} findings in {elapsed_ms}ms")
+    return {
+        "findings": findings[:max_findings],
+        "max_loop_depth": max_loop_depth,
+        "truncated": len(findings) > max_findings,
+        "elapsed_ms": elapsed_ms,
+        "error": error,
+    }
+
+
+def analyze_submission(code: str, language: str, config) -> dict:
+    """analyze_code() with the configured limits, or None when ANALYZER_ENABLED is off."""
+    if not config.ANALYZER_ENABLED:
+        return None
+    return analyze_code(code, language, config.ANALYZER_MAX_FINDINGS)
+
+
+def format_hints(analysis: dict, limit: int = 8) -> str:
+    """The most severe findings as prompt lines ("- Line 12, loop depth 2: ..."); empty if there are none."""
+    lines = []
+    for finding in (analysis or {}).get("findings", [])[:limit]:
+        depth = f", loop depth {finding['loop_depth']}" if finding["loop_depth"] else ""
+        lines.append(f"- Line {finding['line']}{depth}: {finding['message']}")
+    return "\n".join(lines)
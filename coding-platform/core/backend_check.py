@@ -0,0 +1,135 @@
+"""Conformance checks and a latency comparison for the execution backends (core/backends.py).
+
+Run from the coding-platform directory:
+
+    python -m core.backend_check [docker] [local] [--runs N]
+
+Each case goes through runner.execute_code with both languages' EXECUTION_BACKEND_* pointed at the
+backend under test, so a backend conforms when submissions see the same outcome (output, exit
+code, error text, limits, isolation) as in the Docker sandbox. The latency table then times a
+trivial program end to end on every backend that passed its setup.
+"""
+import sys
+import time
+import argparse
+import statistics
+
+from config import Config
+from core import runner, backends
+
+CPP_ECHO = '#include <iostream>\nint main() { std::string s; std::cin >> s; std::cout << "hi " << s << std::endl; }'
+NETWORK_PROBE = ('import socket\ntry:\n    socket.create_connection(("1.1.1.1", 53), timeout=2)\n    print("connected")\n'
+                 'except OSError:\n    print("no network")')
+# Forks far more children than SANDBOX_MAX_PROCESSES allows; they exit on their own within seconds
+FORK_PROBE = ('import os, time\ntry:\n    for _ in range(1000):\n        if os.fork() == 0:\n            os.close(1)\n'
+              '            os.close(2)\n            time.sleep(2)\n            os._exit(0)\n    print("forked 1000")\n'
+              'except OSError:\n    print("limited")')
+
+
+def _expect(output=None, exit_code=0, error_contains=None):
+    def check(result):
+        if output is not None and result["output"] != output:
+            return f"output {result['output'][:80]!r}, expected {output!r}"
+        if exit_code is not None and result["exit_code"] != exit_code:
+            return f"exit code {result['exit_code']}, expected {exit_code}"
+        if error_contains and error_contains not in result["error"]:
+            return f"error {result['error'][:120]!r} does not mention {error_contains!r}"
+        return None
+    return check
+
+
+def _failed_to_allocate(result):
+    if result["exit_code"] in (0, None) or "allocated" in result["output"]:
+        return f"a 1 GiB allocation succeeded under the memory limit (exit code {result['exit_code']})"
+    return None
+
+
+# (name, language, code, stdin, check): check(result) returns None or what went wrong
+CASES = [
+    ("python stdout and stdin", "python", "print('hi', input())", "there", _expect("hi there")),
+    ("python exit code and stderr", "python", "import sys\nprint('oops', file=sys.stderr)\nsys.exit(3)", None,
+     _expect("", 3, "oops")),
+    ("python uncaught exception", "python", "raise ValueError('bad')", None, _expect("", 1, "ValueError: bad")),
+    ("python scratch files", "python", "open('f.txt', 'w').write('x')\nprint(open('f.txt').read())", None, _expect("x")),
+    ("python timeout", "python", "while True:\n    pass", None, _expect(None, 137, "timed out")),
+    ("python memory limit", "python", "x = bytearray(1024 ** 3)\nprint('allocated')", None, _failed_to_allocate),
+    ("python no network", "python", NETWORK_PROBE, None, _expect("no network")),
+    ("python process limit", "python", FORK_PROBE, None, _expect("limited")),
+    ("python no leaked environment", "python", "import os\nprint('GEMINI_API_KEY' in os.environ)", None, _expect("False")),
+    ("cpp compile and run", "cpp", CPP_ECHO, "there", _expect("hi there")),
+    ("cpp compile error", "cpp", "int main() { return undefined_name; }", None, _expect("", 1, "Compilation failed")),
+    ("cpp segfault", "cpp", "int main() { volatile int *p = 0; return *p; }", None, _expect("", 139, "Segmentation Fault")),
+    ("cpp exit code", "cpp", "int main() { return 7; }", None, _expect("", 7)),
+]
+
+LATENCY_PROGRAMS = {"python": "print(1)", "cpp": '#include <cstdio>\nint main() { puts("1"); }'}
+
+
+def config_for(backend: str):
+    """Config with every language (trusted or not) on `backend`."""
+    overrides = {f"{prefix}EXECUTION_BACKEND_{language.upper()}": backend
+                 for prefix in ("", "TRUSTED_") for language in LATENCY_PROGRAMS}
+    return type("BackendCheckConfig", (Config,), overrides)
+
+
+def check_backend(backend: str) -> list:
+    """Runs CASES on `backend`. Returns [(case name, failure or None)]."""
+    config = config_for(backend)
+    outcomes = []
+    for name, language, code, stdin, check in CASES:
+        result = runner.execute_code(code, language, config, stdin=stdin)
+        if result["exit_code"] is None and "timed out" not in result["error"]:
+            outcomes.append((name, f"setup failed: {result['error'][:200]}"))
+        else:
+            outcomes.append((name, check(result)))
+    return outcomes
+
+
+def compare_latency(backend: str, runs: int) -> dict:
+    """End-to-end execute_code wall time and program runtime per language, after one warmup run (which fills the compile cache)."""
+    config = config_for(backend)
+    latency = {}
+    for language, code in LATENCY_PROGRAMS.items():
+        runner.execute_code(code, language, config)
+        wall_ms, runtime_ms = [], []
+        for _ in range(runs):
+            started = time.perf_counter()
+            result = runner.execute_code(code, language, config)
+            wall_ms.append((time.perf_counter() - started) * 1000)
+            runtime_ms.append(result["metrics"]["runtime_ms"])
+        wall_ms.sort()
+        latency[language] = {
+            "median_ms": round(statistics.median(wall_ms), 1),
+            "p95_ms": round(wall_ms[min(len(wall_ms) - 1, int(0.95 * len(wall_ms)))], 1),
+            "runtime_median_ms": statistics.median(runtime_ms),
+        }
+    return latency
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check execution backends for conformance and compare their latency.")
+    parser.add_argument("backends", nargs="*", default=list(backends.BACKENDS), help="backends to check (default: all)")
+    parser.add_argument("--runs", type=int, default=10, help="timed runs per language for the latency comparison")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    usable = []
+    for backend in args.backends:
+        print(f"== {backend}")
+        outcomes = check_backend(backend)
+        for name, failure in outcomes:
+            print(f"  {'FAIL' if failure else 'ok  '} {name}" + (f": {failure}" if failure else ""))
+        failures += sum(1 for _, failure in outcomes if failure)
+        if not all(failure and failure.startswith("setup failed") for _, failure in outcomes):
+            usable.append(backend)
+
+    if usable:
+        print(f"\n{'backend':<10}{'language':<10}{'median ms':>12}{'p95 ms':>10}{'program ms':>12}")
+        for backend in usable:
+            for language, row in compare_latency(backend, args.runs).items():
+                print(f"{backend:<10}{language:<10}{row['median_ms']:>12}{row['p95_ms']:>10}{row['runtime_median_ms']:>12}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import os
+import threading
+import logging
+
+from core import pool, hosts, images, local_sandbox
+
+logger = logging.getLogger(__name__)
+
+
+class DockerBackend:
+    """Runs submissions in locked-down containers on the Docker hosts (core/hosts.py), taken from each host's warm pool when it is enabled (core/pool.py)."""
+
+    name = "docker"
+
+    def __init__(self, config):
+        self.config = config
+        self.hosts = hosts.get_hosts(config)
+
+    def image_name(self, language: str) -> str:
+        return self.config.DOCKER_PYTHON_IMAGE if language == 'python' else self.config.DOCKER_CPP_IMAGE
+
+    def environment_id(self, language: str, sandbox=None):
+        """What the result of a build or run depends on besides the code: here the image digest.
+
+        With a `sandbox`, the digest on the host it was placed on (already ensured by `acquire`, and
+        hosts may have built the same tag into different images). Without one (before placement),
+        the digests in the hosts' image caches, without any Docker API call; None if no host has
+        the image cached.
+        """
+        image_name = self.image_name(language)
+        if sandbox is not None and sandbox.host is not None:
+            return sandbox.host.manager.image_id(image_name)
+        digests = {host.manager.cached_image_id(image_name) for host in self.hosts.hosts} - {None}
+        return ",".join(sorted(digests)) or None
+
+    def acquire(self, language: str, result: dict, timings):
+        """Returns a sandbox for one run, or None with `result["error"]` set.
+
+        When a host fails to provide one (daemon down, image pull or container start failing), up to
+        DOCKER_DISPATCH_RETRIES other hosts are tried before giving up.
+        """
+        tried = []
+        for _ in range(1 + self.config.DOCKER_DISPATCH_RETRIES):
+            host = self.hosts.place(exclude=tried)
+            if host is None:
+                break
+            tried.append(host)
+            error = None
+            try:
+                sandbox, error = self._acquire_on(host, language, result, timings)
+            except Exception as e:
+                sandbox, error = None, f"Failed to start a sandbox on Docker host {host.name}: {e}"
+                logger.error(f"Error starting {language} sandbox on {host.name} for run_id {result['run_id']}: {e}", exc_info=True)
+            if sandbox is not None:
+                self.hosts.record_success(host)
+                sandbox.host = host
+                if len(self.hosts.hosts) > 1:
+                    result["metrics"]["docker_host"] = host.name
+                return sandbox
+            self.hosts.release(host)
+            self.hosts.record_failure(host, error)
+            result["error"] = error
+            if len(self.hosts.hosts) > 1:
+                logger.warning(f"Docker host {host.name} failed run_id {result['run_id']}, trying another host: {error}")
+        if not tried:
+            result["error"] = "No Docker host is available (all are ejected after repeated failures)."
+            logger.error(f"No Docker host available for run_id {result['run_id']}")
+        return None
+
+    def _acquire_on(self, host, language: str, result: dict, timings):
+        """(sandbox, None) from `host`, or (None, error message)."""
+        config = self.config
+        image_name = self.image_name(language)
+        # Shared client; health and image presence are tracked in the background
+        manager = host.manager
+        with timings.span("docker_check"):
+            healthy = manager.healthy or manager.check_health()
+        if not healthy:
+            logger.error(f"Docker host {host.name} unavailable for run_id {result['run_id']}: {manager.last_error}")
+            return None, f"Failed to connect to Docker: {manager.last_error}"
+
+        # Only pulls (or builds a managed image) when the image cache has never seen this image
+        try:
+            with timings.span("image_check"):
+                images.ensure_image(manager, config, language, image_name)
+        except Exception as e:
+            logger.error(f"Error ensuring image {image_name} on {host.name}: {e}", exc_info=True)
+            return None, f"Failed to prepare Docker image '{image_name}': {e}"
+
+        # Take a warm container from the host's pool, or start a one-off sandbox on a miss
+        with timings.span("sandbox_acquire"):
+            if config.POOL_ENABLED:
+                sandbox = pool.get_pool(config, host.base_url).acquire(language, manager.client, manager.shares_filesystem)
+            else:
+                sandbox = pool.create_sandbox(manager.client, config, language, mount_compile_cache=manager.shares_filesystem)
+        result["metrics"]["pool"] = "hit" if sandbox.pooled else "miss"
+        return sandbox, None
+
+    def release(self, sandbox, dirty: bool):
+        host, sandbox.host = sandbox.host, None
+        if self.config.POOL_ENABLED:
+            pool.get_pool(self.config, host.base_url).release(sandbox, dirty=dirty)
+        else:
+            pool.destroy_sandbox(sandbox)
+        self.hosts.release(host)
+
+    def report_failure(self, sandbox, error):
+        """Counts a Docker API error during a run against the sandbox's host."""
+        self.hosts.record_failure(sandbox.host, error)
+
+    def stats(self) -> dict:
+        return {"pool": self.config.POOL_ENABLED}
+
+
+class LocalBackend:
+    """Runs submissions as rlimited processes on this host (core/local_sandbox.py): no container startup, weaker isolation."""
+
+    name = "local"
+
+    def __init__(self, config):
+        self.config = config
+        os.makedirs(config.LOCAL_SANDBOX_ROOT, exist_ok=True)
+        self.network_isolation = config.LOCAL_SANDBOX_NETWORK_ISOLATION and local_sandbox.network_isolation_available()
+        if config.LOCAL_SANDBOX_NETWORK_ISOLATION and not self.network_isolation:
+            logger.warning("Network namespaces are unavailable on this host; local sandboxes will have network access.")
+        if local_sandbox.seccomp is None:
+            logger.info("libseccomp's Python bindings are not installed; local sandboxes run without a syscall filter.")
+        self._toolchains = {}
+        self._lock = threading.Lock()
+        self.counters = {"sandboxes": 0}
+
+    def environment_id(self, language: str, sandbox=None) -> str:
+        with self._lock:
+            if language not in self._toolchains:
+                self._toolchains[language] = local_sandbox.toolchain_id(language, self.config)
+            return self._toolchains[language]
+
+    def acquire(self, language: str, result: dict, timings):
+        with timings.span("sandbox_acquire"):
+            try:
+                sandbox = local_sandbox.LocalSandbox(language, self.config, self.network_isolation)
+            except OSError as e:
+                result["error"] = f"Failed to create a local sandbox: {e}"
+                logger.error(f"Could not create a local sandbox for run_id {result['run_id']}: {e}")
+                return None
+        with self._lock:
+            self.counters["sandboxes"] += 1
+        return sandbox
+
+    def release(self, sandbox, dirty: bool):
+        sandbox.destroy() # Every process group was killed when its exec returned
+
+    def report_failure(self, sandbox, error):
+        pass # Local failures are not infrastructure a run could be moved away from
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "network_isolation": self.network_isolation, "seccomp": local_sandbox.seccomp is not None}
+
+
+BACKENDS = {"docker": DockerBackend, "local": LocalBackend}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def backend_name(config, language: str, trusted: bool = False) -> str:
+    """The configured backend for `language`: EXECUTION_BACKEND_<LANGUAGE>, or TRUSTED_EXECUTION_BACKEND_<LANGUAGE> for trusted callers."""
+    return getattr(config, f"{'TRUSTED_' if trusted else ''}EXECUTION_BACKEND_{language.upper()}")
+
+
+def get_backend(config, language: str, trusted: bool = False):
+    """Returns the process-wide instance of the backend configured for `language` and trust level.
+
+    Raises ValueError for an unknown backend name.
+    """
+    name = backend_name(config, language, trusted)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown execution backend '{name}' for {language} (expected one of: {', '.join(BACKENDS)})")
+    with _backends_lock:
+        if name not in _backends:
+            _backends[name] = BACKENDS[name](config)
+        return _backends[name]
+
+
+def stats() -> dict:
+    with _backends_lock:
+        backends = dict(_backends)
+    return {name: backend.stats() for name, backend in backends.items()}
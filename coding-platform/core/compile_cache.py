@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(source: str, image_id: str, flags: list) -> str:
+    """Content address of a build: source text, compiler image digest and compiler flags."""
+    digest = hashlib.sha256()
+    for part in (source, image_id, " ".join(flags)):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class CompileCache:
+    """Size-bounded, on-disk LRU of compiled C++ binaries keyed by `cache_key()`.
+
+    Each entry is `<key>.bin` plus a `<key>.json` sidecar recording how long the compile took,
+    so hits can report the compile time they saved. Recency is tracked in memory and mirrored
+    in file mtimes, which is how the order is rebuilt after a restart.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (size_bytes, compile_ms), least recently used first
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "compile_ms_saved": 0}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def binary_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".bin"):
+                continue
+            key = name[:-4]
+            try:
+                stat = os.stat(self.binary_path(key))
+                with open(self._meta_path(key), encoding='utf-8') as f:
+                    compile_ms = json.load(f).get("compile_ms", 0)
+            except (OSError, ValueError):
+                continue
+            found.append((stat.st_mtime, key, stat.st_size, compile_ms))
+        for _, key, size, compile_ms in sorted(found):
+            self._entries[key] = (size, compile_ms)
+            self._total_bytes += size
+        logger.info(f"Compile cache loaded {len(self._entries)} entries ({self._total_bytes / (1024*1024):.1f} MiB) from {self.cache_dir}")
+
+    def lookup(self, key: str):
+        """Returns the compile time (ms) the cached binary saves, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not os.path.exists(self.binary_path(key)):
+                if entry is not None: # Removed from disk behind our back
+                    self._drop(key)
+                self.counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters["hits"] += 1
+            self.counters["compile_ms_saved"] += entry[1]
+        try:
+            os.utime(self.binary_path(key))
+        except OSError:
+            pass
+        return entry[1]
+
+    def read(self, key: str):
+        """The cached binary's bytes, for sandboxes that cannot see the cache directory (remote Docker hosts), or None."""
+        try:
+            with open(self.binary_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def store(self, key: str, binary: bytes, compile_ms: int):
+        """Adds a freshly compiled binary, evicting least recently used entries to stay under max_bytes."""
+        if len(binary) > self.max_bytes:
+            return
+        tmp_path = f"{self.binary_path(key)}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(binary)
+            os.chmod(tmp_path, 0o755)
+            with open(self._meta_path(key), 'w', encoding='utf-8') as f:
+                json.dump({"compile_ms": compile_ms}, f)
+            os.replace(tmp_path, self.binary_path(key)) # Atomic: readers never see a partial binary
+        except OSError as e:
+            logger.warning(f"Could not store compiled binary {key[:12]} in cache: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries[key][0]
+            self._entries[key] = (len(binary), compile_ms)
+            self._total_bytes += len(binary)
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.counters["evictions"] += 1
+
+    def _drop(self, key: str):
+        size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+        for path in (self.binary_path(key), self._meta_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "entries": len(self._entries), "size_bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(config) -> CompileCache:
+    """Returns the process-wide compile cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CompileCache(config.COMPILE_CACHE_DIR, config.COMPILE_CACHE_MAX_MB * 1024 * 1024)
+        return _cache
@@ -0,0 +1,214 @@
+import time
+import threading
+import logging
+
+import docker
+
+logger = logging.getLogger(__name__)
+
+# Image events that can change which tags exist locally
+IMAGE_EVENT_ACTIONS = {"pull", "tag", "untag", "delete", "load", "import"}
+
+
+def host_urls(config) -> list:
+    """The daemons runs are dispatched to (DOCKER_HOSTS), or [None] for the one DOCKER_HOST/the environment points at."""
+    return [url.strip() for url in config.DOCKER_HOSTS.split(",") if url.strip()] or [None]
+
+
+def client_timeout(config) -> int:
+    """Socket timeout of the shared client. exec_start blocks for the whole exec, so every exec must finish within it."""
+    return max(30, config.DOCKER_TIMEOUT_SECONDS + 10)
+
+
+class DockerClientManager:
+    """Process-wide client for one Docker daemon with background health checks and an image-presence cache.
+
+    The `/run` hot path only reads `healthy`, `resources` and `has_image()`; pings, `info` calls and
+    image listings happen on background threads (health checks every DOCKER_HEALTHCHECK_SECONDS,
+    image cache refreshes driven by the daemon's image events). `base_url` None means the daemon
+    configured in the environment (DOCKER_HOST or the local socket).
+    """
+
+    def __init__(self, config, base_url: str = None):
+        self.config = config
+        self.base_url = base_url
+        self.name = base_url or "default"
+        # Bind mounts of host paths (the compile cache) only work on a daemon sharing our filesystem
+        self.shares_filesystem = base_url is None or base_url.startswith("unix://")
+        self._client = None
+        self._lock = threading.Lock()
+        self._images = {} # Local tag -> image ID, e.g. "python:3.10-slim" -> "sha256:..."
+        self._images_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self.healthy = False
+        self.last_error = None
+        self.last_check = None
+        self.resources = None # {"cpus", "mem_total", "containers_running", "checked_at"} from the last `info`
+
+    @property
+    def client(self):
+        """The shared client. Its HTTP connection pool is reused across requests."""
+        with self._lock:
+            if self._client is None:
+                self._client = self._connect(timeout=client_timeout(self.config), max_pool_size=self.config.DOCKER_CLIENT_POOL_SIZE)
+            return self._client
+
+    def _connect(self, **kwargs):
+        if self.base_url is None:
+            return docker.from_env(**kwargs)
+        return docker.DockerClient(base_url=self.base_url, **kwargs)
+
+    def start(self):
+        """Runs the first health check and image listing, then starts the background threads."""
+        if self._threads:
+            return
+        self.check_health()
+        if self.healthy:
+            self.refresh_images()
+        suffix = "" if self.base_url is None else f"-{self.name}"
+        for target, name in ((self._health_loop, f"docker-health{suffix}"), (self._events_loop, f"docker-events{suffix}")):
+            thread = threading.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        with self._images_lock:
+            image_count = len(self._images)
+        return {"healthy": self.healthy, "last_error": self.last_error, "last_check": self.last_check, "cached_images": image_count,
+                "resources": self.resources}
+
+    # --- Health ---
+
+    def check_health(self) -> bool:
+        try:
+            self.client.ping()
+            if not self.healthy:
+                logger.info(f"Docker daemon {self.name} is reachable.")
+            self.healthy, self.last_error = True, None
+        except Exception as e:
+            if self.healthy or self.last_error is None:
+                logger.error(f"Docker daemon {self.name} health check failed: {e}")
+            self.healthy, self.last_error = False, str(e)
+        self.last_check = time.time()
+        if self.healthy:
+            self.refresh_resources()
+        return self.healthy
+
+    def refresh_resources(self):
+        """Records the daemon's CPU count, memory and running containers for load-aware placement (core/hosts.py)."""
+        try:
+            info = self.client.info()
+            self.resources = {"cpus": info.get("NCPU"), "mem_total": info.get("MemTotal"),
+                              "containers_running": info.get("ContainersRunning"), "checked_at": time.time()}
+        except Exception as e:
+            logger.warning(f"Could not read resources of Docker daemon {self.name}: {e}")
+
+    def _health_loop(self):
+        while not self._stop_event.wait(self.config.DOCKER_HEALTHCHECK_SECONDS):
+            was_healthy = self.healthy
+            if self.check_health() and not was_healthy:
+                self.refresh_images() # Events may have been missed while the daemon was down
+
+    # --- Image cache ---
+
+    @staticmethod
+    def normalize_image_name(image_name: str) -> str:
+        """Adds the implicit ':latest' tag so names compare the way the daemon reports them."""
+        if '@' in image_name or ':' in image_name.rsplit('/', 1)[-1]:
+            return image_name
+        return f"{image_name}:latest"
+
+    def refresh_images(self):
+        try:
+            tags = {tag: image.id for image in self.client.images.list() for tag in image.tags}
+        except Exception as e:
+            logger.warning(f"Could not list Docker images on {self.name}: {e}")
+            return
+        with self._images_lock:
+            self._images = tags
+        logger.debug(f"Image cache of {self.name} refreshed ({len(tags)} tags).")
+
+    def has_image(self, image_name: str) -> bool:
+        with self._images_lock:
+            return self.normalize_image_name(image_name) in self._images
+
+    def ensure_image(self, image_name: str):
+        """Makes sure `image_name` exists locally, pulling it on a cache miss.
+
+        Raises docker.errors.APIError if the pull fails.
+        """
+        if self.has_image(image_name):
+            return
+        try:
+            image = self.client.images.get(image_name)
+            logger.debug(f"Docker image found locally: {image_name}")
+        except docker.errors.ImageNotFound:
+            logger.info(f"Pulling Docker image {image_name} on {self.name}")
+            image = self.client.images.pull(image_name)
+            logger.info(f"Successfully pulled image {image_name} on {self.name}")
+        with self._images_lock:
+            self._images[self.normalize_image_name(image_name)] = image.id
+
+    def build_image(self, path: str, tag: str, buildargs: dict, labels: dict) -> str:
+        """Builds the image in the local context directory `path` as `tag` and records it in the image cache. Returns its ID.
+
+        Uses a client without a read timeout: a build step can run silently for minutes. Raises
+        docker.errors.BuildError or APIError if the build fails.
+        """
+        build_client = self._connect(timeout=None)
+        try:
+            image, _ = build_client.images.build(path=path, tag=tag, buildargs=buildargs, labels=labels, rm=True, forcerm=True)
+        finally:
+            build_client.close()
+        with self._images_lock:
+            self._images[self.normalize_image_name(tag)] = image.id
+        return image.id
+
+    def cached_image_id(self, image_name: str):
+        """The image ID of `image_name` from the image cache, or None if it is not cached. Never calls the daemon."""
+        with self._images_lock:
+            return self._images.get(self.normalize_image_name(image_name))
+
+    def image_id(self, image_name: str) -> str:
+        """The local image ID (content digest) for `image_name`, pulling the image if needed."""
+        self.ensure_image(image_name)
+        with self._images_lock:
+            # A concurrent refresh may have dropped the tag (image deleted); fall back to the name
+            return self._images.get(self.normalize_image_name(image_name), image_name)
+
+    def _events_loop(self):
+        events_client = None
+        while not self._stop_event.is_set():
+            if not self.healthy:
+                self._stop_event.wait(self.config.DOCKER_HEALTHCHECK_SECONDS)
+                continue
+            try:
+                if events_client is None:
+                    # Separate client without a read timeout: the event stream is idle most of the time
+                    events_client = self._connect(timeout=None)
+                for event in events_client.events(decode=True, filters={"type": "image"}):
+                    if event.get("Action") in IMAGE_EVENT_ACTIONS:
+                        self.refresh_images()
+                    if self._stop_event.is_set():
+                        return
+            except Exception as e:
+                logger.warning(f"Docker event stream of {self.name} interrupted: {e}")
+                self._stop_event.wait(1)
+
+
+_managers = {}
+_manager_lock = threading.Lock()
+
+
+def get_manager(config, base_url: str = None) -> DockerClientManager:
+    """Returns the process-wide manager of the daemon at `base_url` (default: the first of `host_urls()`), creating it on first use."""
+    if base_url is None:
+        base_url = host_urls(config)[0]
+    with _manager_lock:
+        if base_url not in _managers:
+            _managers[base_url] = DockerClientManager(config, base_url)
+        return _managers[base_url]
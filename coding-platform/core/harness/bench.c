@@ -0,0 +1,100 @@
+/* Benchmark harness for the C++ sandbox: `bench WARMUPS RUNS BUDGET_S PER_RUN_S CMD...`.
+ *
+ * Same protocol as bench.py: CMD is forked repeatedly with stdin/stdout on /dev/null and stderr in
+ * /tmp/bench_stderr, each run timed with CLOCK_MONOTONIC around fork and wait4(), and one JSON
+ * object is printed on stdout. */
+#include <errno.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+
+static volatile pid_t child = 0;
+
+static void on_alarm(int signum) {
+    (void)signum;
+    if (child > 0) kill(child, SIGKILL);
+}
+
+static long long now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+static void print_list(const char *name, const long long *values, int count) {
+    printf("\"%s\": [", name);
+    for (int i = 0; i < count; i++) printf(i ? ", %lld" : "%lld", values[i]);
+    printf("], ");
+}
+
+int main(int argc, char **argv) {
+    if (argc < 6) {
+        fprintf(stderr, "usage: bench WARMUPS RUNS BUDGET_S PER_RUN_S CMD...\n");
+        return 2;
+    }
+    int warmups = atoi(argv[1]), runs = atoi(argv[2]), per_run_s = atoi(argv[4]);
+    long long deadline = now_ns() + (long long)(atof(argv[3]) * 1e9);
+    char **cmd = argv + 5;
+    int devnull = open("/dev/null", O_RDWR);
+    int errfd = open("/tmp/bench_stderr", O_WRONLY | O_CREAT | O_TRUNC, 0600);
+    long long *warmup_ns = calloc(warmups + 1, sizeof(long long));
+    long long *times_ns = calloc(runs + 1, sizeof(long long));
+    long long *cpu_ns = calloc(runs + 1, sizeof(long long));
+    long long failed_ns = -1;
+    int warm_done = 0, done = 0, exit_code = 0, truncated = 0;
+
+    struct sigaction action = {0};
+    action.sa_handler = on_alarm;
+    sigaction(SIGALRM, &action, NULL);
+
+    for (int i = 0; i < warmups + runs; i++) {
+        if (now_ns() > deadline) {
+            truncated = 1;
+            break;
+        }
+        long long start = now_ns();
+        pid_t pid = fork();
+        if (pid == 0) {
+            dup2(devnull, 0);
+            dup2(devnull, 1);
+            dup2(errfd, 2);
+            execvp(cmd[0], cmd);
+            _exit(127);
+        }
+        child = pid;
+        alarm(per_run_s);
+        int status = 0;
+        struct rusage usage;
+        while (wait4(pid, &status, 0, &usage) < 0 && errno == EINTR) {
+        }
+        long long elapsed = now_ns() - start;
+        alarm(0);
+        child = 0;
+        int code = WIFEXITED(status) ? WEXITSTATUS(status) : 128 + WTERMSIG(status);
+        if (code != 0) {
+            exit_code = code;
+            failed_ns = elapsed;
+            break;
+        }
+        if (i < warmups) {
+            warmup_ns[warm_done++] = elapsed;
+        } else {
+            cpu_ns[done] = (usage.ru_utime.tv_sec + usage.ru_stime.tv_sec) * 1000000000LL
+                           + (usage.ru_utime.tv_usec + usage.ru_stime.tv_usec) * 1000LL;
+            times_ns[done++] = elapsed;
+        }
+    }
+
+    printf("{");
+    print_list("warmup_ns", warmup_ns, warm_done);
+    print_list("times_ns", times_ns, done);
+    print_list("cpu_ns", cpu_ns, done);
+    if (failed_ns >= 0) printf("\"failed_ns\": %lld, ", failed_ns);
+    printf("\"exit_code\": %d, \"truncated\": %s}\n", exit_code, truncated ? "true" : "false");
+    return 0;
+}
@@ -0,0 +1,49 @@
+"""Benchmark harness, run inside a Python sandbox as `python -c <this file> WARMUPS RUNS BUDGET_S PER_RUN_S CMD...`.
+
+Spawns CMD repeatedly with stdin/stdout on /dev/null and stderr in /tmp/bench_stderr, timing each
+run with perf_counter_ns() around spawn and wait4(). Prints one JSON object on stdout.
+"""
+import os
+import sys
+import json
+import time
+import signal
+
+warmups, runs, budget_s, per_run_s = int(sys.argv[1]), int(sys.argv[2]), float(sys.argv[3]), int(sys.argv[4])
+cmd = sys.argv[5:]
+devnull = os.open(os.devnull, os.O_RDWR)
+errfd = os.open("/tmp/bench_stderr", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+file_actions = [(os.POSIX_SPAWN_DUP2, devnull, 0), (os.POSIX_SPAWN_DUP2, devnull, 1), (os.POSIX_SPAWN_DUP2, errfd, 2)]
+child = None
+
+
+def on_alarm(signum, frame):
+    if child:
+        os.kill(child, signal.SIGKILL)
+
+
+signal.signal(signal.SIGALRM, on_alarm)
+deadline = time.perf_counter_ns() + int(budget_s * 1e9)
+report = {"warmup_ns": [], "times_ns": [], "cpu_ns": [], "exit_code": 0, "truncated": False}
+for i in range(warmups + runs):
+    if time.perf_counter_ns() > deadline:
+        report["truncated"] = True
+        break
+    start = time.perf_counter_ns()
+    child = os.posix_spawnp(cmd[0], cmd, os.environ, file_actions=file_actions)
+    signal.alarm(per_run_s)
+    _, status, usage = os.wait4(child, 0)
+    elapsed = time.perf_counter_ns() - start
+    signal.alarm(0)
+    child = None
+    exit_code = os.waitstatus_to_exitcode(status)
+    if exit_code != 0:
+        report["exit_code"] = 128 - exit_code if exit_code < 0 else exit_code
+        report["failed_ns"] = elapsed
+        break
+    if i < warmups:
+        report["warmup_ns"].append(elapsed)
+    else:
+        report["times_ns"].append(elapsed)
+        report["cpu_ns"].append(int((usage.ru_utime + usage.ru_stime) * 1e9))
+print(json.dumps(report))
@@ -0,0 +1,183 @@
+/* Test-case harness for the C++ sandbox:
+ * `cases CASE_DIR COUNT PER_CASE_S BUDGET_S STOP_ON_FAILURE OUTPUT_LIMIT CMD...`.
+ *
+ * Same protocol as cases.py: CMD runs once per case with stdin from CASE_DIR/<i>.in and
+ * stdout/stderr in CASE_DIR/<i>.out/.err, stdout is compared with CASE_DIR/<i>.expected when
+ * present (trailing whitespace ignored), and one JSON line is printed per case, then
+ * {"done": true, "stopped": null | "budget" | "failure"}. */
+#include <errno.h>
+#include <fcntl.h>
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/resource.h>
+#include <sys/stat.h>
+#include <sys/wait.h>
+
+static volatile pid_t child = 0;
+static volatile sig_atomic_t timed_out = 0;
+
+static void on_alarm(int signum) {
+    (void)signum;
+    if (child > 0) {
+        timed_out = 1;
+        kill(child, SIGKILL);
+    }
+}
+
+static long long now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+static long long file_size(const char *path) {
+    struct stat st;
+    return stat(path, &st) == 0 ? (long long)st.st_size : -1;
+}
+
+/* Reads up to `limit` bytes of `path` into a malloc'd buffer; *length receives the size read. */
+static char *read_head(const char *path, long long limit, long long *length) {
+    char *data = malloc(limit + 1);
+    *length = 0;
+    FILE *f = fopen(path, "rb");
+    if (f) {
+        *length = (long long)fread(data, 1, limit, f);
+        fclose(f);
+    }
+    return data;
+}
+
+/* Drops trailing whitespace on every line and trailing blank lines, in place. Returns the new length. */
+static long long normalize(char *data, long long length) {
+    long long out = 0, line_start = 0;
+    for (long long i = 0; i <= length; i++) {
+        if (i == length || data[i] == '\n') {
+            long long end = i;
+            while (end > line_start && (data[end - 1] == ' ' || data[end - 1] == '\t' || data[end - 1] == '\r')) end--;
+            memmove(data + out, data + line_start, end - line_start);
+            out += end - line_start;
+            if (i < length) data[out++] = '\n';
+            line_start = i + 1;
+        }
+    }
+    while (out > 0 && data[out - 1] == '\n') out--;
+    return out;
+}
+
+static void print_json_string(const char *data, long long length) {
+    putchar('"');
+    for (long long i = 0; i < length; i++) {
+        unsigned char c = (unsigned char)data[i];
+        if (c == '"' || c == '\\') printf("\\%c", c);
+        else if (c == '\n') printf("\\n");
+        else if (c == '\t') printf("\\t");
+        else if (c < 0x20 || c == 0x7f) printf("\\u%04x", c);
+        else putchar(c); /* Non-ASCII bytes are passed through; the host decodes with replacement */
+    }
+    putchar('"');
+}
+
+int main(int argc, char **argv) {
+    if (argc < 8) {
+        fprintf(stderr, "usage: cases CASE_DIR COUNT PER_CASE_S BUDGET_S STOP_ON_FAILURE OUTPUT_LIMIT CMD...\n");
+        return 2;
+    }
+    const char *case_dir = argv[1];
+    int count = atoi(argv[2]), per_case_s = atoi(argv[3]), stop_on_failure = atoi(argv[5]);
+    long long deadline = now_ns() + (long long)(atof(argv[4]) * 1e9);
+    long long output_limit = atoll(argv[6]);
+    char **cmd = argv + 7;
+    const char *stopped = NULL;
+
+    struct sigaction action = {0};
+    action.sa_handler = on_alarm;
+    sigaction(SIGALRM, &action, NULL);
+
+    for (int i = 0; i < count; i++) {
+        if (now_ns() > deadline) {
+            stopped = "budget";
+            break;
+        }
+        char in_path[4096], out_path[4096], err_path[4096], expected_path[4096];
+        snprintf(in_path, sizeof in_path, "%s/%d.in", case_dir, i);
+        snprintf(out_path, sizeof out_path, "%s/%d.out", case_dir, i);
+        snprintf(err_path, sizeof err_path, "%s/%d.err", case_dir, i);
+        snprintf(expected_path, sizeof expected_path, "%s/%d.expected", case_dir, i);
+        int fds[3] = {
+            open(in_path, O_RDONLY),
+            open(out_path, O_WRONLY | O_CREAT | O_TRUNC, 0600),
+            open(err_path, O_WRONLY | O_CREAT | O_TRUNC, 0600),
+        };
+
+        timed_out = 0;
+        long long start = now_ns();
+        pid_t pid = fork();
+        if (pid == 0) {
+            for (int n = 0; n < 3; n++) dup2(fds[n], n);
+            execvp(cmd[0], cmd);
+            _exit(127);
+        }
+        child = pid;
+        alarm(per_case_s);
+        int status = 0;
+        struct rusage usage;
+        while (wait4(pid, &status, 0, &usage) < 0 && errno == EINTR) {
+        }
+        long long elapsed = now_ns() - start;
+        alarm(0);
+        child = 0;
+        for (int n = 0; n < 3; n++) close(fds[n]);
+
+        int exit_code = WIFEXITED(status) ? WEXITSTATUS(status) : 128 + WTERMSIG(status);
+        long long stdout_bytes = file_size(out_path), expected_bytes = file_size(expected_path);
+        const char *verdict;
+        if (timed_out) {
+            verdict = "time_limit_exceeded";
+        } else if (exit_code == 137) {
+            verdict = "memory_limit_exceeded"; /* SIGKILL not sent by us: the OOM killer */
+        } else if (exit_code != 0) {
+            verdict = "runtime_error";
+        } else if (expected_bytes >= 0) {
+            if (stdout_bytes > 2 * expected_bytes + 4096) { /* Cannot match; don't read it all into memory */
+                verdict = "wrong_answer";
+            } else {
+                long long actual_length, expected_length;
+                char *actual = read_head(out_path, stdout_bytes, &actual_length);
+                char *expected = read_head(expected_path, expected_bytes, &expected_length);
+                actual_length = normalize(actual, actual_length);
+                expected_length = normalize(expected, expected_length);
+                verdict = (actual_length == expected_length && memcmp(actual, expected, actual_length) == 0) ? "passed" : "wrong_answer";
+                free(actual);
+                free(expected);
+            }
+        } else {
+            verdict = "completed";
+        }
+
+        long long stdout_length, stderr_length;
+        char *stdout_head = read_head(out_path, output_limit, &stdout_length);
+        char *stderr_head = read_head(err_path, output_limit, &stderr_length);
+        long long cpu_ns = (usage.ru_utime.tv_sec + usage.ru_stime.tv_sec) * 1000000000LL
+                           + (usage.ru_utime.tv_usec + usage.ru_stime.tv_usec) * 1000LL;
+        printf("{\"index\": %d, \"verdict\": \"%s\", \"exit_code\": %d, \"time_ns\": %lld, \"cpu_ns\": %lld, \"maxrss_kb\": %ld, \"stdout\": ",
+               i, verdict, exit_code, elapsed, cpu_ns, usage.ru_maxrss);
+        print_json_string(stdout_head, stdout_length);
+        printf(", \"stderr\": ");
+        print_json_string(stderr_head, stderr_length);
+        printf(", \"stdout_bytes\": %lld, \"truncated\": %s}\n", stdout_bytes, stdout_bytes > output_limit ? "true" : "false");
+        fflush(stdout);
+        free(stdout_head);
+        free(stderr_head);
+        if (stop_on_failure && strcmp(verdict, "passed") != 0 && strcmp(verdict, "completed") != 0) {
+            stopped = "failure";
+            break;
+        }
+    }
+    if (stopped) printf("{\"done\": true, \"stopped\": \"%s\"}\n", stopped);
+    else printf("{\"done\": true, \"stopped\": null}\n");
+    return 0;
+}
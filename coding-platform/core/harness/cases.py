@@ -0,0 +1,87 @@
+"""Test-case harness, run inside a Python sandbox as
+`python -c <this file> CASE_DIR COUNT PER_CASE_S BUDGET_S STOP_ON_FAILURE OUTPUT_LIMIT CMD...`.
+
+Runs CMD once per case with stdin from CASE_DIR/<i>.in and stdout/stderr in CASE_DIR/<i>.out/.err,
+compares stdout with CASE_DIR/<i>.expected when present (trailing whitespace ignored) and prints
+one JSON line per case, then {"done": true, "stopped": null | "budget" | "failure"}.
+"""
+import os
+import sys
+import json
+import time
+import signal
+
+case_dir, count, per_case_s, budget_s = sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), float(sys.argv[4])
+stop_on_failure, output_limit = sys.argv[5] == "1", int(sys.argv[6])
+cmd = sys.argv[7:]
+child = None
+timed_out = False
+
+
+def on_alarm(signum, frame):
+    global timed_out
+    if child:
+        timed_out = True
+        os.kill(child, signal.SIGKILL)
+
+
+def normalize(data):
+    return b"\n".join(line.rstrip() for line in data.split(b"\n")).rstrip(b"\n")
+
+
+def head(path):
+    with open(path, "rb") as f:
+        data = f.read(output_limit + 1)
+    return data[:output_limit].decode("utf-8", "replace"), len(data) > output_limit
+
+
+signal.signal(signal.SIGALRM, on_alarm)
+deadline = time.perf_counter_ns() + int(budget_s * 1e9)
+stopped = None
+for i in range(count):
+    if time.perf_counter_ns() > deadline:
+        stopped = "budget"
+        break
+    base = os.path.join(case_dir, str(i))
+    fds = [os.open(base + ".in", os.O_RDONLY)]
+    fds += [os.open(base + suffix, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600) for suffix in (".out", ".err")]
+    timed_out = False
+    start = time.perf_counter_ns()
+    child = os.posix_spawnp(cmd[0], cmd, os.environ, file_actions=[(os.POSIX_SPAWN_DUP2, fd, n) for n, fd in enumerate(fds)])
+    signal.alarm(per_case_s)
+    _, status, usage = os.wait4(child, 0)
+    elapsed = time.perf_counter_ns() - start
+    signal.alarm(0)
+    child = None
+    for fd in fds:
+        os.close(fd)
+
+    exit_code = os.waitstatus_to_exitcode(status)
+    exit_code = 128 - exit_code if exit_code < 0 else exit_code
+    stdout_bytes = os.path.getsize(base + ".out")
+    if timed_out:
+        verdict = "time_limit_exceeded"
+    elif exit_code == 137:
+        verdict = "memory_limit_exceeded" # SIGKILL not sent by us: the OOM killer
+    elif exit_code != 0:
+        verdict = "runtime_error"
+    elif os.path.exists(base + ".expected"):
+        expected_bytes = os.path.getsize(base + ".expected")
+        if stdout_bytes > 2 * expected_bytes + 4096: # Cannot match; don't read it all into memory
+            verdict = "wrong_answer"
+        else:
+            with open(base + ".out", "rb") as actual, open(base + ".expected", "rb") as expected:
+                verdict = "passed" if normalize(actual.read()) == normalize(expected.read()) else "wrong_answer"
+    else:
+        verdict = "completed"
+    stdout, truncated = head(base + ".out")
+    stderr, _ = head(base + ".err")
+    print(json.dumps({
+        "index": i, "verdict": verdict, "exit_code": exit_code, "time_ns": elapsed,
+        "cpu_ns": int((usage.ru_utime + usage.ru_stime) * 1e9), "maxrss_kb": usage.ru_maxrss,
+        "stdout": stdout, "stderr": stderr, "stdout_bytes": stdout_bytes, "truncated": truncated,
+    }), flush=True)
+    if stop_on_failure and verdict not in ("passed", "completed"):
+        stopped = "failure"
+        break
+print(json.dumps({"done": True, "stopped": stopped}), flush=True)
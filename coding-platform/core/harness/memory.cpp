@@ -0,0 +1,211 @@
+/* Allocation-tracking shim linked into C++ submissions built in memory mode.
+ *
+ * Replaces malloc/calloc/realloc/free, the aligned allocators and every global operator new and
+ * delete. Each allocation is forwarded to glibc's own allocator (__libc_*) and accounted by its
+ * usable size (malloc_usable_size): allocation and free counts, bytes allocated, live bytes and
+ * their peak, plus per call site (return address minus one, for addr2line) the number of
+ * allocations and bytes. A timeline of [t_us, live_bytes, peak_in_interval] is recorded from the
+ * allocation path every $MEMORY_INTERVAL_US; when it fills up, neighbouring points are merged and
+ * the interval doubles. Tracking starts before the program's static constructors. When the
+ * program exits normally, after its static destructors, the report is written as JSON to
+ * $MEMORY_OUT; blocks still live then are what the program leaked.
+ */
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <ctime>
+#include <new>
+#include <malloc.h>
+
+extern "C" {
+void *__libc_malloc(size_t size);
+void *__libc_calloc(size_t count, size_t size);
+void *__libc_realloc(void *ptr, size_t size);
+void *__libc_memalign(size_t alignment, size_t size);
+void __libc_free(void *ptr);
+}
+
+namespace {
+
+const int MAX_SITES = 4096; // Power of two
+const int MAX_POINTS = 4096; // Even
+
+struct Site { void *address; long long count, bytes; };
+struct Point { long long t_ns, live, peak; };
+
+Site sites[MAX_SITES];
+int site_count = 0;
+long long other_count = 0, other_bytes = 0; // Allocations once the site table is full
+Point points[MAX_POINTS];
+int point_count = 0;
+long long allocations = 0, frees = 0, allocated_bytes = 0, live_bytes = 0, live_blocks = 0, peak_bytes = 0;
+long long start_ns = 0, interval_ns = 10000000, next_point_ns = 0, window_peak = 0;
+bool enabled = false;
+volatile char lock_flag = 0;
+
+inline void lock() {
+    while (__atomic_test_and_set(&lock_flag, __ATOMIC_ACQUIRE)) {
+    }
+}
+
+inline void unlock() { __atomic_clear(&lock_flag, __ATOMIC_RELEASE); }
+
+long long now_ns() {
+    timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+void add_point(long long t_ns) {
+    if (point_count == MAX_POINTS) {
+        for (int i = 0; i < MAX_POINTS / 2; i++) {
+            Point merged = points[2 * i + 1];
+            if (points[2 * i].peak > merged.peak) merged.peak = points[2 * i].peak;
+            points[i] = merged;
+        }
+        point_count = MAX_POINTS / 2;
+        interval_ns *= 2;
+    }
+    points[point_count++] = {t_ns - start_ns, live_bytes, window_peak};
+    window_peak = live_bytes;
+    next_point_ns = t_ns + interval_ns;
+}
+
+void count_site(void *address, long long size) {
+    unsigned long h = ((unsigned long)address >> 2) * 2654435761UL;
+    for (int probe = 0; probe < MAX_SITES / 2; probe++) { // Stay at most half full
+        Site &site = sites[(h + probe) & (MAX_SITES - 1)];
+        if (site.address == address) {
+            site.count++;
+            site.bytes += size;
+            return;
+        }
+        if (!site.address) {
+            if (site_count >= MAX_SITES / 2) break;
+            site_count++;
+            site.address = address;
+            site.count = 1;
+            site.bytes = size;
+            return;
+        }
+    }
+    other_count++;
+    other_bytes += size;
+}
+
+void *track_alloc(void *ptr, void *return_address) {
+    if (!ptr || !enabled) return ptr;
+    long long size = malloc_usable_size(ptr);
+    long long t_ns = now_ns();
+    lock();
+    allocations++;
+    allocated_bytes += size;
+    live_blocks++;
+    live_bytes += size;
+    if (live_bytes > peak_bytes) peak_bytes = live_bytes;
+    if (live_bytes > window_peak) window_peak = live_bytes;
+    count_site((char *)return_address - 1, size);
+    if (t_ns >= next_point_ns) add_point(t_ns);
+    unlock();
+    return ptr;
+}
+
+void track_free(void *ptr) {
+    if (!ptr || !enabled) return;
+    long long size = malloc_usable_size(ptr);
+    lock();
+    frees++;
+    live_blocks--;
+    live_bytes -= size; // Blocks from before tracking started can push this below zero
+    unlock();
+}
+
+void *aligned(size_t alignment, size_t size, void *return_address) {
+    if (alignment < sizeof(void *)) alignment = sizeof(void *);
+    return track_alloc(__libc_memalign(alignment, size), return_address);
+}
+
+void *new_or_throw(void *ptr) {
+    if (!ptr) throw std::bad_alloc();
+    return ptr;
+}
+
+__attribute__((constructor(101))) void memory_start() {
+    const char *interval = getenv("MEMORY_INTERVAL_US");
+    if (interval && atoll(interval) > 0) interval_ns = atoll(interval) * 1000;
+    start_ns = now_ns();
+    next_point_ns = start_ns + interval_ns;
+    enabled = true;
+}
+
+__attribute__((destructor(101))) void memory_finish() {
+    lock();
+    add_point(now_ns());
+    enabled = false; // fopen/fprintf below allocate
+    unlock();
+    const char *path = getenv("MEMORY_OUT");
+    FILE *out = path ? fopen(path, "w") : nullptr;
+    if (!out) return;
+    fprintf(out, "{\"interval_us\": %lld, \"allocations\": %lld, \"frees\": %lld, \"allocated_bytes\": %lld, "
+                 "\"peak_bytes\": %lld, \"final_bytes\": %lld, \"live_blocks\": %lld, \"other_sites\": [%lld, %lld], \"sites\": [",
+            interval_ns / 1000, allocations, frees, allocated_bytes, peak_bytes, live_bytes, live_blocks, other_count, other_bytes);
+    bool first = true;
+    for (const Site &site : sites) {
+        if (!site.address) continue;
+        fprintf(out, "%s[\"0x%lx\", %lld, %lld]", first ? "" : ", ", (unsigned long)site.address, site.count, site.bytes);
+        first = false;
+    }
+    fprintf(out, "], \"timeline\": [");
+    for (int i = 0; i < point_count; i++) {
+        fprintf(out, "%s[%lld, %lld, %lld]", i ? ", " : "", points[i].t_ns / 1000, points[i].live, points[i].peak);
+    }
+    fprintf(out, "]}\n");
+    fclose(out);
+}
+
+} // namespace
+
+extern "C" {
+void *malloc(size_t size) { return track_alloc(__libc_malloc(size), __builtin_return_address(0)); }
+void *calloc(size_t count, size_t size) { return track_alloc(__libc_calloc(count, size), __builtin_return_address(0)); }
+void free(void *ptr) {
+    track_free(ptr);
+    __libc_free(ptr);
+}
+void *realloc(void *ptr, size_t size) {
+    track_free(ptr);
+    void *moved = __libc_realloc(ptr, size);
+    if (!moved && size) { // Failed: the old block is still there
+        track_alloc(ptr, __builtin_return_address(0));
+        return nullptr;
+    }
+    return track_alloc(moved, __builtin_return_address(0));
+}
+void *memalign(size_t alignment, size_t size) { return aligned(alignment, size, __builtin_return_address(0)); }
+void *aligned_alloc(size_t alignment, size_t size) { return aligned(alignment, size, __builtin_return_address(0)); }
+int posix_memalign(void **result, size_t alignment, size_t size) {
+    void *ptr = aligned(alignment, size, __builtin_return_address(0));
+    if (!ptr) return 12; // ENOMEM
+    *result = ptr;
+    return 0;
+}
+}
+
+void *operator new(size_t size) { return new_or_throw(track_alloc(__libc_malloc(size), __builtin_return_address(0))); }
+void *operator new[](size_t size) { return new_or_throw(track_alloc(__libc_malloc(size), __builtin_return_address(0))); }
+void *operator new(size_t size, const std::nothrow_t &) noexcept { return track_alloc(__libc_malloc(size), __builtin_return_address(0)); }
+void *operator new[](size_t size, const std::nothrow_t &) noexcept { return track_alloc(__libc_malloc(size), __builtin_return_address(0)); }
+void *operator new(size_t size, std::align_val_t alignment) {
+    return new_or_throw(aligned((size_t)alignment, size, __builtin_return_address(0)));
+}
+void *operator new[](size_t size, std::align_val_t alignment) {
+    return new_or_throw(aligned((size_t)alignment, size, __builtin_return_address(0)));
+}
+void operator delete(void *ptr) noexcept { free(ptr); }
+void operator delete[](void *ptr) noexcept { free(ptr); }
+void operator delete(void *ptr, size_t) noexcept { free(ptr); }
+void operator delete[](void *ptr, size_t) noexcept { free(ptr); }
+void operator delete(void *ptr, std::align_val_t) noexcept { free(ptr); }
+void operator delete[](void *ptr, std::align_val_t) noexcept { free(ptr); }
+void operator delete(void *ptr, size_t, std::align_val_t) noexcept { free(ptr); }
+void operator delete[](void *ptr, size_t, std::align_val_t) noexcept { free(ptr); }
@@ -0,0 +1,98 @@
+"""Memory harness, run inside a Python sandbox as `python -c <this file> SCRIPT OUT_PATH INTERVAL_MS MAX_SITES`.
+
+Runs SCRIPT as __main__ with tracemalloc tracing every allocation (one frame per trace, so sites
+are the allocating line). A sampler thread records [t_ms, traced_bytes, peak_bytes] every
+INTERVAL_MS and snapshots the live allocations whenever the peak has grown by PEAK_GROWTH since
+the last snapshot, so the sites near the peak are known; live allocations are also snapshotted
+when the script finishes. The program keeps its own stdin/stdout/stderr and exit code; the
+report is written as JSON to OUT_PATH, including after sys.exit() or an uncaught exception.
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import threading
+import traceback
+import tracemalloc
+import pkgutil # noqa: F401 - runpy imports it lazily; keep that out of the trace
+
+script, out_path, interval_ms, max_sites = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+sys.argv = [script]
+sys.path[0] = os.path.dirname(script)
+PEAK_GROWTH = 1.25 # Snapshot again once the peak is this much above the last snapshot's
+MAX_POINTS = 4096 # Raw timeline length; the interval doubles when it fills up
+# Allocations made by this harness and tracemalloc itself
+IGNORED = [tracemalloc.Filter(False, name) for name in
+           ("<string>", runpy.run_path.__code__.co_filename, tracemalloc.__file__, threading.__file__)]
+
+timeline = []
+peak_snapshot, snapshot_peak = None, 0
+stop = threading.Event()
+
+
+def sample_memory(started):
+    global peak_snapshot, snapshot_peak
+    interval = interval_ms / 1000
+    while not stop.wait(interval):
+        current, peak = tracemalloc.get_traced_memory()
+        timeline.append([round((time.monotonic() - started) * 1000, 1), current, peak])
+        if len(timeline) >= MAX_POINTS:
+            timeline[:] = timeline[1::2]
+            interval *= 2
+        if peak > snapshot_peak * PEAK_GROWTH and current > snapshot_peak:
+            peak_snapshot, snapshot_peak = tracemalloc.take_snapshot(), current
+
+
+def top_sites(snapshot):
+    stats = snapshot.filter_traces(IGNORED).statistics("lineno")
+    return [[frame.filename == script, frame.filename, frame.lineno, stat.size, stat.count]
+            for stat in stats[:max_sites] for frame in stat.traceback[:1]]
+
+
+def user_traceback(tb):
+    while tb is not None and tb.tb_frame.f_code.co_filename != script:
+        tb = tb.tb_next
+    return tb
+
+
+tracemalloc.start(1)
+started = time.monotonic()
+sampler = threading.Thread(target=sample_memory, args=(started,), daemon=True)
+sampler.start()
+exit_code = 0
+module_globals = None
+try:
+    module_globals = runpy.run_path(script, run_name="__main__")
+except SystemExit as e:
+    if e.code is None:
+        exit_code = 0
+    elif isinstance(e.code, int):
+        exit_code = e.code
+    else:
+        print(e.code, file=sys.stderr)
+        exit_code = 1
+except BaseException as e:
+    traceback.print_exception(type(e), e, user_traceback(e.__traceback__))
+    exit_code = 1
+finally:
+    stop.set()
+    sampler.join()
+    final_bytes, peak_bytes = tracemalloc.get_traced_memory()
+    final_snapshot = tracemalloc.take_snapshot() # Still holds the script's globals
+    if final_bytes > snapshot_peak and final_bytes * PEAK_GROWTH >= peak_bytes: # e.g. a run shorter than INTERVAL_MS
+        peak_snapshot, snapshot_peak = final_snapshot, final_bytes
+    timeline.append([round((time.monotonic() - started) * 1000, 1), final_bytes, peak_bytes])
+    tracemalloc.stop()
+
+with open(out_path, "w") as f:
+    json.dump({
+        "peak_bytes": peak_bytes,
+        "final_bytes": final_bytes,
+        "peak_sites": top_sites(peak_snapshot) if peak_snapshot else None,
+        "peak_snapshot_bytes": snapshot_peak,
+        "final_sites": top_sites(final_snapshot),
+        "timeline": timeline,
+    }, f)
+del module_globals
+sys.exit(exit_code) # Still runs the program's atexit handlers
@@ -0,0 +1,203 @@
+/* Profiling shim linked into C++ submissions built in profile mode (-finstrument-functions).
+ *
+ * Every instrumented function entry/exit updates a calling-context tree: one node per distinct
+ * call path with its call count, self and total time (CLOCK_MONOTONIC). A SIGPROF timer samples
+ * the interrupted program counter every $PROFILE_INTERVAL_US of CPU time, together with the
+ * innermost instrumented function, for line-level hot spots. Instrumented code spends much of its
+ * time in the hooks below, so each sample also keeps the return addresses of the next
+ * FRAME_WALK frame-pointer frames (call sites, minus one byte), read only while the frame pointer
+ * stays inside the main thread's stack. When the program exits normally
+ * (return from main or exit()), the tree and samples are written as JSON to $PROFILE_OUT with raw
+ * addresses; the runner symbolizes them with addr2line (the binary is linked with -no-pie). */
+#define _GNU_SOURCE
+#include <signal.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include <sys/time.h>
+#include <ucontext.h>
+
+#define NI __attribute__((no_instrument_function))
+#define MAX_NODES 65536
+#define HASH_SIZE 131072 /* Power of two, at most half full */
+#define MAX_DEPTH 8192
+#define MAX_SAMPLES 262144
+#define FRAME_WALK 2
+
+struct node { void *fn; int parent; long long calls, self_ns, total_ns; };
+struct frame { int node; long long start_ns, child_ns; };
+struct sample { void *pc[FRAME_WALK + 1]; int node; };
+
+static struct node nodes[MAX_NODES];
+static int node_count = 1; /* Node 0 is the root */
+static int node_index[HASH_SIZE]; /* 0 = empty slot */
+static struct frame stack[MAX_DEPTH];
+static int depth = 0, overflow = 0, nodes_full = 0;
+static struct sample samples[MAX_SAMPLES];
+static volatile int sample_count = 0;
+static volatile long long dropped_samples = 0;
+static int enabled = 0, interval_us = 1000;
+static unsigned long stack_low = 0, stack_high = 0; /* Main thread stack, from /proc/self/maps */
+
+static NI long long now_ns(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+static NI int find_node(int parent, void *fn) {
+    unsigned long h = ((unsigned long)fn >> 4) * 2654435761UL ^ (unsigned long)parent * 40503UL;
+    for (unsigned long i = h & (HASH_SIZE - 1);; i = (i + 1) & (HASH_SIZE - 1)) {
+        int n = node_index[i];
+        if (n == 0) {
+            if (node_count >= MAX_NODES) {
+                nodes_full = 1;
+                return -1;
+            }
+            n = node_count++;
+            nodes[n].fn = fn;
+            nodes[n].parent = parent;
+            node_index[i] = n;
+            return n;
+        }
+        if (nodes[n].fn == fn && nodes[n].parent == parent) return n;
+    }
+}
+
+void NI __cyg_profile_func_enter(void *fn, void *call_site) {
+    (void)call_site;
+    if (!enabled) return;
+    if (depth >= MAX_DEPTH) {
+        overflow++;
+        return;
+    }
+    int parent = depth ? stack[depth - 1].node : 0;
+    int n = parent >= 0 ? find_node(parent, fn) : -1; /* Below an untracked frame, everything is untracked */
+    if (n >= 0) nodes[n].calls++;
+    stack[depth].node = n;
+    stack[depth].child_ns = 0;
+    stack[depth].start_ns = now_ns();
+    depth++;
+}
+
+static NI void pop_frame(long long end_ns) {
+    struct frame *f = &stack[--depth];
+    long long elapsed = end_ns - f->start_ns;
+    if (f->node >= 0) {
+        nodes[f->node].self_ns += elapsed - f->child_ns;
+        nodes[f->node].total_ns += elapsed;
+    }
+    if (depth) stack[depth - 1].child_ns += elapsed;
+}
+
+void NI __cyg_profile_func_exit(void *fn, void *call_site) {
+    (void)fn;
+    (void)call_site;
+    if (!enabled) return;
+    if (overflow) {
+        overflow--;
+        return;
+    }
+    if (depth) pop_frame(now_ns());
+}
+
+static NI void on_sigprof(int signum, siginfo_t *info, void *context) {
+    (void)signum;
+    (void)info;
+    ucontext_t *uc = (ucontext_t *)context;
+    void *pc = 0;
+    unsigned long fp = 0;
+#if defined(__x86_64__)
+    pc = (void *)uc->uc_mcontext.gregs[REG_RIP];
+    fp = (unsigned long)uc->uc_mcontext.gregs[REG_RBP];
+#elif defined(__aarch64__)
+    pc = (void *)uc->uc_mcontext.pc;
+    fp = (unsigned long)uc->uc_mcontext.regs[29];
+#else
+    (void)uc;
+#endif
+    int i = sample_count;
+    if (i < MAX_SAMPLES) {
+        memset(samples[i].pc, 0, sizeof(samples[i].pc));
+        samples[i].pc[0] = pc;
+        /* Frame records are {previous fp, return address} on both x86-64 and AArch64 */
+        for (int k = 1; k <= FRAME_WALK; k++) {
+            if (fp < stack_low || fp + 2 * sizeof(void *) > stack_high || fp % sizeof(void *)) break;
+            unsigned long *record = (unsigned long *)fp;
+            if (!record[1]) break;
+            samples[i].pc[k] = (void *)(record[1] - 1);
+            if (record[0] <= fp) break;
+            fp = record[0];
+        }
+        samples[i].node = depth ? stack[depth - 1].node : 0;
+        sample_count = i + 1;
+    } else {
+        dropped_samples++;
+    }
+}
+
+__attribute__((constructor)) static NI void profile_start(void) {
+    const char *interval = getenv("PROFILE_INTERVAL_US");
+    if (interval && atoi(interval) > 0) interval_us = atoi(interval);
+    FILE *maps = fopen("/proc/self/maps", "r");
+    if (maps) {
+        char line[512];
+        while (fgets(line, sizeof(line), maps)) {
+            if (strstr(line, "[stack]")) {
+                sscanf(line, "%lx-%lx", &stack_low, &stack_high);
+                break;
+            }
+        }
+        fclose(maps);
+    }
+    struct sigaction action;
+    memset(&action, 0, sizeof(action));
+    action.sa_sigaction = on_sigprof;
+    action.sa_flags = SA_SIGINFO | SA_RESTART;
+    sigaction(SIGPROF, &action, NULL);
+    struct itimerval timer = {{interval_us / 1000000, interval_us % 1000000}, {interval_us / 1000000, interval_us % 1000000}};
+    setitimer(ITIMER_PROF, &timer, NULL);
+    enabled = 1;
+}
+
+static NI int by_pc_then_node(const void *a, const void *b) {
+    const struct sample *x = a, *y = b;
+    int order = memcmp(x->pc, y->pc, sizeof(x->pc));
+    return order ? order : x->node - y->node;
+}
+
+__attribute__((destructor)) static NI void profile_finish(void) {
+    struct itimerval off;
+    memset(&off, 0, sizeof(off));
+    setitimer(ITIMER_PROF, &off, NULL);
+    enabled = 0;
+    long long end_ns = now_ns();
+    while (depth) pop_frame(end_ns); /* exit() called below main: close the open frames */
+
+    const char *path = getenv("PROFILE_OUT");
+    FILE *out = path ? fopen(path, "w") : NULL;
+    if (!out) return;
+    fprintf(out, "{\"interval_us\": %d, \"truncated\": %s, \"dropped_samples\": %lld, \"nodes\": [",
+            interval_us, nodes_full ? "true" : "false", dropped_samples);
+    for (int i = 1; i < node_count; i++) {
+        fprintf(out, "%s[%d, \"0x%lx\", %lld, %lld, %lld]", i > 1 ? ", " : "", nodes[i].parent, (unsigned long)nodes[i].fn,
+                nodes[i].calls, nodes[i].self_ns, nodes[i].total_ns);
+    }
+    fprintf(out, "], \"samples\": [");
+    int count = sample_count;
+    qsort(samples, count, sizeof(samples[0]), by_pc_then_node);
+    for (int i = 0, first = 1; i < count;) {
+        int j = i;
+        while (j < count && by_pc_then_node(&samples[i], &samples[j]) == 0) j++;
+        fprintf(out, "%s[[", first ? "" : ", ");
+        for (int k = 0; k <= FRAME_WALK && (k == 0 || samples[i].pc[k]); k++) {
+            fprintf(out, "%s\"0x%lx\"", k ? ", " : "", (unsigned long)samples[i].pc[k]);
+        }
+        fprintf(out, "], %d, %d]", samples[i].node, j - i);
+        first = 0;
+        i = j;
+    }
+    fprintf(out, "]}\n");
+    fclose(out);
+}
@@ -0,0 +1,94 @@
+"""Profiler harness, run inside a Python sandbox as `python -c <this file> SCRIPT OUT_PATH INTERVAL_US`.
+
+Runs SCRIPT as __main__ under cProfile (exact call counts, self and cumulative time per function)
+while a SIGPROF timer samples the Python stack every INTERVAL_US of CPU time (hot lines and
+collapsed stacks). The program keeps its own stdin/stdout/stderr and exit code; the profile is
+written as JSON to OUT_PATH once it finishes, including via sys.exit() or an uncaught exception.
+"""
+import os
+import sys
+import json
+import runpy
+import pstats
+import signal
+import cProfile
+import traceback
+import pkgutil # noqa: F401 - runpy imports it lazily; keep that out of the profile
+
+script, out_path, interval_us = sys.argv[1], sys.argv[2], int(sys.argv[3])
+sys.argv = [script]
+sys.path[0] = os.path.dirname(script)
+stop_files = {runpy.run_path.__code__.co_filename, "<string>"} # Harness frames: stacks are cut here
+hot_lines = {} # (line, function) in SCRIPT -> samples
+stacks = {} # "outer;...;inner" -> samples
+sample_count = 0
+
+
+def frame_label(code):
+    # No function calls here: they would show up in the cProfile table
+    name = getattr(code, "co_qualname", code.co_name)
+    if code.co_filename == script:
+        return name
+    return f"{code.co_filename.rsplit('/', 1)[-1]}:{name}"
+
+
+def on_sample(signum, frame):
+    global sample_count
+    labels, line_key = [], None
+    while frame is not None and frame.f_code.co_filename not in stop_files:
+        code = frame.f_code
+        if line_key is None and code.co_filename == script:
+            line_key = (frame.f_lineno, getattr(code, "co_qualname", code.co_name))
+        labels.append(frame_label(code))
+        frame = frame.f_back
+    if not labels:
+        return # Harness code, not the program
+    sample_count += 1
+    if line_key:
+        hot_lines[line_key] = hot_lines.get(line_key, 0) + 1
+    stack = ";".join(reversed(labels))
+    stacks[stack] = stacks.get(stack, 0) + 1
+
+
+def user_traceback(tb):
+    while tb is not None and tb.tb_frame.f_code.co_filename != script:
+        tb = tb.tb_next
+    return tb
+
+
+profiler = cProfile.Profile()
+signal.signal(signal.SIGPROF, on_sample)
+signal.setitimer(signal.ITIMER_PROF, interval_us / 1e6, interval_us / 1e6)
+exit_code = 0
+profiler.enable()
+try:
+    runpy.run_path(script, run_name="__main__")
+except SystemExit as e:
+    if e.code is None:
+        exit_code = 0
+    elif isinstance(e.code, int):
+        exit_code = e.code
+    else:
+        print(e.code, file=sys.stderr)
+        exit_code = 1
+except BaseException as e:
+    traceback.print_exception(type(e), e, user_traceback(e.__traceback__))
+    exit_code = 1
+finally:
+    profiler.disable()
+    signal.setitimer(signal.ITIMER_PROF, 0, 0)
+
+functions = []
+for (filename, line, name), (primitive_calls, calls, self_s, cumulative_s, _) in pstats.Stats(profiler).stats.items():
+    if filename in stop_files or name in ("<built-in method builtins.exec>", "<method 'disable' of '_lsprof.Profiler' objects>"):
+        continue # runpy's exec of the script and the profiler itself
+    functions.append([filename == script, filename, line, name, calls, primitive_calls, round(self_s * 1e9), round(cumulative_s * 1e9)])
+with open(out_path, "w") as f:
+    json.dump({
+        "functions": functions,
+        "hot_lines": [[line, name, count] for (line, name), count in hot_lines.items()],
+        "stacks": stacks,
+        "samples": sample_count,
+        "interval_us": interval_us,
+    }, f)
+sys.exit(exit_code) # Still runs the program's atexit handlers
@@ -0,0 +1,165 @@
+import time
+import random
+import threading
+import logging
+
+from core import docker_client, pool
+from core.metrics import parse_size
+
+logger = logging.getLogger(__name__)
+
+PLACEMENTS = ("p2c", "least_loaded")
+
+
+class Host:
+    """One Docker daemon runs can be placed on, with the load the dispatcher knows about."""
+
+    def __init__(self, config, base_url: str):
+        self.base_url = base_url
+        self.manager = docker_client.get_manager(config, base_url)
+        self.name = self.manager.name
+        self.active = 0 # Runs this process currently has in a sandbox here
+        self.failures = 0 # Consecutive infrastructure failures
+        self.ejected_until = 0.0
+        self.counters = {"dispatched": 0, "failures": 0, "ejections": 0}
+        self._pool = pool.get_pool(config, base_url) if config.POOL_ENABLED else None
+        self._seen_check = None # `checked_at` of the resources snapshot `_active_at_check` and `_idle_at_check` belong to
+        self._active_at_check = 0
+        self._idle_at_check = 0
+
+    def load(self) -> float:
+        """Busy containers on the daemon: the last `info` count, corrected by the runs this process started or finished since.
+
+        This process's idle pooled containers only run `sleep infinity`, so they are left out; a
+        host with a full warm pool is not busier than an empty one. Other web processes' runs show
+        up at the next health check; ours immediately. Without a snapshot yet, only our own runs
+        are known.
+        """
+        resources = self.manager.resources
+        if not resources or resources.get("containers_running") is None:
+            return self.active
+        if resources["checked_at"] != self._seen_check:
+            idle = sum(self._pool.stats()["idle"].values()) if self._pool else 0
+            self._seen_check, self._active_at_check, self._idle_at_check = resources["checked_at"], self.active, idle
+        return max(self.active, resources["containers_running"] - self._idle_at_check + self.active - self._active_at_check)
+
+    def capacity(self, cpus_per_run: float) -> float:
+        """How many runs fit at their CPU quota (DOCKER_CPUS), at least 1."""
+        cpus = (self.manager.resources or {}).get("cpus")
+        return max(1.0, cpus / cpus_per_run) if cpus and cpus_per_run > 0 else 1.0
+
+    def headroom(self, mem_per_run: int):
+        """Memory left once every running container uses its DOCKER_MEM_LIMIT, or None if the daemon's memory is unknown."""
+        mem_total = (self.manager.resources or {}).get("mem_total")
+        return mem_total - self.load() * mem_per_run if mem_total else None
+
+
+class HostSet:
+    """Places runs on the configured Docker hosts (DOCKER_HOSTS) and ejects failing ones.
+
+    `place()` picks among healthy, non-ejected hosts with room for one more DOCKER_MEM_LIMIT: with
+    "p2c" the less loaded of two random candidates (power of two choices: close to least-loaded,
+    but concurrent dispatchers working from slightly stale counts do not all pile onto the same
+    host), with "least_loaded" the least loaded of all. Load is running containers per CPU slot
+    (Host.load / Host.capacity). DOCKER_HOST_EJECT_FAILURES consecutive infrastructure failures
+    eject a host for DOCKER_HOST_EJECT_SECONDS; its manager keeps health-checking it meanwhile.
+    A lone host is never ejected: there is nowhere else to go.
+    """
+
+    def __init__(self, config):
+        if config.DOCKER_HOST_PLACEMENT not in PLACEMENTS:
+            raise ValueError(f"Unknown DOCKER_HOST_PLACEMENT '{config.DOCKER_HOST_PLACEMENT}' (expected one of: {', '.join(PLACEMENTS)})")
+        self.config = config
+        self.hosts = [Host(config, base_url) for base_url in docker_client.host_urls(config)]
+        self.placement = config.DOCKER_HOST_PLACEMENT
+        self.mem_per_run = parse_size(config.DOCKER_MEM_LIMIT)
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts every host's manager (health checks, resources, image cache)."""
+        for host in self.hosts:
+            host.manager.start()
+
+    def _has_room(self, host: Host) -> bool:
+        headroom = host.headroom(self.mem_per_run)
+        return headroom is None or headroom >= self.mem_per_run
+
+    def _score(self, host: Host):
+        headroom = host.headroom(self.mem_per_run)
+        return host.load() / host.capacity(self.config.DOCKER_CPUS), -(headroom or 0)
+
+    def place(self, exclude=()):
+        """Picks a host for one run and counts it as active there, or returns None if every host is excluded or ejected.
+
+        Healthy hosts are preferred; if none is healthy the others are still returned, so the caller's
+        synchronous health check (and error message) decides. Pair every placement with `release()`.
+        """
+        now = time.time()
+        with self._lock:
+            candidates = [host for host in self.hosts if host not in exclude and host.ejected_until <= now]
+            healthy = [host for host in candidates if host.manager.healthy]
+            roomy = [host for host in healthy if self._has_room(host)]
+            candidates = roomy or healthy or candidates
+            if not candidates:
+                return None
+            if self.placement == "p2c" and len(candidates) > 2:
+                candidates = self._random.sample(candidates, 2)
+            host = min(candidates, key=self._score)
+            host.active += 1
+            host.counters["dispatched"] += 1
+            return host
+
+    def release(self, host: Host):
+        with self._lock:
+            host.active -= 1
+
+    def record_success(self, host: Host):
+        host.failures = 0
+
+    def record_failure(self, host: Host, error):
+        """Counts an infrastructure failure (daemon unreachable, container start or Docker API error) against `host`."""
+        with self._lock:
+            host.failures += 1
+            host.counters["failures"] += 1
+            if len(self.hosts) < 2 or host.failures < self.config.DOCKER_HOST_EJECT_FAILURES or host.ejected_until > time.time():
+                return
+            host.ejected_until = time.time() + self.config.DOCKER_HOST_EJECT_SECONDS
+            host.failures = 0
+            host.counters["ejections"] += 1
+        logger.warning(f"Ejected Docker host {host.name} for {self.config.DOCKER_HOST_EJECT_SECONDS}s after "
+                       f"{self.config.DOCKER_HOST_EJECT_FAILURES} consecutive failures (last: {error})")
+
+    def stats(self) -> dict:
+        """Per-host numbers keyed by host name, shaped for /metrics gauges (one `key` label per host)."""
+        now = time.time()
+        stats = {"hosts": len(self.hosts), "placement": self.placement, "active": {}, "load": {}, "healthy": {}, "ejected": {},
+                 "headroom_mb": {}, "dispatched": {}, "failures": {}, "ejections": {}}
+        with self._lock:
+            for host in self.hosts:
+                headroom = host.headroom(self.mem_per_run)
+                stats["active"][host.name] = host.active
+                stats["load"][host.name] = round(host.load() / host.capacity(self.config.DOCKER_CPUS), 3)
+                stats["healthy"][host.name] = int(host.manager.healthy)
+                stats["ejected"][host.name] = int(host.ejected_until > now)
+                if headroom is not None:
+                    stats["headroom_mb"][host.name] = round(headroom / (1024 * 1024))
+                for key, value in host.counters.items():
+                    stats[key][host.name] = value
+        return stats
+
+
+_hosts = None
+_hosts_lock = threading.Lock()
+
+
+def get_hosts(config) -> HostSet:
+    """Returns the process-wide host set, creating it on first use.
+
+    Raises ValueError for an unknown DOCKER_HOST_PLACEMENT.
+    """
+    global _hosts
+    with _hosts_lock:
+        if _hosts is None:
+            _hosts = HostSet(config)
+        return _hosts
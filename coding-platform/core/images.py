@@ -0,0 +1,152 @@
+"""Project sandbox images: builds dockerfiles/<language> and points DOCKER_*_IMAGE at the result.
+
+Each image is tagged with a hash of its build context and build arguments
+(`coding-platform-cpp:<hash>`), so a daemon that already has the tag skips the build, and any
+change to a Dockerfile, the precompiled headers or the preinstalled packages produces a new tag
+(and, through the image digest, new compile-cache keys). The C++ image carries precompiled
+headers for IMAGE_CPP_PCH_HEADERS built with runner.CPP_COMPILE_FLAGS; the Python image has its
+standard library and IMAGE_PYTHON_PACKAGES byte-compiled.
+
+At startup (MANAGED_IMAGES) Config.validate() calls use_managed_images(); a host that was
+unreachable then builds the image on its first run (ensure_image, called by DockerBackend). To
+build on demand, run from the coding-platform directory:
+
+    python -m core.images [python] [cpp] [--force]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import logging
+
+from core import docker_client, runner
+
+logger = logging.getLogger(__name__)
+
+DOCKERFILES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dockerfiles")
+LANGUAGES = ("python", "cpp")
+IMAGE_SETTINGS = {"python": "DOCKER_PYTHON_IMAGE", "cpp": "DOCKER_CPP_IMAGE"} # Config attribute each built tag is assigned to
+IMAGE_HASH_LABEL = "coding-platform.image-hash"
+
+_build_locks = {} # (host name, tag) -> lock, so concurrent runs on a host missing the image build it once
+_build_locks_lock = threading.Lock()
+
+
+def build_args(config, language: str) -> dict:
+    if language == "cpp":
+        return {"PCH_FLAGS": " ".join(runner.CPP_COMPILE_FLAGS), "PCH_HEADERS": config.IMAGE_CPP_PCH_HEADERS}
+    return {"PYTHON_PACKAGES": config.IMAGE_PYTHON_PACKAGES}
+
+
+def content_hash(config, language: str) -> str:
+    """sha256 over every file of the language's build context (path and bytes) and its build arguments."""
+    context = os.path.join(DOCKERFILES_DIR, language)
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(context):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, context).encode("utf-8") + b"\0")
+            with open(path, "rb") as f:
+                digest.update(f.read())
+            digest.update(b"\0")
+    digest.update(json.dumps(build_args(config, language), sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def image_tag(config, language: str) -> str:
+    return f"coding-platform-{language}:{content_hash(config, language)[:16]}"
+
+
+def build(manager, config, language: str, force: bool = False) -> str:
+    """Builds the language's image on `manager`'s daemon unless it already has the tag. Returns the tag.
+
+    Raises docker.errors.BuildError or APIError if the build fails.
+    """
+    tag = image_tag(config, language)
+    if manager.has_image(tag) and not force:
+        logger.debug(f"Image {tag} already present on {manager.name}")
+        return tag
+    logger.info(f"Building {tag} on {manager.name} from {os.path.join(DOCKERFILES_DIR, language)}")
+    start_time = time.monotonic()
+    manager.build_image(os.path.join(DOCKERFILES_DIR, language), tag, build_args(config, language),
+                        {IMAGE_HASH_LABEL: content_hash(config, language)})
+    logger.info(f"Built {tag} on {manager.name} in {time.monotonic() - start_time:.1f}s")
+    return tag
+
+
+def ensure_image(manager, config, language: str, image_name: str):
+    """Makes sure `image_name` exists on `manager`'s daemon: a managed tag (image_tag) is built there, any other image pulled.
+
+    A managed tag exists in no registry, so a host that missed the startup build (unreachable
+    then, or added since) builds it on its first run. Raises docker.errors.BuildError or APIError.
+    """
+    if manager.has_image(image_name):
+        return
+    if image_name != image_tag(config, language):
+        manager.ensure_image(image_name)
+        return
+    with _build_locks_lock:
+        lock = _build_locks.setdefault((manager.name, image_name), threading.Lock())
+    with lock:
+        if not manager.has_image(image_name):
+            build(manager, config, language)
+
+
+def use_managed_images(config, managers: list, force: bool = False) -> dict:
+    """Builds (or finds) both project images on every manager in `managers` and points config.DOCKER_*_IMAGE at them.
+
+    `managers` are the hosts reachable now; the others build the images on their first run (see
+    ensure_image). A language whose build fails on any of `managers` keeps its configured image,
+    so every host runs the same image. Returns {language: tag or the build error}.
+    """
+    outcome = {}
+    for language in LANGUAGES:
+        try:
+            for manager in managers:
+                tag = build(manager, config, language, force)
+        except Exception as e:
+            logger.error(f"Could not build the {language} sandbox image, keeping {getattr(config, IMAGE_SETTINGS[language])}: {e}")
+            outcome[language] = f"Error: {e}"
+            continue
+        if managers:
+            setattr(config, IMAGE_SETTINGS[language], tag)
+            outcome[language] = tag
+    return outcome
+
+
+def main(argv=None) -> int:
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Build the project's sandbox images on every Docker host.")
+    parser.add_argument("languages", nargs="*", default=list(LANGUAGES), help="images to build (default: all)")
+    parser.add_argument("--force", action="store_true", help="rebuild even if a host already has the tag")
+    args = parser.parse_args(argv)
+    unknown = sorted(set(args.languages) - set(LANGUAGES))
+    if unknown:
+        parser.error(f"unknown language(s): {', '.join(unknown)} (expected: {', '.join(LANGUAGES)})")
+
+    failures = 0
+    for base_url in docker_client.host_urls(Config):
+        manager = docker_client.get_manager(Config, base_url)
+        manager.check_health()
+        if not manager.healthy:
+            print(f"{manager.name}: not reachable: {manager.last_error}")
+            failures += 1
+            continue
+        manager.refresh_images()
+        for language in args.languages:
+            try:
+                print(f"{manager.name}: {build(manager, Config, language, args.force)}")
+            except Exception as e:
+                print(f"{manager.name}: {language} build failed: {e}")
+                failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
+    sys.exit(main())
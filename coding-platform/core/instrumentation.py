@@ -0,0 +1,201 @@
+import re
+import time
+import bisect
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "codeplatform"
+# Upper bounds in seconds; wide enough for both sub-millisecond stages and whole runs or AI calls
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# name -> (type, help); every series must be described here before it is exported
+METRICS = {
+    "stage_duration_seconds": ("histogram", "Duration of one stage of an operation (run, benchmark, batch, gemini)."),
+    "operation_duration_seconds": ("histogram", "End-to-end duration of an operation."),
+    "job_queue_wait_seconds": ("histogram", "Time jobs spent queued before a worker picked them up."),
+    "runs_total": ("counter", "Finished /run executions by language, exit code and the stage that produced it (compile or execute)."),
+    "run_timeouts_total": ("counter", "Runs killed at DOCKER_TIMEOUT_SECONDS."),
+    "run_oom_kills_total": ("counter", "Runs killed with SIGKILL before the timeout, most likely by the memory limit."),
+    "run_output_limit_kills_total": ("counter", "Runs stopped for writing more than OUTPUT_LIMIT_BYTES of output."),
+    "gemini_requests_total": ("counter", "Gemini calls by outcome (ok, error, cache_hit, cancelled, rejected)."),
+    "gemini_errors_total": ("counter", "Failed Gemini calls by error class."),
+}
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram, as Prometheus exposes it."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # Last slot: above the largest bucket (+Inf)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float):
+        """Estimates the q-quantile by linear interpolation inside its bucket, like PromQL's histogram_quantile()."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets): # +Inf bucket: the largest finite bound is all we know
+                    return self.buckets[-1]
+                return lower + (self.buckets[i] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Registry:
+    """Process-wide counters and histograms, keyed by metric name and label set."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {} # (name, labels) -> value; labels is a sorted tuple of (key, value)
+        self._histograms = {} # (name, labels) -> Histogram
+
+    def inc(self, name: str, labels: dict = None, value: float = 1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, labels: dict = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def latency_summary(self) -> dict:
+        """{metric: {"label=value,...": {count, mean_ms, p50_ms, p95_ms, p99_ms}}} for the JSON /stats endpoint."""
+        summary = {}
+        with self._lock:
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                series = {"count": histogram.count, "mean_ms": round(histogram.sum / histogram.count * 1000, 2)}
+                for q in QUANTILES:
+                    series[f"p{round(q * 100)}_ms"] = round(histogram.quantile(q) * 1000, 2)
+                summary.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels) or "all"] = series
+        return summary
+
+    def render(self, gauges: dict = None) -> str:
+        """Prometheus text exposition (format 0.0.4) of every series, plus `gauges`.
+
+        `gauges` maps a component name to a stats dict, e.g. {"jobs": scheduler.stats()}; its
+        numeric values become `<prefix>_<component>_<key>` gauges, and one level of nested dicts
+        of numbers becomes a `key` label.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self._histograms.items())
+        for name, (kind, help_text) in METRICS.items():
+            full_name = f"{PREFIX}_{name}"
+            lines += [f"# HELP {full_name} {help_text}", f"# TYPE {full_name} {kind}"]
+            if kind == "counter":
+                lines += [f"{full_name}{_labels(labels)} {_number(value)}" for (metric, labels), value in counters if metric == name]
+                continue
+            for (metric, labels), (counts, total, count) in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{full_name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines += [f"{full_name}_sum{_labels(labels)} {_number(total)}", f"{full_name}_count{_labels(labels)} {count}"]
+        for component, stats in (gauges or {}).items():
+            lines += _gauge_lines(f"{PREFIX}_{component}", stats)
+        return "\n".join(lines) + "\n"
+
+
+def _number(value) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _metric_name(name: str) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _gauge_lines(prefix: str, stats: dict) -> list:
+    lines = []
+    for key, value in sorted(stats.items()):
+        name = _metric_name(f"{prefix}_{key}")
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (int, float)):
+            lines += [f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+        elif isinstance(value, dict) and value and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in value.values()):
+            lines.append(f"# TYPE {name} gauge")
+            lines += [f"{name}{_labels((('key', label),))} {_number(v)}" for label, v in sorted(value.items())]
+    return lines
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    return _registry
+
+
+def count(name: str, labels: dict = None, value: float = 1):
+    _registry.inc(name, labels, value)
+
+
+def observe(name: str, seconds: float, labels: dict = None):
+    _registry.observe(name, seconds, labels)
+
+
+class Timings:
+    """Span recorder for one operation, e.g. a run: `with timings.span("compile"): ...`.
+
+    Every span is observed into stage_duration_seconds{operation, stage} as it ends and kept for
+    the per-request `timings` breakdown; `finish()` records operation_duration_seconds.
+    """
+
+    def __init__(self, operation: str, labels: dict = None):
+        self.operation = operation
+        self.labels = labels or {}
+        self.stages = {} # stage -> ms, summed if a stage runs more than once
+        self._started = time.perf_counter()
+        self._total_ms = None
+
+    @contextmanager
+    def span(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0) + seconds * 1000
+        observe("stage_duration_seconds", seconds, {"operation": self.operation, "stage": stage, **self.labels})
+
+    def finish(self):
+        if self._total_ms is None:
+            seconds = time.perf_counter() - self._started
+            self._total_ms = seconds * 1000
+            observe("operation_duration_seconds", seconds, {"operation": self.operation, **self.labels})
+
+    def to_dict(self) -> dict:
+        total_ms = self._total_ms if self._total_ms is not None else (time.perf_counter() - self._started) * 1000
+        stages = {stage: round(ms, 2) for stage, ms in self.stages.items()}
+        return {"total_ms": round(total_ms, 2), "stages": stages,
+                "unaccounted_ms": round(max(0.0, total_ms - sum(self.stages.values())), 2)}
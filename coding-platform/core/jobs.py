@@ -0,0 +1,220 @@
+import time
+import uuid
+import math
+import threading
+import logging
+from collections import deque, OrderedDict
+
+from core import instrumentation, docker_client
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised by `JobScheduler.submit` when the queue is at capacity."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, lane: str, func, args: tuple):
+        self.id = str(uuid.uuid4())
+        self.lane = lane # Fairness lane, e.g. the language
+        self.func = func
+        self.args = args
+        self.status = "queued" # queued -> running -> done | failed
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = threading.Event() # Set once the job is done or failed
+
+    def to_dict(self) -> dict:
+        data = {"job_id": self.id, "status": self.status, "lane": self.lane, "submitted_at": self.submitted_at}
+        if self.started_at:
+            data["queue_ms"] = round((self.started_at - self.submitted_at) * 1000)
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobScheduler:
+    """Bounded worker pool with per-lane round-robin fairness and queue-depth backpressure.
+
+    Jobs wait in one FIFO per lane; workers take the next job from each non-empty lane in turn,
+    so a burst of C++ submissions cannot starve Python ones. At most JOB_WORKERS jobs per Docker host run at once
+    and at most JOB_QUEUE_MAX wait; beyond that `submit` raises QueueFullError. Finished jobs are
+    kept for JOB_RESULT_TTL_SECONDS so clients can poll for them.
+    """
+
+    def __init__(self, workers: int, max_queued: int, result_ttl: int, name: str = "job"):
+        self.name = name # Prefix of the worker threads' names
+        self.workers = workers
+        self.max_queued = max_queued
+        self.result_ttl = result_ttl
+        self._lanes = OrderedDict() # lane -> deque of queued jobs, rotated for round-robin
+        self._jobs = {} # job_id -> Job, including finished ones until they expire
+        self._queued = 0
+        self._running = 0
+        self._avg_job_seconds = 1.0 # Moving average used for retry hints
+        self._cond = threading.Condition()
+        self._threads = []
+        self.counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0}
+
+    def start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"{self.name}-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Job scheduler '{self.name}' started ({self.workers} workers, max {self.max_queued} queued).")
+
+    def submit(self, lane: str, func, *args) -> Job:
+        """Queues `func(*args)`; its return value becomes the job result."""
+        with self._cond:
+            self._expire_finished()
+            if self._queued >= self.max_queued:
+                self.counters["rejected"] += 1
+                raise QueueFullError(self._retry_after())
+            job = Job(lane, func, args)
+            self._jobs[job.id] = job
+            self._lanes.setdefault(lane, deque()).append(job)
+            self._queued += 1
+            self.counters["submitted"] += 1
+            self._cond.notify()
+        return job
+
+    def record(self, lane: str, result) -> Job:
+        """Registers an already finished job holding `result` (e.g. a cache hit), so it can be polled like any other."""
+        job = Job(lane, None, ())
+        job.status = "done"
+        job.result = result
+        job.started_at = job.finished_at = job.submitted_at
+        job.done.set()
+        with self._cond:
+            self._expire_finished()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def position(self, job: Job) -> int:
+        """Number of jobs ahead of `job` in its lane (0 when it is next or already running)."""
+        with self._cond:
+            lane = self._lanes.get(job.lane)
+            if job.status != "queued" or not lane:
+                return 0
+            return next((i for i, queued in enumerate(lane) if queued is job), 0)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                **self.counters,
+                "workers": self.workers,
+                "running": self._running,
+                "queued": self._queued,
+                "queued_by_lane": {lane: len(jobs) for lane, jobs in self._lanes.items()},
+                "avg_job_ms": round(self._avg_job_seconds * 1000),
+            }
+
+    def _retry_after(self) -> int:
+        # Time for the workers to drain the current backlog, at the observed job duration
+        return max(1, math.ceil((self._queued + self._running) * self._avg_job_seconds / self.workers))
+
+    def _next_job(self):
+        for _ in range(len(self._lanes)):
+            lane, jobs = next(iter(self._lanes.items()))
+            self._lanes.move_to_end(lane) # Next call starts from the following lane
+            if jobs:
+                return jobs.popleft()
+        return None
+
+    def _expire_finished(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._queued == 0:
+                    self._cond.wait()
+                job = self._next_job()
+                self._queued -= 1
+                self._running += 1
+                job.status = "running"
+                job.started_at = time.time()
+            instrumentation.observe("job_queue_wait_seconds", job.started_at - job.submitted_at, {"lane": job.lane})
+            try:
+                job.result = job.func(*job.args)
+                job.status = "done"
+            except Exception as e:
+                logger.error(f"Job {job.id} failed: {e}", exc_info=True)
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                with self._cond:
+                    self._running -= 1
+                    self.counters["completed" if job.status == "done" else "failed"] += 1
+                    self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * (job.finished_at - job.started_at)
+                job.func, job.args = None, None # Drop references to submitted code
+                job.done.set()
+
+
+_scheduler = None
+_search_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler(config) -> JobScheduler:
+    """Returns the process-wide scheduler, creating and starting it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            workers = config.JOB_WORKERS * len(docker_client.host_urls(config)) # Run capacity grows with the Docker hosts
+            _scheduler = JobScheduler(workers, config.JOB_QUEUE_MAX, config.JOB_RESULT_TTL_SECONDS)
+            _scheduler.start()
+        return _scheduler
+
+
+def get_search_scheduler(config) -> JobScheduler:
+    """Returns the process-wide scheduler for optimization searches, creating and starting it on first use.
+
+    A search spends most of its time waiting on the AI, so it runs on OPTIMIZE_SEARCH_WORKERS
+    threads of its own and queues only its sandbox steps on get_scheduler() (run_and_wait).
+    """
+    global _search_scheduler
+    with _scheduler_lock:
+        if _search_scheduler is None:
+            _search_scheduler = JobScheduler(config.OPTIMIZE_SEARCH_WORKERS, config.OPTIMIZE_SEARCH_QUEUE_MAX,
+                                             config.JOB_RESULT_TTL_SECONDS, name="search")
+            _search_scheduler.start()
+        return _search_scheduler
+
+
+def run_and_wait(config, lane: str, func, *args):
+    """Runs `func(*args)` as a job on get_scheduler() and returns its result; for callers outside its workers.
+
+    A full queue is waited out (its retry hint) rather than failing. Raises RuntimeError if the job failed.
+    """
+    scheduler = get_scheduler(config)
+    while True:
+        try:
+            job = scheduler.submit(lane, func, *args)
+            break
+        except QueueFullError as e:
+            time.sleep(e.retry_after)
+    job.done.wait()
+    if job.status == "failed":
+        raise RuntimeError(job.error)
+    return job.result
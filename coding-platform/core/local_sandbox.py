@@ -0,0 +1,300 @@
+import os
+import re
+import time
+import errno
+import shutil
+import signal
+import socket
+import hashlib
+import resource
+import selectors
+import tempfile
+import threading
+import subprocess
+import logging
+
+from core.metrics import parse_size
+from core.pool import SANDBOX_WORKDIR, COMPILE_CACHE_MOUNT_PATH
+
+try:
+    import seccomp # Optional: libseccomp's Python bindings
+except ImportError:
+    seccomp = None
+
+logger = logging.getLogger(__name__)
+
+# Syscalls a sandboxed process gets EPERM for when seccomp is available (network sockets are filtered by family)
+SECCOMP_DENIED = ["ptrace", "mount", "umount2", "pivot_root", "chroot", "unshare", "setns", "reboot", "kexec_load",
+                  "init_module", "finit_module", "delete_module", "swapon", "swapoff", "bpf", "perf_event_open"]
+NETWORK_FAMILIES = [socket.AF_INET, socket.AF_INET6, getattr(socket, "AF_PACKET", 17), getattr(socket, "AF_NETLINK", 16)]
+# Container directories in commands, as whole path components (e.g. "/sandbox/x.py", not "/sandboxes")
+CONTAINER_PATHS = re.compile(r"(?<![\w/.-])(?:%s)(?![\w.-])" % "|".join(re.escape(path) for path in (SANDBOX_WORKDIR, "/tmp", COMPILE_CACHE_MOUNT_PATH)))
+
+
+def _user_tasks() -> int:
+    """Tasks (processes and threads) running as this process's user, which RLIMIT_NPROC counts."""
+    uid, count = os.getuid(), 0
+    for entry in os.scandir("/proc"):
+        if entry.name.isdigit():
+            try:
+                if entry.stat().st_uid == uid:
+                    count += len(os.listdir(f"/proc/{entry.name}/task"))
+            except OSError:
+                pass # Exited meanwhile
+    return count
+
+
+def _tool_version(command: list) -> str:
+    try:
+        completed = subprocess.run(command, capture_output=True, timeout=10)
+        return (completed.stdout + completed.stderr).decode('utf-8', errors='replace').strip()
+    except (OSError, subprocess.TimeoutExpired) as e:
+        return f"unavailable: {e}"
+
+
+class LocalSandbox:
+    """A private scratch directory on this host where submissions run as plain processes.
+
+    Mirrors pool.Sandbox's interface so RunSession can drive either. Commands and environment
+    values are written against the container layout, so SANDBOX_WORKDIR, /tmp and
+    COMPILE_CACHE_MOUNT_PATH are rewritten to this sandbox's directories (and `python` to
+    LOCAL_PYTHON). Each process gets its own session, a minimal environment, setrlimit limits on
+    CPU time, memory (DOCKER_MEM_LIMIT as RLIMIT_DATA), file size, open files, processes
+    (SANDBOX_MAX_PROCESSES more than its user already runs; not enforced for root) and core dumps, a
+    fresh network namespace when `network_isolation` is on, and the SECCOMP_DENIED filter when
+    libseccomp is installed. When the timeout hits or the process exits, its whole process group
+    is SIGKILLed. Only as strong as those mechanisms: meant for trusted code.
+    """
+
+    container = None # No container: telemetry comes from the process's rusage (`usage_sampler`)
+    pooled = False
+    compile_cache_mounted = True # COMPILE_CACHE_MOUNT_PATH is remapped to COMPILE_CACHE_DIR
+
+    def __init__(self, language: str, config, network_isolation: bool):
+        self.language = language
+        self.config = config
+        self.network_isolation = network_isolation
+        self.root = tempfile.mkdtemp(prefix="sandbox-", dir=config.LOCAL_SANDBOX_ROOT)
+        self.workdir = os.path.join(self.root, "work")
+        self.tmpdir = os.path.join(self.root, "tmp")
+        os.mkdir(self.workdir, 0o700)
+        os.mkdir(self.tmpdir, 0o700)
+        self.uses = 0
+        self.last_usage = None # (wall_seconds, resource.struct_rusage) of the last process
+        self._process = None # The running process, for kill()
+        self._unshare_command = network_isolation and not hasattr(os, "unshare") # Before Python 3.12: the util-linux tool
+        self._paths = {SANDBOX_WORKDIR: self.workdir, "/tmp": self.tmpdir, COMPILE_CACHE_MOUNT_PATH: config.COMPILE_CACHE_DIR}
+
+    @property
+    def short_id(self):
+        return f"local-{os.path.basename(self.root)[8:18]}"
+
+    def _map(self, value: str) -> str:
+        # One pass, so a rewritten path (which may itself be under /tmp) is never rewritten again
+        return CONTAINER_PATHS.sub(lambda match: self._paths[match.group(0)], value)
+
+    def _command(self, cmd: list) -> list:
+        cmd = [self._map(arg) for arg in cmd]
+        if cmd[0] == "python":
+            cmd[0] = self.config.LOCAL_PYTHON
+        if self._unshare_command:
+            cmd = ["unshare", "--user", "--map-current-user", "--net", "--"] + cmd
+        return cmd
+
+    def _environment(self, environment: dict) -> dict:
+        env = {"PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"), "HOME": self.workdir, "TMPDIR": self.tmpdir,
+               "LANG": "C.UTF-8"}
+        env.update({key: self._map(value) for key, value in (environment or {}).items()})
+        return env
+
+    def _seccomp_filter(self):
+        if seccomp is None:
+            return None
+        rules = seccomp.SyscallFilter(defaction=seccomp.ALLOW)
+        for name in SECCOMP_DENIED:
+            if name == "unshare" and self._unshare_command:
+                continue # The unshare tool runs after the filter is loaded
+            rules.add_rule(seccomp.ERRNO(errno.EPERM), name)
+        for family in NETWORK_FAMILIES:
+            rules.add_rule(seccomp.ERRNO(errno.EPERM), "socket", seccomp.Arg(0, seccomp.EQ, family))
+        return rules
+
+    def _preexec(self, timeout_seconds: int, seccomp_filter):
+        memory = parse_size(self.config.DOCKER_MEM_LIMIT)
+        file_size = parse_size(self.config.LOCAL_SANDBOX_FILE_LIMIT)
+        # RLIMIT_NPROC counts every task of the user, the app's own threads included
+        processes = _user_tasks() + self.config.SANDBOX_MAX_PROCESSES
+        hard = resource.getrlimit(resource.RLIMIT_NPROC)[1]
+        if hard != resource.RLIM_INFINITY:
+            processes = min(processes, hard)
+
+        def limit():
+            # Runs in the child between fork and exec
+            resource.setrlimit(resource.RLIMIT_CPU, (timeout_seconds + 1, timeout_seconds + 1))
+            resource.setrlimit(resource.RLIMIT_DATA, (memory, memory))
+            resource.setrlimit(resource.RLIMIT_FSIZE, (file_size, file_size))
+            resource.setrlimit(resource.RLIMIT_NOFILE, (256, 256))
+            resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+            if self.network_isolation and hasattr(os, "unshare"):
+                os.unshare(os.CLONE_NEWUSER | os.CLONE_NEWNET)
+            # After unshare: a new user namespace keeps its creator's limit for the tasks outside it
+            resource.setrlimit(resource.RLIMIT_NPROC, (processes, processes))
+            if seccomp_filter is not None:
+                seccomp_filter.load()
+        return limit
+
+    def _spawn(self, cmd: list, timeout_seconds: int, workdir: str, environment: dict, stdin: bool):
+        return subprocess.Popen(
+            self._command(cmd), cwd=self._map(workdir), env=self._environment(environment),
+            stdin=subprocess.PIPE if stdin else subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            start_new_session=True, preexec_fn=self._preexec(timeout_seconds, self._seccomp_filter()),
+        )
+
+    @staticmethod
+    def _kill_group(process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def _run(self, cmd: list, timeout_seconds: int, on_chunk, workdir: str, environment: dict, stdin: bytes) -> int:
+        """Runs one process to completion, passing each output chunk to `on_chunk`; returns the exit code.
+
+        Signals are reported as 128 + signal number, like a shell (a timeout is 137).
+        """
+        started = time.monotonic()
+        process = self._spawn(cmd, timeout_seconds, workdir, environment, stdin is not None)
+        self._process = process
+        killer = threading.Timer(timeout_seconds, self._kill_group, args=(process,))
+        killer.daemon = True
+        killer.start()
+        if stdin is not None:
+            def feed():
+                try:
+                    process.stdin.write(stdin)
+                except OSError:
+                    pass # The process exited without reading all of its input
+                finally:
+                    try:
+                        process.stdin.close()
+                    except OSError:
+                        pass
+            threading.Thread(target=feed, name=f"local-stdin-{self.short_id}", daemon=True).start()
+        try:
+            status = None
+            with selectors.DefaultSelector() as selector:
+                selector.register(process.stdout, selectors.EVENT_READ, "stdout")
+                selector.register(process.stderr, selectors.EVENT_READ, "stderr")
+                while selector.get_map():
+                    for key, _ in selector.select(timeout=0.05):
+                        data = os.read(key.fileobj.fileno(), 65536)
+                        if data:
+                            on_chunk(key.data, data)
+                        else:
+                            selector.unregister(key.fileobj)
+                    if status is None:
+                        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+                        if pid:
+                            # Background children would keep the pipes open: the run ends with the main process
+                            self._kill_group(process)
+                        else:
+                            status = None
+            if status is None:
+                _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            self.last_usage = (time.monotonic() - started, usage)
+        finally:
+            killer.cancel()
+            self._process = None
+            self._kill_group(process) # Background children, or everything if on_chunk raised
+            process.stdout.close()
+            process.stderr.close()
+            if process.returncode is None:
+                process.wait()
+        return 128 - process.returncode if process.returncode < 0 else process.returncode
+
+    def exec_run(self, cmd: list, timeout_seconds: int, workdir: str = SANDBOX_WORKDIR, environment: dict = None, stdin: bytes = None):
+        """Runs `cmd`, SIGKILLed after `timeout_seconds`. Returns (exit_code, stdout_bytes, stderr_bytes)."""
+        parts = {"stdout": [], "stderr": []}
+        exit_code = self._run(cmd, timeout_seconds, lambda stream, data: parts[stream].append(data), workdir, environment, stdin)
+        return exit_code, b"".join(parts["stdout"]), b"".join(parts["stderr"])
+
+    def exec_stream(self, cmd: list, timeout_seconds: int, on_chunk, workdir: str = SANDBOX_WORKDIR, environment: dict = None, stdin: bytes = None):
+        """Like exec_run, but calls `on_chunk(stream_name, data)` as output arrives. If `on_chunk` raises, the process is killed."""
+        return self._run(cmd, timeout_seconds, on_chunk, workdir, environment, stdin)
+
+    def kill(self):
+        """SIGKILLs the running process's group (a cancelled run); exec_stream then returns."""
+        process = self._process
+        if process is not None:
+            self._kill_group(process)
+
+    def put_files(self, files: dict, directory: str = SANDBOX_WORKDIR, timeout_seconds: int = 30, mode: int = 0o644):
+        """Writes {relative_path: bytes} under `directory` with permissions `mode`. Raises RuntimeError on failure."""
+        base = os.path.realpath(self._map(directory))
+        try:
+            for name, data in files.items():
+                path = os.path.realpath(os.path.join(base, name))
+                if not path.startswith(base + os.sep):
+                    raise OSError(f"{name!r} is outside the sandbox")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(data)
+                os.chmod(path, mode)
+        except OSError as e:
+            raise RuntimeError(f"Could not copy files into sandbox {self.short_id}: {e}")
+
+    def usage_sampler(self):
+        return RusageSampler(self)
+
+    def destroy(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class RusageSampler:
+    """Telemetry for a LocalSandbox run, from the rusage of its process (same summary keys as metrics.TelemetrySampler)."""
+
+    def __init__(self, sandbox: LocalSandbox):
+        self.sandbox = sandbox
+
+    def start(self):
+        self.sandbox.last_usage = None
+
+    def stop(self, sole_tenant: bool = False) -> dict:
+        if self.sandbox.last_usage is None:
+            return {"source": "rusage", "samples": 0}
+        wall_seconds, usage = self.sandbox.last_usage
+        cpu_time_ms = (usage.ru_utime + usage.ru_stime) * 1000
+        return {
+            "source": "rusage",
+            "cpu_time_ms": round(cpu_time_ms, 1),
+            "cpu_percent": round(cpu_time_ms / max(wall_seconds * 1000, 1e-3) * 100, 1),
+            "peak_rss_bytes": usage.ru_maxrss * 1024,
+            "peak_mem_bytes": None,
+            "samples": 1,
+        }
+
+
+def network_isolation_available() -> bool:
+    """Whether unprivileged user + network namespaces work here (they are often disabled inside containers)."""
+    try:
+        if hasattr(os, "unshare"):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    os.unshare(os.CLONE_NEWUSER | os.CLONE_NEWNET)
+                    os._exit(0)
+                except OSError:
+                    os._exit(1)
+            return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]) == 0
+        return subprocess.run(["unshare", "--user", "--map-current-user", "--net", "--", "true"],
+                              capture_output=True, timeout=10).returncode == 0
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def toolchain_id(language: str, config) -> str:
+    """Identity of the host interpreter or compiler, standing in for the Docker image digest in cache keys."""
+    command = [config.LOCAL_PYTHON, "-VV"] if language == 'python' else ["g++", "--version"]
+    resolved = shutil.which(command[0]) or command[0]
+    return "local:" + hashlib.sha256(f"{resolved}\0{_tool_version(command)}".encode('utf-8')).hexdigest()
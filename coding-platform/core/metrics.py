@@ -1,47 +1,193 @@
-import docker
+import os
+import math
+import random
+import statistics
 import threading
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Note: Real-time stats polling is complex and not directly used by the current runner.
-# The runner gets final stats after completion. This function is for demonstration.
-def get_realtime_stats(container_id, stats_dict, stop_event, interval=1):
-    client = None
-    try:
-        client = docker.from_env()
-        container = client.containers.get(container_id)
-        logger.info(f"[Metrics Thread {container_id[:8]}]: Starting stats collection.")
-
-        max_mem = 0
-        # More complex CPU calculation needed here comparing readings over time
-
-        while not stop_event.is_set():
-            try:
-                stats = container.stats(stream=False) # Get a single snapshot
-
-                # Memory Usage (Peak)
-                mem_usage = stats.get('memory_stats', {}).get('usage', 0)
-                if mem_usage > max_mem:
-                    max_mem = mem_usage
-                stats_dict['peak_memory_bytes'] = max_mem
-
-            except docker.errors.NotFound:
-                logger.info(f"[Metrics Thread {container_id[:8]}]: Container not found, stopping.")
-                break
-            except Exception as e:
-                logger.error(f"[Metrics Thread {container_id[:8]}]: Error getting stats: {e}")
-                # Consider breaking or continuing based on error type
-            time.sleep(interval)
-        logger.info(f"[Metrics Thread {container_id[:8]}]: Stopping stats collection.")
-    except docker.errors.NotFound:
-         logger.warning(f"[Metrics Thread {container_id[:8]}]: Container gone before stats started.")
-    except Exception as e:
-        logger.error(f"[Metrics Thread {container_id[:8]}]: Initial connection error: {e}")
+def find_cgroup_dir(container_id: str, cgroup_root: str = "/sys/fs/cgroup"):
+    """Locates a container's cgroup v2 directory on this host, or None (cgroup v1, remote daemon...)."""
+    if not os.path.exists(os.path.join(cgroup_root, "cgroup.controllers")):
+        return None
+    for relative in (f"system.slice/docker-{container_id}.scope", # systemd cgroup driver
+                     f"docker/{container_id}",                     # cgroupfs driver
+                     f"docker.slice/docker-{container_id}.scope"):
+        path = os.path.join(cgroup_root, relative)
+        if os.path.isdir(path):
+            return path
+    return None
+
+def _read_flat_keyed(path):
+    with open(path) as f:
+        return {key: int(value) for key, value in (line.split() for line in f if line.strip())}
+
+def read_cgroup_sample(cgroup_dir: str) -> dict:
+    """One telemetry sample straight from cgroup v2 files (a few hundred microseconds)."""
+    cpu = _read_flat_keyed(os.path.join(cgroup_dir, "cpu.stat"))
+    memory = _read_flat_keyed(os.path.join(cgroup_dir, "memory.stat"))
+    return {
+        "t": time.monotonic(),
+        "cpu_usec": cpu.get("usage_usec", 0),
+        "nr_throttled": cpu.get("nr_throttled", 0),
+        "throttled_usec": cpu.get("throttled_usec", 0),
+        "rss_bytes": memory.get("anon", 0),
+    }
+
+def docker_stats_sample(stats: dict) -> dict:
+    """One telemetry sample from a Docker stats API response (cgroup v1 or v2 hosts)."""
+    cpu_stats = stats.get("cpu_stats", {})
+    throttling = cpu_stats.get("throttling_data", {})
+    memory_stats = stats.get("memory_stats", {})
+    inner = memory_stats.get("stats", {})
+    return {
+        "t": time.monotonic(),
+        "cpu_usec": cpu_stats.get("cpu_usage", {}).get("total_usage", 0) // 1000,
+        "nr_throttled": throttling.get("throttled_periods", 0),
+        "throttled_usec": throttling.get("throttled_time", 0) // 1000,
+        "rss_bytes": inner.get("anon", inner.get("rss", memory_stats.get("usage", 0))),
+        "max_usage": memory_stats.get("max_usage"), # cgroup v1 only
+    }
+
+class TelemetrySampler:
+    """Samples a sandbox's CPU and memory for the duration of one run.
+
+    Reads cgroup v2 files directly when the container's cgroup is visible on this host, otherwise
+    falls back to the Docker stats API. Counters are diffed between the first and last sample, so
+    the numbers cover only this run even in a reused pooled container. The sampler times itself
+    and doubles its interval whenever sampling costs more than `max_overhead_pct` of wall time.
+    """
+
+    def __init__(self, container, interval_ms: int, max_overhead_pct: float, max_points: int, cgroup_root: str):
+        self.container = container
+        self.interval = interval_ms / 1000
+        self.max_overhead = max_overhead_pct / 100
+        self.max_points = max_points
+        self.cgroup_dir = find_cgroup_dir(container.id, cgroup_root)
+        self.samples = []
+        self.overhead_seconds = 0.0
+        self._peak_file = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _open_peak_file(self):
+        # memory.peak is per-container lifetime, but since Linux 6.12 writing to an open
+        # descriptor resets the watermark for reads through that descriptor
+        try:
+            peak_file = open(os.path.join(self.cgroup_dir, "memory.peak"), "r+")
+            peak_file.write("reset\n")
+            peak_file.flush()
+            self._peak_file = peak_file
+        except OSError:
+            self._peak_file = None
+
+    def _read_peak(self):
+        try:
+            self._peak_file.seek(0)
+            return int(self._peak_file.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _sample(self):
+        started = time.perf_counter()
+        try:
+            if self.cgroup_dir:
+                self.samples.append(read_cgroup_sample(self.cgroup_dir))
+            else:
+                self.samples.append(docker_stats_sample(self.container.stats(stream=False, one_shot=True)))
+        except Exception as e:
+            logger.debug(f"Telemetry sample failed for {self.container.short_id}: {e}")
+        finally:
+            self.overhead_seconds += time.perf_counter() - started
+
+    def _loop(self):
+        interval = self.interval
+        started = time.monotonic()
+        while not self._stop_event.wait(interval):
+            self._sample()
+            elapsed = time.monotonic() - started
+            if self.overhead_seconds > self.max_overhead * elapsed:
+                interval = min(interval * 2, 1.0)
+
+    def start(self):
+        if self.cgroup_dir:
+            self._open_peak_file()
+        self._sample() # Baseline for the counter diffs
+        self._thread = threading.Thread(target=self._loop, name=f"telemetry-{self.container.short_id}", daemon=True)
+        self._thread.start()
+
+    def stop(self, sole_tenant: bool = False) -> dict:
+        """Stops sampling and returns the run's telemetry summary.
+
+        `sole_tenant` means the container served only this run, so lifetime peaks are usable.
+        """
+        self._stop_event.set()
+        self._thread.join(timeout=2)
+        self._sample()
+        peak_mem = self._read_peak() if self._peak_file else None
+        if self._peak_file:
+            self._peak_file.close()
+        if peak_mem is None and sole_tenant and self.samples:
+            peak_mem = self.samples[-1].get("max_usage")
+        return self.summarize(peak_mem)
+
+    def summarize(self, peak_mem=None) -> dict:
+        if len(self.samples) < 2:
+            return {"source": "cgroup" if self.cgroup_dir else "docker", "samples": len(self.samples)}
+        first, last = self.samples[0], self.samples[-1]
+        wall_seconds = max(last["t"] - first["t"], 1e-6)
+        cpu_time_ms = (last["cpu_usec"] - first["cpu_usec"]) / 1000
+        peak_rss = max(sample["rss_bytes"] for sample in self.samples)
+
+        series = []
+        for previous, sample in zip(self.samples, self.samples[1:]):
+            dt = max(sample["t"] - previous["t"], 1e-6)
+            series.append([
+                round((sample["t"] - first["t"]) * 1000),
+                round((sample["cpu_usec"] - previous["cpu_usec"]) / 1e6 / dt * 100, 1),
+                round(sample["rss_bytes"] / (1024 * 1024), 2),
+            ])
+        return {
+            "source": "cgroup" if self.cgroup_dir else "docker",
+            "cpu_time_ms": round(cpu_time_ms, 1),
+            "cpu_percent": round(cpu_time_ms / (wall_seconds * 1000) * 100, 1),
+            "peak_rss_bytes": peak_rss,
+            "peak_mem_bytes": peak_mem, # Includes page cache and tmpfs; None when unavailable
+            "throttled_periods": last["nr_throttled"] - first["nr_throttled"],
+            "throttled_ms": round((last["throttled_usec"] - first["throttled_usec"]) / 1000, 1),
+            "samples": len(self.samples),
+            "overhead_ms": round(self.overhead_seconds * 1000, 2),
+            "series": downsample(series, self.max_points), # [t_ms, cpu_percent, rss_mib]
+        }
+
+def downsample(series: list, max_points: int) -> list:
+    """Buckets [t, cpu, mem] points down to max_points, keeping mean CPU and peak memory per bucket."""
+    if len(series) <= max_points:
+        return series
+    bucket_size = len(series) / max_points
+    result = []
+    for i in range(max_points):
+        bucket = series[int(i * bucket_size):int((i + 1) * bucket_size)] or [series[-1]]
+        result.append([
+            bucket[-1][0],
+            round(sum(point[1] for point in bucket) / len(bucket), 1),
+            max(point[2] for point in bucket),
+        ])
+    return result
+
+def parse_size(size: str) -> int:
+    """Parses Docker-style sizes such as "128m", "128mb" or "1g" into bytes."""
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    size = str(size).strip().lower()
+    if size[-2:] in ('kb', 'mb', 'gb'):
+        size = size[:-1]
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
 
 def format_bytes(byte_val):
-    # This function isn't currently used as runner formats directly
     if byte_val is None or not isinstance(byte_val, (int, float)) or byte_val < 0:
         return "N/A"
     if byte_val == 0:
@@ -49,6 +195,132 @@ def format_bytes(byte_val):
     mib = byte_val / (1024 * 1024)
     return f"{mib:.2f} MiB"
 
-def estimate_complexity(code: str, language: str):
-    # Placeholder: True automatic complexity analysis is extremely difficult.
-    return {"time": "N/A (Manual)", "space": "N/A (Manual)"}
\ No newline at end of file
+# Candidate growth models, simplest first; ties are resolved in favour of the simpler model
+COMPLEXITY_MODELS = [
+    ("O(1)", lambda n: 0.0),
+    ("O(log n)", lambda n: math.log2(n)),
+    ("O(n)", lambda n: float(n)),
+    ("O(n log n)", lambda n: n * math.log2(n)),
+    ("O(n^2)", lambda n: float(n) ** 2),
+    ("O(n^3)", lambda n: float(n) ** 3),
+    ("O(2^n)", lambda n: 2.0 ** n),
+]
+
+def _fit_scaled(xs, ys):
+    """Least squares for y = a*x + c with a >= 0. Returns (a, c, residual sum of squares)."""
+    count = len(xs)
+    mean_x, mean_y = sum(xs) / count, sum(ys) / count
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    a = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sxx if sxx > 0 else 0.0
+    a = max(a, 0.0)
+    c = mean_y - a * mean_x
+    rss = sum((y - (a * x + c)) ** 2 for x, y in zip(xs, ys))
+    return a, c, rss
+
+def estimate_complexity(sizes: list, values: list, tolerance: float = 0.1):
+    """Fits measurements (runtime or memory) taken at input sizes `sizes` against COMPLEXITY_MODELS.
+
+    Picks the simplest model whose residual is within `tolerance` of the best fit (plus a noise
+    floor of 2% of the mean per point). Confidence combines how well the chosen model fits with how clearly
+    it beats the closest alternative. Returns None with fewer than three distinct sizes.
+    """
+    if len(set(sizes)) < 3 or len(sizes) != len(values):
+        return None
+    mean_y = sum(values) / len(values)
+    total_ss = sum((y - mean_y) ** 2 for y in values)
+    fits = []
+    for name, model in COMPLEXITY_MODELS:
+        try:
+            xs = [model(n) for n in sizes]
+        except OverflowError:
+            continue
+        if any(math.isinf(x) for x in xs):
+            continue
+        a, c, rss = _fit_scaled(xs, values)
+        fits.append({"model": name, "a": a, "c": c, "rss": rss})
+
+    noise_floor = (0.02 * mean_y) ** 2 * len(values)
+    threshold = min(fit["rss"] for fit in fits) * (1 + tolerance) + noise_floor
+    best = next(fit for fit in fits if fit["rss"] <= threshold)
+    alternative = min((fit["rss"] for fit in fits if fit is not best), default=None)
+    r2 = 1 - best["rss"] / total_ss if total_ss > 0 else 1.0
+    # Like R^2, but flat data within the noise floor counts as well explained (matters for O(1))
+    goodness = 1 - best["rss"] / (total_ss + noise_floor) if total_ss + noise_floor > 0 else 1.0
+    if alternative is None or best["model"] == "O(1)":
+        separation = 1.0 # Flat data: every growth model degenerates to the same constant fit
+    else:
+        low, high = sorted((best["rss"] + noise_floor, alternative + noise_floor))
+        separation = 1 - low / high if high > 0 else 0.0
+    return {
+        "model": best["model"],
+        "confidence": round(max(0.0, min(1.0, goodness)) * separation, 2),
+        "r2": round(r2, 4),
+        "coefficients": {"a": best["a"], "c": best["c"]},
+    }
+
+def predict_complexity(fit: dict, n: int):
+    """Extrapolates a fit from estimate_complexity() to input size n (None if it overflows)."""
+    model = dict(COMPLEXITY_MODELS)[fit["model"]]
+    try:
+        return fit["coefficients"]["a"] * model(n) + fit["coefficients"]["c"]
+    except OverflowError:
+        return None
+
+def percentile(ordered: list, q: float) -> float:
+    """Linearly interpolated percentile (q in 0..100) of an already sorted list."""
+    if len(ordered) == 1:
+        return ordered[0]
+    position = (len(ordered) - 1) * q / 100
+    low = math.floor(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def bootstrap_ci(values: list, statistic=statistics.median, confidence: float = 0.95, resamples: int = 2000, seed: int = 0):
+    """Percentile-bootstrap confidence interval (low, high) for `statistic` of `values`.
+
+    Seeded so the same samples always give the same interval.
+    """
+    rng = random.Random(seed)
+    n = len(values)
+    estimates = sorted(statistic(rng.choices(values, k=n)) for _ in range(resamples))
+    tail = (1 - confidence) / 2 * 100
+    return percentile(estimates, tail), percentile(estimates, 100 - tail)
+
+def summarize_samples(values: list, confidence: float = 0.95) -> dict:
+    """Descriptive statistics for repeated timings: min, median, mean, p95, stdev and a bootstrap
+    CI of the median. `ci_rel_pct` is the CI half-width relative to the median, i.e. the smallest
+    relative change these samples can resolve."""
+    ordered = sorted(values)
+    median = statistics.median(ordered)
+    ci_low, ci_high = bootstrap_ci(ordered, confidence=confidence) if len(ordered) > 1 else (median, median)
+    return {
+        "n": len(ordered),
+        "min": ordered[0],
+        "median": median,
+        "mean": statistics.fmean(ordered),
+        "p95": percentile(ordered, 95),
+        "stdev": statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        "ci_low": ci_low,
+        "ci_high": ci_high,
+        "confidence": confidence,
+        "ci_rel_pct": round((ci_high - ci_low) / 2 / median * 100, 2) if median else 0.0,
+    }
+
+def compare_samples(baseline: list, candidate: list, confidence: float = 0.95, resamples: int = 2000, seed: int = 0) -> dict:
+    """Speedup of `candidate` over `baseline` as the ratio of their medians (>1 means faster), with a
+    bootstrap CI. The difference is significant when the CI excludes 1."""
+    rng = random.Random(seed)
+    floor = 1e-9 # Guards against a zero median
+    speedup = statistics.median(baseline) / max(statistics.median(candidate), floor)
+    ratios = sorted(statistics.median(rng.choices(baseline, k=len(baseline))) /
+                    max(statistics.median(rng.choices(candidate, k=len(candidate))), floor)
+                    for _ in range(resamples))
+    tail = (1 - confidence) / 2 * 100
+    ci_low, ci_high = percentile(ratios, tail), percentile(ratios, 100 - tail)
+    return {
+        "speedup": round(speedup, 3),
+        "ci_low": round(ci_low, 3),
+        "ci_high": round(ci_high, 3),
+        "confidence": confidence,
+        "significant": ci_low > 1 or ci_high < 1,
+    }
@@ -0,0 +1,379 @@
+import difflib
+import statistics
+import threading
+import logging
+
+from core import runner, metrics, ai_coder, ai_gateway, analyzer, profiler, jobs
+
+logger = logging.getLogger(__name__)
+
+MEMORY_NOISE_BYTES = 1024 * 1024 # Peak-memory differences below this are treated as noise
+ALLOCATION_NOISE_PCT = 2.0 # Traced heap peaks barely vary between runs; smaller differences are noise
+ALLOCATION_NOISE_BYTES = 4096
+
+# Rewrite directions for the candidates of one search round (search_optimizations), so parallel requests explore different ideas
+SEARCH_STRATEGIES = (
+    "Look for a better algorithm or data structure first.",
+    "Keep the algorithm, but cut constant factors: repeated work, allocations and slow I/O.",
+    "Use the language's fastest idioms and standard library facilities in the hot spots.",
+    "Reduce memory traffic: fewer copies, more compact data, better locality.",
+)
+SEARCH_FEEDBACK_ATTEMPTS = 8 # Most recent candidates described in the search prompt
+SEARCH_HOT_SPOTS = 5 # Hottest functions and lines each described in the search prompt
+
+
+def _normalize_output(text: str) -> str:
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+def _peak_memory(run: dict):
+    telemetry = run["metrics"].get("telemetry") or {}
+    return telemetry.get("peak_mem_bytes") or telemetry.get("peak_rss_bytes")
+
+
+def _reference_runs(code: str, language: str, config, label: str):
+    """Runs `code` OPTIMIZE_VERIFY_RUNS times. Returns (output, peak_memory_samples, None) or (None, None, problem).
+
+    A run succeeds on exit code 0: `error` then only holds the program's stderr (warnings,
+    debug prints), which is not part of the output compared for equivalence.
+    """
+    outputs, peaks = [], []
+    for _ in range(max(1, config.OPTIMIZE_VERIFY_RUNS)):
+        run = runner.execute_code(code, language, config)
+        if run.get("exit_code") != 0:
+            return None, None, f"The {label} code failed: {(run.get('error') or 'exit code ' + str(run.get('exit_code')))[:300]}"
+        outputs.append(_normalize_output(run["output"]))
+        peak = _peak_memory(run)
+        if peak:
+            peaks.append(peak)
+    if len(set(outputs)) > 1:
+        return None, None, f"The {label} code's output differs between runs, so equivalence cannot be checked."
+    return outputs[0], peaks, None
+
+
+def _benchmark(code: str, language: str, config, label: str):
+    """Benchmarks `code`. Returns (summary, samples_ms, None) or (None, None, problem)."""
+    bench = runner.benchmark_code(code, language, config)
+    summary = bench["metrics"].get("benchmark")
+    if bench.get("error") or not summary:
+        return None, None, f"Benchmarking the {label} code failed: {(bench.get('error') or 'no timings')[:300]}"
+    return summary, summary.pop("samples_ms"), None
+
+
+def _output_diff(original_output: str, candidate_output: str) -> str:
+    diff = difflib.unified_diff(original_output.splitlines(), candidate_output.splitlines(),
+                                "original", "optimized", lineterm="", n=1)
+    return "\n".join(list(diff)[:40])
+
+
+def _memory_delta(original_peaks: list, candidate_peaks: list):
+    if not original_peaks or not candidate_peaks:
+        return None
+    original, candidate = statistics.median(original_peaks), statistics.median(candidate_peaks)
+    # Significant only if larger than either program's own run-to-run variation
+    noise = max(max(original_peaks) - min(original_peaks), max(candidate_peaks) - min(candidate_peaks), MEMORY_NOISE_BYTES)
+    delta = candidate - original
+    return {
+        "original_bytes": original,
+        "candidate_bytes": candidate,
+        "delta_bytes": delta,
+        "delta_pct": round(delta / original * 100, 1) if original else None,
+        "significant": abs(delta) > noise,
+    }
+
+
+def _allocation_delta(original: str, candidate: str, language: str, config):
+    """Runs both versions once in memory mode and compares their traced peak heap; None if either has no report."""
+    peaks = []
+    for code in (original, candidate):
+        report = runner.execute_code(code, language, config, memory=True).get("memory") or {}
+        if "peak_bytes" not in report:
+            return None
+        peaks.append(report["peak_bytes"])
+    original, candidate = peaks
+    delta = candidate - original
+    return {
+        "tracer": report["tracer"],
+        "original_peak_bytes": original,
+        "candidate_peak_bytes": candidate,
+        "delta_bytes": delta,
+        "delta_pct": round(delta / original * 100, 1) if original else None,
+        "significant": abs(delta) > max(original * ALLOCATION_NOISE_PCT / 100, ALLOCATION_NOISE_BYTES),
+    }
+
+
+def verify_optimization(original: str, candidate: str, language: str, config) -> dict:
+    """Checks that `candidate` prints the same output as `original` and measures whether it is faster.
+
+    Both programs are run OPTIMIZE_VERIFY_RUNS times and their normalized stdout compared, then both
+    are benchmarked (runner.benchmark_code). With OPTIMIZE_VERIFY_ALLOCATIONS, both also run once in
+    memory mode, so a memory improvement is judged on traced heap allocations rather than container
+    memory. The candidate is accepted only if its output matches and it is significantly faster,
+    or not significantly slower while using significantly less memory. Returns a dict with
+    `accepted`, a human-readable `reason`, `equivalent`, `speed` (speedup of the candidate with a
+    bootstrap CI), `memory` (container peak-memory delta), `allocations` (traced peak-heap delta)
+    and both benchmark summaries.
+    """
+    verification = {"accepted": False, "reason": "", "equivalent": None, "speed": None, "memory": None, "allocations": None,
+                    "benchmarks": {}}
+
+    original_output, original_peaks, problem = _reference_runs(original, language, config, "original")
+    if problem:
+        verification["reason"] = f"Could not verify the optimization. {problem}"
+        return verification
+    candidate_output, candidate_peaks, problem = _reference_runs(candidate, language, config, "optimized")
+    if problem:
+        verification["reason"] = problem
+        return verification
+
+    verification["equivalent"] = original_output == candidate_output
+    if not verification["equivalent"]:
+        verification["output_diff"] = _output_diff(original_output, candidate_output)
+        verification["reason"] = "The optimized code prints different output."
+        return verification
+
+    samples = {}
+    for label, code in (("original", original), ("optimized", candidate)):
+        summary, samples[label], problem = _benchmark(code, language, config, label)
+        if problem:
+            verification["reason"] = problem
+            return verification
+        verification["benchmarks"][label] = summary
+
+    speed = metrics.compare_samples(samples["original"], samples["optimized"])
+    memory = _memory_delta(original_peaks, candidate_peaks)
+    allocations = _allocation_delta(original, candidate, language, config) if config.OPTIMIZE_VERIFY_ALLOCATIONS else None
+    verification["speed"], verification["memory"], verification["allocations"] = speed, memory, allocations
+    faster = speed["significant"] and speed["speedup"] > 1
+    slower = speed["significant"] and speed["speedup"] < 1
+    if allocations: # Exact allocation data beats container-level sampling
+        leaner = allocations["significant"] and allocations["delta_bytes"] < 0
+        saved = -allocations["delta_bytes"]
+    else:
+        leaner = bool(memory and memory["significant"] and memory["delta_bytes"] < 0)
+        saved = -memory["delta_bytes"] if memory else 0
+    ci = f"{speed['speedup']}x (95% CI {speed['ci_low']}-{speed['ci_high']}x)"
+    if faster:
+        verification["accepted"], verification["reason"] = True, f"The optimized code is faster: {ci}."
+    elif slower:
+        verification["reason"] = f"The optimized code is slower: {ci}."
+    elif leaner:
+        verification["accepted"] = True
+        measured = "peak heap (traced allocations)" if allocations else "peak memory"
+        verification["reason"] = f"No significant speed difference ({ci}), but {measured} drops by {metrics.format_bytes(saved)}."
+    else:
+        verification["reason"] = f"No measurable improvement: {ci}."
+    return verification
+
+
+def choose_candidate(code: str, candidate: str, language: str, config, analysis: dict = None) -> dict:
+    """Verifies an AI `candidate` for `code` and picks the version to recommend.
+
+    Returns {"optimized_code", "candidate_code", "accepted", "verification"}, where `optimized_code`
+    is the candidate if it was accepted and the original otherwise, plus the static `analysis` of
+    `code` when it is given.
+    """
+    if _normalize_output(candidate) == _normalize_output(code):
+        verification = {"accepted": False, "reason": "The AI returned the code unchanged."}
+    else:
+        verification = verify_optimization(code, candidate, language, config)
+    logger.info(f"Optimization verified for {language} code: accepted={verification['accepted']} ({verification['reason']})")
+    chosen = {
+        "optimized_code": candidate if verification["accepted"] else code,
+        "candidate_code": candidate,
+        "accepted": verification["accepted"],
+        "verification": verification,
+    }
+    if analysis is not None:
+        chosen["analysis"] = analysis
+    return chosen
+
+
+def _hot_spots(code: str, language: str, config) -> list:
+    """The submission's hottest functions and lines from one profiled run, one description each; [] if profiling failed."""
+    profile = runner.execute_code(code, language, config, profile=True).get("profile") or {}
+    functions = [f for f in profile.get("functions", []) if f.get("file") == profiler.SUBMISSION][:SEARCH_HOT_SPOTS]
+    spots = [f"function {f['function']} (line {f['line']}): {f['self_pct']}% of the run time in {f['calls']} calls" for f in functions]
+    spots += [f"line {line['line']} in {line['function']}: {line['pct']}% of the samples" for line in profile.get("hot_lines", [])[:SEARCH_HOT_SPOTS]]
+    return spots
+
+
+def _describe_attempt(entry: dict) -> str:
+    where = f"Round {entry['round']}, candidate {entry['candidate']}"
+    if entry["status"] == "wrong_output":
+        return f"{where}: printed different output, so it was rejected. Output diff:\n{entry['output_diff']}"
+    if entry["status"] in ("failed", "ai_error", "rejected"):
+        return f"{where}: {entry['error']}"
+    if entry["status"] == "unchanged":
+        return f"{where}: repeated a version that was already measured."
+    speed = entry["speed"]
+    return (f"{where}: {entry['median_ms']:.3f} ms median, {speed['speedup']}x the original's speed "
+            f"(95% CI {speed['ci_low']}-{speed['ci_high']}x){' - the current best' if entry.get('selected') else ''}.")
+
+
+def _search_feedback(baseline: dict, best: dict, history: list, hints: str) -> str:
+    """What the next search round's prompt is told: baseline and best measurements, hot spots and recent attempts."""
+    lines = [f"The original code: {baseline['median_ms']:.3f} ms median over {baseline['benchmark']['n']} runs"
+             + (f", peak memory {metrics.format_bytes(baseline['peak_memory_bytes'])}." if baseline["peak_memory_bytes"] else ".")]
+    if best["entry"] is not baseline:
+        lines.append(f"The code below is the fastest correct version so far (round {best['entry']['round']}): "
+                     f"{best['entry']['median_ms']:.3f} ms median, {best['entry']['speed']['speedup']}x the original's speed.")
+    if best["entry"].get("hot_spots"):
+        lines.append("Profile of the code below, hottest first:")
+        lines += [f"- {spot}" for spot in best["entry"]["hot_spots"]]
+    if hints and best["entry"] is baseline:
+        lines.append(f"A static analysis flagged these likely hotspots:\n{hints}")
+    if history:
+        lines.append("Earlier candidates:")
+        lines += [f"- {_describe_attempt(entry)}" for entry in history[-SEARCH_FEEDBACK_ATTEMPTS:]]
+    return "\n".join(lines)
+
+
+def _request_candidates(code: str, language: str, config, feedback: str, width: int, client: str) -> list:
+    """Asks for `width` candidates in parallel, one per SEARCH_STRATEGIES entry. Returns the AI reply or the Rejected error of each."""
+    replies = [None] * width
+
+    def request(index):
+        try:
+            replies[index] = ai_coder.refine_via_gemini(code, language, config.GEMINI_API_KEY, feedback, SEARCH_STRATEGIES[index],
+                                                        config, client)
+        except ai_gateway.Rejected as e:
+            replies[index] = e
+        except Exception as e:
+            replies[index] = f"Error: {e}"
+
+    threads = [threading.Thread(target=request, args=(index,), name=f"optimize-search-{index}", daemon=True) for index in range(width)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return replies
+
+
+def _measure_baseline(code: str, language: str, config):
+    """Runs, benchmarks and profiles the original for a search. Returns (output, baseline, samples, None) or (None, None, None, problem)."""
+    output, peaks, problem = _reference_runs(code, language, config, "original")
+    if not problem:
+        summary, samples, problem = _benchmark(code, language, config, "original")
+    if problem:
+        return None, None, None, problem
+    baseline = {"median_ms": summary["median"], "peak_memory_bytes": statistics.median(peaks) if peaks else None,
+                "benchmark": summary, "hot_spots": _hot_spots(code, language, config)}
+    return output, baseline, samples, None
+
+
+def _evaluate_candidate(entry: dict, candidate: str, language: str, config, original_output: str, original_samples: list):
+    """Checks a candidate's output against the original and benchmarks it, filling in `entry`. Returns its samples if it is correct."""
+    output, peaks, problem = _reference_runs(candidate, language, config, "candidate")
+    if problem:
+        entry.update(status="failed", error=problem)
+        return None
+    if output != original_output:
+        entry.update(status="wrong_output", output_diff=_output_diff(original_output, output))
+        return None
+    summary, samples, problem = _benchmark(candidate, language, config, "candidate")
+    if problem:
+        entry.update(status="failed", error=problem)
+        return None
+    entry.update(median_ms=summary["median"], peak_memory_bytes=statistics.median(peaks) if peaks else None, benchmark=summary,
+                 speed=metrics.compare_samples(original_samples, samples))
+    return samples
+
+
+def search_optimizations(code: str, language: str, config, client: str = None, rounds: int = None, candidates: int = None) -> dict:
+    """Measurement-guided optimization: up to `rounds` rounds of `candidates` AI rewrites each, keeping the fastest correct one.
+
+    The original is run, benchmarked and profiled first. Every round asks for its candidates in
+    parallel, each with a different SEARCH_STRATEGIES direction, starting from the fastest correct
+    version so far and told its measured runtime, memory and profile hot spots and how the earlier
+    candidates fared (speedups, failures, output diffs). Candidates are then checked and
+    benchmarked one at a time, so their timings do not compete for the CPU. A candidate must print
+    the original's output and be significantly faster than the round's starting version to take
+    its place. The search stops early once a round brings nothing new, or when the AI gateway
+    admits none of a round's calls (every candidate counts against `client`'s AI rate limit).
+
+    Meant to run on jobs.get_search_scheduler(): the AI calls wait on the search's own thread,
+    and each measurement (the original's, every candidate's, the winner's profile) is queued as a
+    sandbox job (jobs.run_and_wait), so a search only holds a job worker while something runs.
+
+    Returns `optimized_code` (the original if nothing won), `accepted`, a `reason`, the `baseline`
+    measurements, every candidate in `history` (with code, status, median_ms and `speed` against
+    the original), the best median per round in `trajectory`, and `analysis`. Returns
+    {"error": ...} if the original cannot be measured or the first round's AI calls all failed
+    (with `retry_after` if they were not admitted).
+    """
+    rounds = max(1, min(int(rounds or config.OPTIMIZE_SEARCH_ROUNDS), config.OPTIMIZE_SEARCH_MAX_ROUNDS))
+    width = max(1, min(int(candidates or config.OPTIMIZE_SEARCH_CANDIDATES), config.OPTIMIZE_SEARCH_MAX_CANDIDATES, len(SEARCH_STRATEGIES)))
+    analysis = analyzer.analyze_submission(code, language, config)
+    hints = analyzer.format_hints(analysis, config.ANALYZER_PROMPT_HINTS) if analysis else ""
+
+    original_output, baseline, original_samples, problem = jobs.run_and_wait(config, language, _measure_baseline, code, language, config)
+    if problem:
+        return {"error": f"Error: Could not measure the original code. {problem}", "analysis": analysis}
+    best = {"code": code, "samples": original_samples, "entry": baseline}
+    history, seen = [], {_normalize_output(code)}
+    trajectory = [{"round": 0, "median_ms": baseline["median_ms"]}]
+    stopped = ""
+
+    for round_number in range(1, rounds + 1):
+        replies = _request_candidates(best["code"], language, config, _search_feedback(baseline, best, history, hints), width, client)
+        if all(isinstance(reply, ai_gateway.Rejected) for reply in replies):
+            if round_number == 1:
+                return {"error": f"Error: {replies[0]}", "retry_after": replies[0].retry_after, "analysis": analysis}
+            stopped = f" The search stopped after round {round_number - 1}: {replies[0]}"
+            break
+        if round_number == 1 and all(isinstance(reply, str) and reply.startswith("Error:") for reply in replies):
+            return {"error": replies[0], "analysis": analysis}
+
+        winner, new = None, 0
+        for index, reply in enumerate(replies):
+            entry = {"round": round_number, "candidate": index + 1, "strategy": SEARCH_STRATEGIES[index]}
+            history.append(entry)
+            if isinstance(reply, ai_gateway.Rejected):
+                entry.update(status="rejected", error=f"not requested: {reply}")
+                continue
+            if reply.startswith("Error:"):
+                entry.update(status="ai_error", error=reply)
+                continue
+            entry["code"] = reply
+            if _normalize_output(reply) in seen:
+                entry["status"] = "unchanged"
+                continue
+            seen.add(_normalize_output(reply))
+            new += 1
+            samples = jobs.run_and_wait(config, language, _evaluate_candidate, entry, reply, language, config, original_output,
+                                        original_samples)
+            if samples is None:
+                continue
+            against_best = metrics.compare_samples(best["samples"], samples)
+            entry["status"] = ("faster" if against_best["significant"] and against_best["speedup"] > 1 else
+                               "slower" if against_best["significant"] else "no_difference")
+            if entry["status"] == "faster" and (winner is None or entry["median_ms"] < winner["entry"]["median_ms"]):
+                winner = {"code": reply, "samples": samples, "entry": entry}
+
+        if winner:
+            winner["entry"]["selected"] = True
+            winner["entry"]["hot_spots"] = jobs.run_and_wait(config, language, _hot_spots, winner["code"], language, config)
+            best = winner
+        trajectory.append({"round": round_number, "median_ms": best["entry"]["median_ms"]})
+        logger.info(f"Optimization search round {round_number}/{rounds} for {language} code: {new} new candidate(s), "
+                    f"best {best['entry']['median_ms']:.3f} ms (original {baseline['median_ms']:.3f} ms)")
+        if not new:
+            break
+
+    accepted = best["entry"] is not baseline
+    if accepted:
+        speed = best["entry"]["speed"]
+        reason = (f"Round {best['entry']['round']}, candidate {best['entry']['candidate']} is the fastest correct version: "
+                  f"{speed['speedup']}x (95% CI {speed['ci_low']}-{speed['ci_high']}x) the original's speed.")
+    else:
+        reason = f"None of the {len(history)} candidates was both correct and significantly faster than the original."
+    return {
+        "optimized_code": best["code"],
+        "accepted": accepted,
+        "reason": reason + stopped,
+        "baseline": baseline,
+        "history": history,
+        "trajectory": trajectory,
+        "analysis": analysis,
+    }
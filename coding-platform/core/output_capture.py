@@ -0,0 +1,115 @@
+"""Bounded capture of a program's stdout and stderr.
+
+Output is consumed chunk by chunk as the sandbox's exec stream delivers it (already
+demultiplexed), keeping the first OUTPUT_HEAD_BYTES and the last OUTPUT_TAIL_BYTES of each
+stream and counting the rest, so a run holds the same amount of memory however much the program
+prints. Once stdout and stderr together exceed OUTPUT_LIMIT_BYTES the capture raises
+OutputLimitExceeded from the chunk callback, which makes the sandbox abandon (local: kill) the
+process; the runner then discards the sandbox.
+"""
+
+
+class OutputLimitExceeded(Exception):
+    """Raised from OutputCapture.on_chunk once the program has written more than the output limit."""
+
+
+class RingBuffer:
+    """The last `size` bytes written to it, in a fixed-size buffer."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._buffer = bytearray(size)
+        self._position = 0 # Where the next byte goes
+        self._filled = 0
+
+    def write(self, data: bytes):
+        if not self.size or not data:
+            return
+        data = data[-self.size:]
+        first = min(len(data), self.size - self._position)
+        self._buffer[self._position:self._position + first] = data[:first]
+        self._buffer[:len(data) - first] = data[first:]
+        self._position = (self._position + len(data)) % self.size
+        self._filled = min(self.size, self._filled + len(data))
+
+    def getvalue(self) -> bytes:
+        if self._filled < self.size:
+            return bytes(self._buffer[:self._filled])
+        return bytes(self._buffer[self._position:] + self._buffer[:self._position])
+
+
+class StreamCapture:
+    """Head and tail of one output stream plus its total size."""
+
+    def __init__(self, head_bytes: int, tail_bytes: int):
+        self.head_bytes = head_bytes
+        self.head = bytearray()
+        self.tail = RingBuffer(tail_bytes)
+        self.total = 0
+
+    def feed(self, data: bytes):
+        self.total += len(data)
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        self.tail.write(data)
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > self.head_bytes + self.tail.size
+
+    def getvalue(self) -> bytes:
+        """Everything written if it fit, otherwise the head and tail around a marker with the number of bytes left out."""
+        if not self.truncated:
+            return bytes(self.head) + self.tail.getvalue()
+        omitted = self.total - len(self.head) - self.tail.size
+        return bytes(self.head) + f"\n... [{omitted} bytes omitted] ...\n".encode("utf-8") + self.tail.getvalue()
+
+
+class OutputCapture:
+    """Bounded stdout/stderr capture for one exec; pass `on_chunk` as the sandbox's chunk callback.
+
+    `limit_bytes` 0 means no limit. With `forward(stream_name, data)` (streaming runs), every
+    chunk is passed on instead of kept, and the streams are only counted.
+    """
+
+    def __init__(self, head_bytes: int, tail_bytes: int, limit_bytes: int, forward=None):
+        if forward:
+            head_bytes = tail_bytes = 0
+        self.streams = {name: StreamCapture(head_bytes, tail_bytes) for name in ("stdout", "stderr")}
+        self.limit_bytes = limit_bytes
+        self.forward = forward
+        self.limit_exceeded = False
+
+    @classmethod
+    def from_config(cls, config, forward=None):
+        return cls(config.OUTPUT_HEAD_BYTES, config.OUTPUT_TAIL_BYTES, config.OUTPUT_LIMIT_BYTES, forward)
+
+    def on_chunk(self, stream_name: str, data: bytes):
+        self.streams[stream_name].feed(data)
+        if self.forward:
+            self.forward(stream_name, data)
+        if self.limit_bytes and self.total > self.limit_bytes:
+            self.limit_exceeded = True
+            raise OutputLimitExceeded(f"The program wrote more than {self.limit_bytes} bytes of output.")
+
+    @property
+    def total(self) -> int:
+        return sum(stream.total for stream in self.streams.values())
+
+    @property
+    def truncated(self) -> bool:
+        return self.limit_exceeded or (not self.forward and any(stream.truncated for stream in self.streams.values()))
+
+    def stdout(self) -> bytes:
+        """The kept stdout (see StreamCapture.getvalue), or b"" if it was forwarded."""
+        return b"" if self.forward else self.streams["stdout"].getvalue()
+
+    def stderr(self) -> bytes:
+        return b"" if self.forward else self.streams["stderr"].getvalue()
+
+    def stats(self) -> dict:
+        """For the run's metrics: bytes written per stream and whether anything was left out."""
+        return {"stdout_bytes": self.streams["stdout"].total, "stderr_bytes": self.streams["stderr"].total,
+                "truncated": self.truncated, "limit_exceeded": self.limit_exceeded}
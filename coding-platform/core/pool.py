@@ -0,0 +1,356 @@
+import io
+import time
+import queue
+import tarfile
+import socket
+import threading
+import logging
+from collections import deque
+
+import docker
+from docker.utils.socket import frames_iter, STDOUT
+
+from core import docker_client
+
+logger = logging.getLogger(__name__)
+
+# Paths inside every sandbox container
+SANDBOX_WORKDIR = "/sandbox"    # Per-container tmpfs for source, compile output and scratch files
+COMPILE_CACHE_MOUNT_PATH = "/compile-cache" # Host COMPILE_CACHE_DIR, mounted read-only (C++ only)
+SANDBOX_LABEL = "coding-platform.sandbox"
+
+
+def container_options(config, language: str, mount_compile_cache: bool = True) -> dict:
+    """Builds the `containers.run` kwargs for an idle, locked-down sandbox container.
+
+    The container only runs `sleep infinity`; submissions are copied into its tmpfs and run with `docker exec`.
+    `mount_compile_cache` is False on daemons that cannot see COMPILE_CACHE_DIR (remote hosts).
+    """
+    image_name = config.DOCKER_PYTHON_IMAGE if language == 'python' else config.DOCKER_CPP_IMAGE
+    volumes = {}
+    if language == 'cpp' and config.COMPILE_CACHE_ENABLED and mount_compile_cache:
+        volumes[config.COMPILE_CACHE_DIR] = {'bind': COMPILE_CACHE_MOUNT_PATH, 'mode': 'ro'}
+    return {
+        "image": image_name,
+        "command": ["sleep", "infinity"],
+        "volumes": volumes,
+        # Writable scratch space lives in memory and counts against mem_limit; world-writable for images with a non-root USER
+        "tmpfs": {SANDBOX_WORKDIR: "rw,exec,size=64m,mode=1777", "/tmp": "rw,exec,size=64m,mode=1777"},
+        "working_dir": SANDBOX_WORKDIR,
+        "mem_limit": config.DOCKER_MEM_LIMIT,
+        "memswap_limit": config.DOCKER_MEM_LIMIT, # Disables swap effectively
+        "nano_cpus": int(config.DOCKER_CPUS * 1e9),
+        "pids_limit": config.SANDBOX_MAX_PROCESSES,
+        "network_disabled": True,
+        "read_only": True,
+        "security_opt": ["no-new-privileges"],
+        "log_config": {"type": "json-file", "config": {"max-size": "1m"}},
+        "labels": {SANDBOX_LABEL: language},
+        "detach": True,
+    }
+
+
+class Sandbox:
+    """A running sandbox container that executes submissions via `docker exec`."""
+
+    def __init__(self, container, language: str, pooled: bool, compile_cache_mounted: bool = True):
+        self.container = container
+        self.language = language
+        self.pooled = pooled # False for one-off containers created on a pool miss
+        self.compile_cache_mounted = compile_cache_mounted # Cached binaries are readable at COMPILE_CACHE_MOUNT_PATH
+        self.host = None # core.hosts.Host the sandbox was placed on, set while leased
+        self.uses = 0
+
+    @property
+    def short_id(self):
+        return self.container.short_id
+
+    def _exec_create(self, cmd: list, timeout_seconds: int, workdir: str, environment: dict, stdin: bool = False):
+        wrapped = ["timeout", "-s", "KILL", str(timeout_seconds)] + list(cmd)
+        return self.container.client.api.exec_create(self.container.id, wrapped, workdir=workdir, environment=environment, stdin=stdin)["Id"]
+
+    def _exec_chunks(self, exec_id: str, stdin: bytes):
+        """Starts an exec created with stdin=True, feeds it `stdin` and yields (stdout, stderr) chunks.
+
+        The input is written from a helper thread while output is read here, so a program that
+        prints before it has read all of its input cannot deadlock against the writer.
+        """
+        sock = self.container.client.api.exec_start(exec_id, socket=True)
+        raw = getattr(sock, "_sock", sock)
+
+        def feed():
+            try:
+                raw.sendall(stdin)
+            except OSError:
+                pass # The process exited without reading all of its input
+            finally:
+                try:
+                    raw.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+        writer = threading.Thread(target=feed, name=f"exec-stdin-{self.short_id}", daemon=True)
+        writer.start()
+        try:
+            for stream, data in frames_iter(sock, tty=False):
+                yield (data, None) if stream == STDOUT else (None, data)
+        finally:
+            writer.join(timeout=1)
+            sock.close()
+
+    def exec_run(self, cmd: list, timeout_seconds: int, workdir: str = SANDBOX_WORKDIR, environment: dict = None, stdin: bytes = None):
+        """Runs `cmd` inside the container, SIGKILLed by coreutils `timeout` after `timeout_seconds`.
+
+        `stdin`, if given, is written to the process's standard input. Returns (exit_code, stdout_bytes, stderr_bytes).
+        """
+        api = self.container.client.api
+        exec_id = self._exec_create(cmd, timeout_seconds, workdir, environment, stdin=stdin is not None)
+        if stdin is None:
+            stdout, stderr = api.exec_start(exec_id, demux=True)
+        else:
+            stdout_parts, stderr_parts = [], []
+            for out, err in self._exec_chunks(exec_id, stdin):
+                (stdout_parts if out else stderr_parts).append(out or err)
+            stdout, stderr = b"".join(stdout_parts), b"".join(stderr_parts)
+        exit_code = api.exec_inspect(exec_id).get("ExitCode", -1)
+        return exit_code, stdout or b"", stderr or b""
+
+    def exec_stream(self, cmd: list, timeout_seconds: int, on_chunk, workdir: str = SANDBOX_WORKDIR, environment: dict = None, stdin: bytes = None):
+        """Like exec_run, but calls `on_chunk(stream_name, data)` for each stdout/stderr chunk as it arrives.
+
+        Returns the exit code. If `on_chunk` raises, the exec is abandoned and the exception propagates;
+        the process keeps running, so the caller should treat the sandbox as dirty.
+        """
+        api = self.container.client.api
+        exec_id = self._exec_create(cmd, timeout_seconds, workdir, environment, stdin=stdin is not None)
+        chunks = api.exec_start(exec_id, stream=True, demux=True) if stdin is None else self._exec_chunks(exec_id, stdin)
+        for stdout, stderr in chunks:
+            if stdout:
+                on_chunk("stdout", stdout)
+            if stderr:
+                on_chunk("stderr", stderr)
+        return api.exec_inspect(exec_id).get("ExitCode", -1)
+
+    def kill(self):
+        """Stops everything running in the container (a cancelled run), which ends any exec stream. The sandbox must then be discarded."""
+        try:
+            self.container.kill()
+        except docker.errors.APIError as e:
+            logger.warning(f"Could not kill sandbox {self.short_id}: {e}")
+
+    def put_files(self, files: dict, directory: str = SANDBOX_WORKDIR, timeout_seconds: int = 30, mode: int = 0o644):
+        """Writes {relative_path: bytes} under `directory` with permissions `mode` by piping a tar archive into `tar -x`.
+
+        (`put_archive` cannot write into the tmpfs mounts.) Raises RuntimeError if extraction fails.
+        """
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as archive:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size, info.mode, info.mtime = len(data), mode, int(time.time())
+                archive.addfile(info, io.BytesIO(data))
+        exit_code, _, stderr = self.exec_run(["tar", "-x", "-m", "--no-same-owner", "-C", directory], timeout_seconds, stdin=buffer.getvalue())
+        if exit_code != 0:
+            raise RuntimeError(f"Could not copy files into sandbox {self.short_id}: {stderr.decode('utf-8', errors='replace').strip()}")
+
+
+def create_sandbox(client, config, language: str, pooled: bool = False, mount_compile_cache: bool = True) -> Sandbox:
+    """Starts a new sandbox container for `language`."""
+    container = client.containers.run(**container_options(config, language, mount_compile_cache))
+    logger.debug(f"Started {'pooled' if pooled else 'one-off'} {language} sandbox {container.short_id}")
+    return Sandbox(container, language, pooled, mount_compile_cache)
+
+
+def destroy_sandbox(sandbox: Sandbox):
+    try:
+        sandbox.container.remove(force=True)
+        logger.debug(f"Sandbox {sandbox.short_id} removed.")
+    except docker.errors.NotFound:
+        logger.debug(f"Sandbox {sandbox.short_id} already removed.")
+    except Exception as e:
+        logger.warning(f"Warning: Error removing sandbox {sandbox.short_id}: {e}")
+
+
+class ContainerPool:
+    """Keeps pre-started sandbox containers per language on one Docker daemon so `/run` skips container create/start/remove.
+
+    `base_url` picks the daemon (see docker_client.get_manager). A single maintenance thread scrubs returned containers, replaces dirty or worn-out ones,
+    health-checks idle ones every POOL_HEALTHCHECK_SECONDS and tops each language up to its size.
+    """
+
+    def __init__(self, config, base_url: str = None):
+        self.config = config
+        self.base_url = base_url
+        self.sizes = {'python': config.POOL_SIZE_PYTHON, 'cpp': config.POOL_SIZE_CPP}
+        self.max_uses = config.POOL_MAX_USES
+        self._idle = {language: deque() for language in self.sizes}
+        self._leased = {language: 0 for language in self.sizes}
+        self._lock = threading.Lock()
+        self._tasks = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._manager = None
+        self.counters = {"hits": 0, "misses": 0, "created": 0, "recycled": 0, "discarded": 0, "health_failures": 0}
+
+    # --- Public API ---
+
+    def start(self):
+        """Connects to Docker and starts the maintenance thread (which performs warm-up)."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._manager = docker_client.get_manager(self.config, self.base_url)
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._maintain, name=f"container-pool-{self._manager.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"Container pool started on {self._manager.name} (sizes: {self.sizes}, max uses: {self.max_uses}).")
+
+    def shutdown(self):
+        """Stops maintenance and removes all idle pooled containers."""
+        self._stop_event.set()
+        self._tasks.put(None)
+        if self._thread:
+            self._thread.join(timeout=5)
+        with self._lock:
+            idle = [sandbox for pool in self._idle.values() for sandbox in pool]
+            for pool in self._idle.values():
+                pool.clear()
+        for sandbox in idle:
+            destroy_sandbox(sandbox)
+        logger.info(f"Container pool on {self._manager.name if self._manager else self.base_url} shut down.")
+
+    def acquire(self, language: str, client, mount_compile_cache: bool = True) -> Sandbox:
+        """Returns an idle pooled sandbox (hit) or a freshly started one-off sandbox (miss) started with `client`."""
+        with self._lock:
+            idle = self._idle.get(language)
+            if idle:
+                sandbox = idle.popleft()
+                self._leased[language] += 1
+                self.counters["hits"] += 1
+                return sandbox
+            self.counters["misses"] += 1
+        logger.info(f"Container pool miss for {language}, starting one-off sandbox.")
+        return create_sandbox(client, self.config, language, pooled=False, mount_compile_cache=mount_compile_cache)
+
+    def release(self, sandbox: Sandbox, dirty: bool = False):
+        """Hands a sandbox back after a run. Cleanup happens off the request path."""
+        self._tasks.put((sandbox, dirty))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "idle": {language: len(pool) for language, pool in self._idle.items()},
+                "leased": dict(self._leased),
+                "target": dict(self.sizes),
+            }
+
+    # --- Maintenance thread ---
+
+    def _maintain(self):
+        interval = self.config.POOL_HEALTHCHECK_SECONDS
+        if self.config.POOL_WARMUP:
+            self._refill()
+        next_check = time.monotonic() + interval
+        while not self._stop_event.is_set():
+            try:
+                task = self._tasks.get(timeout=max(0.0, next_check - time.monotonic()))
+            except queue.Empty:
+                task = None
+            if self._stop_event.is_set():
+                break
+            try:
+                if task is not None:
+                    self._handle_release(*task)
+                if time.monotonic() >= next_check:
+                    self._health_check()
+                    next_check = time.monotonic() + interval
+                self._refill()
+            except Exception as e:
+                logger.error(f"Container pool maintenance error: {e}", exc_info=True)
+
+    def _handle_release(self, sandbox: Sandbox, dirty: bool):
+        if not sandbox.pooled:
+            destroy_sandbox(sandbox)
+            return
+        with self._lock:
+            self._leased[sandbox.language] -= 1
+        sandbox.uses += 1
+        if dirty or sandbox.uses >= self.max_uses or not self._scrub(sandbox):
+            logger.debug(f"Discarding pooled sandbox {sandbox.short_id} (uses: {sandbox.uses}, dirty: {dirty})")
+            self.counters["discarded"] += 1
+            destroy_sandbox(sandbox)
+            return
+        with self._lock:
+            self._idle[sandbox.language].append(sandbox)
+        self.counters["recycled"] += 1
+
+    def _scrub(self, sandbox: Sandbox) -> bool:
+        """Wipes scratch space and verifies nothing but `sleep` is left running. False means dirty."""
+        try:
+            exit_code, _, _ = sandbox.exec_run(
+                ["sh", "-c", f"rm -rf {SANDBOX_WORKDIR}/* {SANDBOX_WORKDIR}/.[!.]* /tmp/* /tmp/.[!.]*"],
+                timeout_seconds=5,
+            )
+            if exit_code != 0:
+                return False
+            processes = sandbox.container.top().get("Processes") or []
+            return len(processes) == 1
+        except Exception as e:
+            logger.warning(f"Scrub failed for sandbox {sandbox.short_id}: {e}")
+            return False
+
+    def _health_check(self):
+        with self._lock:
+            idle = [sandbox for pool in self._idle.values() for sandbox in pool]
+        for sandbox in idle:
+            try:
+                sandbox.container.reload()
+                healthy = sandbox.container.status == "running"
+            except Exception:
+                healthy = False
+            if not healthy:
+                logger.warning(f"Pooled sandbox {sandbox.short_id} failed health check, replacing it.")
+                with self._lock:
+                    try:
+                        self._idle[sandbox.language].remove(sandbox)
+                    except ValueError:
+                        continue # Leased in the meantime; the run will surface the failure
+                self.counters["health_failures"] += 1
+                destroy_sandbox(sandbox)
+
+    def _refill(self):
+        if not self._manager.healthy:
+            return
+        for language, size in self.sizes.items():
+            while not self._stop_event.is_set():
+                with self._lock:
+                    if len(self._idle[language]) + self._leased[language] >= size:
+                        break
+                try:
+                    sandbox = create_sandbox(self._manager.client, self.config, language, pooled=True,
+                                             mount_compile_cache=self._manager.shares_filesystem)
+                except Exception as e:
+                    logger.error(f"Failed to start pooled {language} sandbox: {e}")
+                    break
+                with self._lock:
+                    self._idle[language].append(sandbox)
+                self.counters["created"] += 1
+
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+
+def get_pool(config, base_url: str = None) -> ContainerPool:
+    """Returns the process-wide pool on the daemon at `base_url` (default: the first Docker host), creating it on first use."""
+    if base_url is None:
+        base_url = docker_client.host_urls(config)[0]
+    with _pool_lock:
+        if base_url not in _pools:
+            _pools[base_url] = ContainerPool(config, base_url)
+        return _pools[base_url]
+
+
+def get_pools(config) -> list:
+    """One pool per configured Docker host (DOCKER_HOSTS)."""
+    return [get_pool(config, base_url) for base_url in docker_client.host_urls(config)]
@@ -0,0 +1,252 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUBMISSION = "<submission>" # `file` of functions and lines in the submitted code
+
+
+def _ms(ns: int) -> float:
+    return round(ns / 1e6, 3)
+
+
+def _pct(part, whole) -> float:
+    return round(100 * part / whole, 1) if whole else 0.0
+
+
+def _collapsed(stacks: dict, max_stacks: int):
+    """"frame;frame;frame value" lines (Brendan Gregg's collapsed format), largest first."""
+    ordered = sorted(((stack, value) for stack, value in stacks.items() if value > 0), key=lambda item: -item[1])
+    lines = [f"{stack} {value}" for stack, value in ordered[:max_stacks]]
+    return "\n".join(lines), len(ordered) > max_stacks
+
+
+def _hot_lines(counts: dict, samples: int, limit: int) -> list:
+    ordered = sorted(counts.items(), key=lambda item: -item[1])[:limit]
+    return [{"line": line, "function": function, "samples": count, "pct": _pct(count, samples)}
+            for (line, function), count in ordered]
+
+
+def python_profile(raw: dict, config) -> dict:
+    """Profile section for a run under core/harness/profile.py.
+
+    The function table comes from cProfile (exact call counts and times, though cProfile's own
+    overhead inflates call-heavy code); hot lines and collapsed stacks come from SIGPROF samples.
+    """
+    functions = []
+    total_ns = sum(entry[6] for entry in raw["functions"]) # Self times add up to the profiled time
+    for is_submission, filename, line, name, calls, primitive_calls, self_ns, cumulative_ns in raw["functions"]:
+        functions.append({
+            "function": name,
+            "file": SUBMISSION if is_submission else (None if filename == "~" else filename),
+            "line": line or None,
+            "calls": calls,
+            "primitive_calls": primitive_calls, # Calls that were not recursive
+            "self_ms": _ms(self_ns),
+            "cumulative_ms": _ms(cumulative_ns),
+        })
+    functions.sort(key=lambda f: -f["self_ms"])
+    for function in functions:
+        function["self_pct"] = _pct(function["self_ms"] * 1e6, total_ns)
+    samples = raw["samples"]
+    collapsed, stacks_truncated = _collapsed(raw["stacks"], config.PROFILE_MAX_STACKS)
+    return {
+        "profiler": "cProfile + SIGPROF stack sampling",
+        "total_ms": _ms(total_ns),
+        "functions": functions[:config.PROFILE_MAX_FUNCTIONS],
+        "hot_lines": _hot_lines({(line, name): count for line, name, count in raw["hot_lines"]}, samples, config.PROFILE_MAX_LINES),
+        "collapsed_stacks": collapsed,
+        "stack_unit": "samples",
+        "samples": samples,
+        "sample_interval_us": raw["interval_us"],
+        "truncated": stacks_truncated or len(functions) > config.PROFILE_MAX_FUNCTIONS,
+    }
+
+
+def cpp_addresses(raw: dict) -> list:
+    """Distinct code addresses in a raw C++ profile (function entries, sampled PCs and call sites), for addr2line."""
+    addresses = {node[1] for node in raw["nodes"]}
+    for sample in raw["samples"]:
+        addresses.update(sample[0])
+    return sorted(addresses)
+
+
+def parse_addr2line(text: str) -> dict:
+    """Parses `addr2line -a -f -C -i` output into {address: [(function, file, line), ...]}, innermost frame first."""
+    symbols = {}
+    frames = None
+    lines = text.splitlines()
+    i = 0
+    while i < len(lines):
+        if lines[i].startswith("0x"): # Function names never do
+            frames = symbols.setdefault(f"0x{int(lines[i], 16):x}", [])
+            i += 1
+            continue
+        if frames is not None and i + 1 < len(lines):
+            location = lines[i + 1].split(" (discriminator")[0]
+            filename, _, line = location.rpartition(":")
+            frames.append((lines[i], filename, int(line) if line.isdigit() else None))
+        i += 2
+    return symbols
+
+
+def cpp_profile(raw: dict, symbols: dict, is_submission, config) -> dict:
+    """Profile section for a C++ binary linked with core/harness/profile.c.
+
+    The calling-context tree gives exact call counts plus self time per call path (collapsed
+    stacks in microseconds); a function's cumulative time only counts its outermost activation, so
+    recursion is not double counted. Each sample is attributed to the first line of the submission
+    (per `is_submission(path)`) among its PC and the call sites above it, so time in the shim's hooks
+    or an inlined library call counts toward the line that led there; the rest land in `other_samples`.
+    """
+    nodes = raw["nodes"] # [parent, address, calls, self_ns, total_ns]; node ids start at 1, 0 is the root
+
+    def name_of(address):
+        frames = symbols.get(address)
+        return frames[-1][0] if frames and frames[-1][0] != "??" else address
+
+    def node(node_id):
+        return nodes[node_id - 1]
+
+    per_function = {}
+    paths = {0: ""}
+    stacks = {}
+    total_ns = 0
+    for node_id in range(1, len(nodes) + 1):
+        parent, address, calls, self_ns, node_total_ns = node(node_id)
+        name = name_of(address)
+        paths[node_id] = f"{paths[parent]};{name}" if parent else name # Parents always precede children
+        stacks[paths[node_id]] = stacks.get(paths[node_id], 0) + self_ns // 1000
+        if parent == 0:
+            total_ns += node_total_ns
+        entry = per_function.setdefault(address, {"calls": 0, "self_ns": 0, "cumulative_ns": 0})
+        entry["calls"] += calls
+        entry["self_ns"] += self_ns
+        ancestor = parent
+        while ancestor and node(ancestor)[1] != address:
+            ancestor = node(ancestor)[0]
+        if not ancestor: # Outermost activation on this path
+            entry["cumulative_ns"] += node_total_ns
+
+    functions = []
+    for address, entry in per_function.items():
+        frames = symbols.get(address) or [(address, "", None)]
+        name, filename, line = frames[-1]
+        functions.append({
+            "function": name if name != "??" else address,
+            "file": SUBMISSION if is_submission(filename) else (filename or None),
+            "line": line,
+            "calls": entry["calls"],
+            "self_ms": _ms(entry["self_ns"]),
+            "cumulative_ms": _ms(entry["cumulative_ns"]),
+            "self_pct": _pct(entry["self_ns"], total_ns),
+        })
+    functions.sort(key=lambda f: -f["self_ms"])
+
+    line_counts = {}
+    samples = other = 0
+    for chain, _, count in raw["samples"]:
+        samples += count
+        frame = next((f for address in chain for f in symbols.get(address, []) if is_submission(f[1]) and f[2]), None)
+        if frame is None:
+            other += count
+            continue
+        key = (frame[2], frame[0])
+        line_counts[key] = line_counts.get(key, 0) + count
+    collapsed, stacks_truncated = _collapsed(stacks, config.PROFILE_MAX_STACKS)
+    return {
+        "profiler": "gcc -finstrument-functions + SIGPROF PC sampling",
+        "total_ms": _ms(total_ns),
+        "functions": functions[:config.PROFILE_MAX_FUNCTIONS],
+        "hot_lines": _hot_lines(line_counts, samples, config.PROFILE_MAX_LINES),
+        "other_samples": other,
+        "collapsed_stacks": collapsed,
+        "stack_unit": "us",
+        "samples": samples,
+        "sample_interval_us": raw["interval_us"],
+        "truncated": raw.get("truncated", False) or stacks_truncated or len(functions) > config.PROFILE_MAX_FUNCTIONS,
+    }
+
+
+def _timeline(points: list, max_points: int) -> list:
+    """Buckets [t, live_bytes, peak_bytes] points down to max_points, keeping each bucket's last live size and its peak."""
+    if len(points) <= max_points:
+        return points
+    bucket_size = len(points) / max_points
+    result = []
+    for i in range(max_points):
+        bucket = points[int(i * bucket_size):int((i + 1) * bucket_size)] or [points[-1]]
+        result.append([bucket[-1][0], bucket[-1][1], max(point[2] for point in bucket)])
+    return result
+
+
+def _python_sites(sites: list) -> list:
+    return [{"file": SUBMISSION if is_submission else filename, "line": line, "bytes": size, "count": count}
+            for is_submission, filename, line, size, count in sites]
+
+
+def python_memory(raw: dict, config) -> dict:
+    """Memory section for a run under core/harness/memory.py (tracemalloc).
+
+    Sizes are Python-level allocations, not the process RSS. `peak_sites` and `final_sites` are the
+    largest live allocation sites (bytes and block count) in the snapshot nearest the peak (None if
+    the heap never grew between samples) and at exit; `timeline` is [t_ms, traced_bytes, peak_bytes].
+    """
+    return {
+        "tracer": "tracemalloc",
+        "peak_bytes": raw["peak_bytes"],
+        "final_bytes": raw["final_bytes"],
+        "sites_scope": "live",
+        "peak_sites": _python_sites(raw["peak_sites"]) if raw["peak_sites"] is not None else None,
+        "peak_snapshot_bytes": raw["peak_snapshot_bytes"] if raw["peak_sites"] is not None else None,
+        "final_sites": _python_sites(raw["final_sites"]),
+        "timeline": _timeline(raw["timeline"], config.MEMORY_MAX_POINTS),
+        "timeline_unit": "ms",
+    }
+
+
+def cpp_memory_addresses(raw: dict) -> list:
+    """Allocation call sites in a raw C++ memory report, for addr2line."""
+    return sorted({site[0] for site in raw["sites"]})
+
+
+def cpp_memory(raw: dict, symbols: dict, is_submission, config) -> dict:
+    """Memory section for a C++ binary linked with core/harness/memory.cpp (malloc/new interposition).
+
+    Sizes are heap bytes by usable block size, so they include allocator rounding. Sites are
+    allocations over the whole run (count and bytes), attributed like cpp_profile's hot lines to the
+    first line of the submission among the inlined frames at the call site; allocations made from
+    inside shared libraries (e.g. non-inlined std::string code) cannot be traced back further and
+    are grouped as library sites.
+    """
+    per_site = {}
+    for address, count, size in raw["sites"]:
+        frames = symbols.get(address, [])
+        frame = next((f for f in frames if is_submission(f[1]) and f[2]), None)
+        if frame is not None:
+            key = (SUBMISSION, frame[2], frame[0])
+        elif frames and frames[-1][0] != "??":
+            key = (frames[-1][1] or None, frames[-1][2], frames[-1][0])
+        else:
+            key = (None, None, "(shared library)")
+        entry = per_site.setdefault(key, [0, 0])
+        entry[0] += count
+        entry[1] += size
+    other_count, other_bytes = raw["other_sites"]
+    if other_count:
+        per_site[(None, None, "(untracked sites)")] = [other_count, other_bytes]
+    ordered = sorted(per_site.items(), key=lambda item: -item[1][1])
+    sites = [{"file": filename, "line": line, "function": function, "bytes": size, "count": count}
+             for (filename, line, function), (count, size) in ordered[:config.MEMORY_MAX_SITES]]
+    return {
+        "tracer": "malloc/new interposition",
+        "peak_bytes": raw["peak_bytes"],
+        "final_bytes": max(raw["final_bytes"], 0),
+        "allocations": raw["allocations"],
+        "frees": raw["frees"],
+        "allocated_bytes": raw["allocated_bytes"],
+        "leaked_blocks": max(raw["live_blocks"], 0), # Still live after static destructors ran
+        "sites_scope": "allocated",
+        "sites": sites,
+        "timeline": _timeline(raw["timeline"], config.MEMORY_MAX_POINTS),
+        "timeline_unit": "us",
+    }
@@ -0,0 +1,163 @@
+import re
+import json
+import time
+import hashlib
+import threading
+import logging
+
+from core import ai_cache, backends
+
+logger = logging.getLogger(__name__)
+
+# Source patterns that make a program's output depend on more than its code and stdin
+NONDETERMINISTIC_PATTERNS = {
+    "python": [
+        (re.compile(r"^\s*(?:import|from)\s+(random|secrets|uuid|time|datetime|threading|multiprocessing|asyncio|concurrent)\b", re.M), "imports {0}"),
+        (re.compile(r"\bos\.(urandom|getpid|times|environ|listdir|scandir)\b"), "calls os.{0}"),
+        (re.compile(r"\b(id|hash)\s*\("), "prints object identity or string hashes ({0})"),
+        (re.compile(r"/dev/u?random|/proc/"), "reads {0}"),
+    ],
+    "cpp": [
+        (re.compile(r"#\s*include\s*<(random|chrono|ctime|time\.h|thread|future|sys/time\.h)>"), "includes <{0}>"),
+        (re.compile(r"\b(s?rand|random|time|clock|gettimeofday|clock_gettime|getpid)\s*\("), "calls {0}()"),
+        (re.compile(r"\b(random_device|chrono|__TIME__|__DATE__|__TIMESTAMP__)\b"), "uses {0}"),
+        (re.compile(r"/dev/u?random|/proc/"), "reads {0}"),
+    ],
+}
+
+
+def nondeterminism(code: str, language: str):
+    """Why a submission's result may differ between runs (e.g. "imports random"), or None if it looks deterministic.
+
+    A deliberately coarse source scan: false positives only cost a cache miss.
+    """
+    for pattern, reason in NONDETERMINISTIC_PATTERNS.get(language, []):
+        match = pattern.search(code)
+        if match:
+            return reason.format(match.group(1) if pattern.groups else match.group(0))
+    return None
+
+
+def result_key(code: str, language: str, stdin: str, delivery: str, config, trusted: bool = False):
+    """Content address of a run: code, language, backend and its image digest or toolchain, resource limits,
+    stdin and how output is delivered.
+
+    Called on the request thread, so the image digest comes from the hosts' image caches (no Docker
+    API call). Returns None, making the run non-cacheable, if the environment cannot be identified
+    that way (image not cached yet, misconfigured backend).
+    """
+    try:
+        backend = backends.get_backend(config, language, trusted)
+        environment = backend.environment_id(language)
+    except Exception as e:
+        logger.warning(f"Not caching {language} run: could not identify its execution environment: {e}")
+        return None
+    if environment is None:
+        logger.info(f"Not caching {language} run: its image digest is not known yet")
+        return None
+    limits = f"mem={config.DOCKER_MEM_LIMIT} cpus={config.DOCKER_CPUS} timeout={config.DOCKER_TIMEOUT_SECONDS}"
+    digest = hashlib.sha256()
+    for part in (code, language, backend.name, environment, limits,
+                 "\1" if stdin is None else stdin, delivery):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def is_cacheable(result: dict) -> bool:
+    """Only outcomes of the program itself are reused: not setup errors, cancellations, or kills by the time/memory limits."""
+    return result.get("exit_code") is not None and result["exit_code"] != 137
+
+
+class Flight:
+    """One in-progress run that identical submissions wait on instead of starting their own."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None # Set by ResultCache.finish(); None if the run raised
+        self.job = None # The job running it, for /run callers that can simply poll it
+
+    def reusable_entry(self):
+        """The leader's entry once it is done, if its program actually ran (it was not cancelled or failed to start), else None.
+
+        Unlike the cache, followers also share a run killed at the limits: they asked at the same time.
+        """
+        if self.entry is not None and self.entry["result"].get("exit_code") is not None:
+            return self.entry
+        return None
+
+
+class ResultCache:
+    """Deterministic /run results keyed by `result_key()`, with coalescing of identical in-flight runs.
+
+    Entries are {"result": ..., "chunks": [[stream, text], ...] or None, "stored_at": ...}: the
+    chunks are the streamed stdout/stderr of a /run/stream execution, replayed on a hit. Storage is
+    a ResponseCache (hottest entries in memory, the rest on disk, both bounded, with a TTL).
+    `begin()` makes the first caller for a key the leader of a Flight; later callers get the same
+    Flight and wait for the leader's `finish()` rather than running the program again.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int, ttl_seconds: int, memory_entries: int):
+        self._store = ai_cache.ResponseCache(cache_dir, max_bytes, ttl_seconds, memory_entries, name="Run result")
+        self._flights = {} # key -> Flight
+        self._lock = threading.Lock()
+        self.counters = {"coalesced": 0, "uncacheable": 0}
+
+    def get(self, key: str):
+        """Returns the cached entry, or None on a miss."""
+        payload = self._store.get(key)
+        return json.loads(payload) if payload is not None else None
+
+    def begin(self, key: str):
+        """Returns (flight, leader). The leader must call `finish(key, ...)` whatever happens to its run."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.counters["coalesced"] += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key: str, result: dict = None, chunks: list = None):
+        """Stores the leader's result if it is cacheable and releases everyone waiting on the flight."""
+        entry = None
+        if result is not None:
+            entry = {"result": result, "chunks": chunks, "stored_at": time.time()}
+            if is_cacheable(result):
+                self._store.put(key, json.dumps(entry), max(0, result["metrics"].get("runtime_ms", 0)))
+            else:
+                with self._lock:
+                    self.counters["uncacheable"] += 1
+        with self._lock:
+            flight = self._flights.pop(key, None)
+        if flight is not None:
+            flight.entry = entry
+            flight.done.set()
+
+    def stats(self) -> dict:
+        stats = self._store.stats()
+        stats["runtime_saved_ms"] = stats.pop("latency_saved_ms")
+        with self._lock:
+            return {**stats, **self.counters, "in_flight": len(self._flights)}
+
+
+def replay(entry: dict, run_id: str) -> dict:
+    """The result to return for a cached or coalesced entry: a copy of the original result under a new run_id, marked `cached`."""
+    result = json.loads(json.dumps(entry["result"])) # Coalesced callers share one entry
+    result["cached"] = {"run_id": result["run_id"], "age_seconds": round(time.time() - entry["stored_at"], 1)}
+    result["run_id"] = run_id
+    return result
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(config) -> ResultCache:
+    """Returns the process-wide result cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(config.RESULT_CACHE_DIR, config.RESULT_CACHE_MAX_MB * 1024 * 1024,
+                                 config.RESULT_CACHE_TTL_SECONDS, config.RESULT_CACHE_MEMORY_ENTRIES)
+        return _cache
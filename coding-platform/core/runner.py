@@ -1,253 +1,850 @@
 import os
+import json
 import uuid
+import codecs
 import docker
 import time
+import statistics
 import threading
 import traceback
 import logging # Use Flask's logger if available, otherwise basic logger
 
+from core import backends, docker_client, compile_cache, metrics, profiler, instrumentation, output_capture
+from core.pool import SANDBOX_WORKDIR, COMPILE_CACHE_MOUNT_PATH
+
 logger = logging.getLogger(__name__)
 
-def execute_code(code: str, language: str, config: object) -> dict:
-    run_id = str(uuid.uuid4())
-    logger.info(f"Starting execution run_id: {run_id} for language: {language}")
-    result = {
+CPP_COMPILE_FLAGS = ["-std=c++17", "-O2"]
+# Profile mode: debug info for addr2line, fixed addresses, and entry/exit hooks (core/harness/profile.c) on the submission's own functions
+CPP_PROFILE_FLAGS = ["-g", "-no-pie", "-fno-omit-frame-pointer", "-finstrument-functions",
+                     "-finstrument-functions-exclude-file-list=/usr/include,/usr/local/include"]
+CPP_MEMORY_FLAGS = ["-g", "-no-pie"] # Memory mode: allocation sites are symbolized with addr2line
+# Instrumented run modes: the shim linked into C++ binaries and the extra g++ flags
+CPP_SHIMS = {"profile": ("profile.c", CPP_PROFILE_FLAGS), "memory": ("memory.cpp", CPP_MEMORY_FLAGS)}
+HARNESS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "harness") # Sources copied into sandboxes
+CANCEL_POLL_SECONDS = 0.2 # How often a running program's `cancelled` flag is checked
+
+
+class RunCancelled(Exception):
+    """Raised from an `on_output` callback to abandon a streaming run (e.g. the client disconnected)."""
+
+
+class _CancelWatch:
+    """Polls `cancelled()` while a program runs and kills the program (sandbox.kill) once it returns True,
+    so a cancelled run that prints nothing does not keep its sandbox until the timeout."""
+
+    def __init__(self, sandbox, cancelled):
+        self.fired = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, args=(sandbox, cancelled), name=f"cancel-watch-{sandbox.short_id}", daemon=True)
+        self._thread.start()
+
+    def _watch(self, sandbox, cancelled):
+        while not self._stop.wait(CANCEL_POLL_SECONDS):
+            if cancelled():
+                self.fired = True
+                sandbox.kill()
+                return
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def _output_forwarder(on_output):
+    """Adapts `on_output(stream_name, text)` to raw exec chunks, decoding UTF-8 across chunk boundaries."""
+    decoders = {name: codecs.getincrementaldecoder('utf-8')(errors='replace') for name in ("stdout", "stderr")}
+
+    def on_chunk(stream_name, data):
+        text = decoders[stream_name].decode(data)
+        if text:
+            on_output(stream_name, text)
+    return on_chunk
+
+
+def _build_cpp(sandbox, code: str, filename: str, run_id: str, backend, config, metrics: dict, mode: str = None):
+    """Produces a runnable binary for a C++ submission, reusing the compile cache when possible.
+
+    Returns (binary_path, None) on success or (None, (exit_code, stdout, stderr)) if g++ failed.
+    Cache keys include the backend's toolchain identity (the image digest on the sandbox's host for Docker). Cache
+    outcome and compile timings are recorded in `metrics`. With an instrumented `mode`
+    (a CPP_SHIMS key), the binary is built with that mode's flags and linked with its shim; it is
+    cached under its own key.
+    """
+    shim_name, extra_flags = CPP_SHIMS[mode] if mode else (None, [])
+    flags = CPP_COMPILE_FLAGS + extra_flags
+    shim_source = _harness_source(shim_name) if mode else ""
+    cache = compile_cache.get_cache(config) if config.COMPILE_CACHE_ENABLED else None
+    if cache:
+        toolchain = backend.environment_id(sandbox.language, sandbox)
+        key = compile_cache.cache_key(code + "\0" + shim_source if mode else code, toolchain, flags)
+        saved_ms = cache.lookup(key)
+        if saved_ms is not None and sandbox.compile_cache_mounted:
+            metrics.update({"compile_cache": "hit", "compile_ms": 0, "compile_ms_saved": saved_ms})
+            logger.debug(f"Compile cache hit for run_id {run_id} (key {key[:12]})")
+            return f"{COMPILE_CACHE_MOUNT_PATH}/{key}.bin", None
+        binary = cache.read(key) if saved_ms is not None else None
+        if binary is not None: # Remote Docker host: copy the cached binary into the sandbox instead
+            sandbox.put_files({f"{run_id}.out": binary}, mode=0o755)
+            metrics.update({"compile_cache": "hit", "compile_ms": 0, "compile_ms_saved": saved_ms})
+            logger.debug(f"Compile cache hit for run_id {run_id} (key {key[:12]}, copied into sandbox {sandbox.short_id})")
+            return f"{SANDBOX_WORKDIR}/{run_id}.out", None
+        metrics["compile_cache"] = "miss"
+
+    # Only needed on a cache miss: the source goes straight into the sandbox's tmpfs
+    binary_path = f"{SANDBOX_WORKDIR}/{run_id}.out"
+    compile_cmd = ["g++", f"{SANDBOX_WORKDIR}/{filename}", *flags, "-o", binary_path]
+    if mode:
+        shim_file = f"{run_id}_{shim_name}"
+        shim_path, shim_object = f"{SANDBOX_WORKDIR}/{shim_file}", f"{SANDBOX_WORKDIR}/{run_id}_{mode}.o"
+        sandbox.put_files({filename: code.encode('utf-8'), shim_file: shim_source.encode('utf-8')})
+        # The shim is built on its own, without instrumentation (but with frame pointers for the profiler's sampler), then linked in
+        std = "-std=c++17 " if shim_name.endswith(".cpp") else ""
+        compile_cmd = ["sh", "-c", f'gcc {std}-O2 -fno-omit-frame-pointer -c {shim_path} -o {shim_object} && exec "$@"', "sh"] \
+            + compile_cmd[:2] + [shim_object] + compile_cmd[2:]
+    else:
+        sandbox.put_files({filename: code.encode('utf-8')})
+    # Diagnostics are kept bounded, but a compile is not stopped for being verbose: the timeout bounds it
+    capture = output_capture.OutputCapture(config.OUTPUT_HEAD_BYTES, config.OUTPUT_TAIL_BYTES, 0)
+    start_time = time.monotonic()
+    exit_code = sandbox.exec_stream(compile_cmd, config.DOCKER_TIMEOUT_SECONDS, capture.on_chunk)
+    compile_ms = round((time.monotonic() - start_time) * 1000)
+    metrics["compile_ms"] = compile_ms
+    if exit_code != 0:
+        return None, (exit_code, capture.stdout(), capture.stderr())
+
+    if cache:
+        # Copy the binary out before any user code runs in this sandbox, so the cached file is pristine
+        try:
+            read_exit, binary, _ = sandbox.exec_run(["cat", binary_path], timeout_seconds=10)
+            if read_exit == 0 and binary:
+                cache.store(key, binary, compile_ms)
+        except Exception as e:
+            logger.warning(f"Could not cache compiled binary for run_id {run_id}: {e}")
+    return binary_path, None
+
+def _exec_captured(sandbox, cmd: list, config, capture, cancelled=None, **kwargs):
+    """Runs `cmd` with its output going through `capture` (an output_capture.OutputCapture).
+
+    Returns the exit code, or None if the program exceeded OUTPUT_LIMIT_BYTES and was abandoned
+    (the local backend kills it; a container has to be discarded). With `cancelled`, the program
+    is killed once `cancelled()` returns True and RunCancelled is raised.
+    """
+    watch = _CancelWatch(sandbox, cancelled) if cancelled else None
+    try:
+        return sandbox.exec_stream(cmd, config.DOCKER_TIMEOUT_SECONDS, capture.on_chunk, **kwargs)
+    except output_capture.OutputLimitExceeded:
+        return None
+    finally:
+        if watch:
+            watch.stop()
+            if watch.fired:
+                raise RunCancelled()
+
+
+def _start_telemetry(sandbox, config):
+    if not config.TELEMETRY_ENABLED:
+        return None
+    try:
+        if sandbox.container is None: # Local process sandbox: rusage of the finished process
+            sampler = sandbox.usage_sampler()
+            sampler.start()
+            return sampler
+        sampler = metrics.TelemetrySampler(sandbox.container, config.TELEMETRY_INTERVAL_MS, config.TELEMETRY_MAX_OVERHEAD_PCT,
+                                           config.TELEMETRY_MAX_POINTS, config.CGROUP_ROOT)
+        sampler.start()
+        return sampler
+    except Exception as e:
+        logger.warning(f"Could not start telemetry for sandbox {sandbox.short_id}: {e}")
+        return None
+
+
+def _apply_telemetry(run_metrics: dict, telemetry: dict):
+    run_metrics["telemetry"] = telemetry
+    if "cpu_time_ms" in telemetry:
+        run_metrics["cpu_used"] = f"{telemetry['cpu_time_ms']} ms ({telemetry['cpu_percent']}%)"
+        # Prefer the kernel's exact watermark; the sampled RSS peak can miss short spikes
+        peak = telemetry.get("peak_mem_bytes") or telemetry.get("peak_rss_bytes")
+        run_metrics["mem_used"] = metrics.format_bytes(peak)
+
+
+class RunSession:
+    """Everything one submission needs around the actual exec calls.
+
+    `open()` takes a sandbox from the execution backend configured for the language and trust level
+    (core/backends.py: a pooled or one-off container, or a local process sandbox), `program_command()`
+    copies the source into the sandbox's scratch space (compiling C++ there) and `close()` hands the sandbox back,
+    discarding it if `dirty`. Nothing is written on the host. Setup failures are reported through
+    `result["error"]`, matching execute_code's result shape. In an instrumented mode ("profile" or
+    "memory") the command writes a raw report to `report_path` when the program exits, which
+    `collect_report()` turns into the result section of the same name. Every stage is timed into
+    `timings` (core/instrumentation.py) under `operation`.
+    """
+
+    def __init__(self, code: str, language: str, config, run_id: str, operation: str = "run", trusted: bool = False):
+        self.code = code
+        self.language = language
+        self.config = config
+        self.run_id = run_id
+        self.trusted = trusted
+        self.backend = None
+        self.filename = None
+        self.sandbox = None
+        self.dirty = False
+        self.binary_path = None
+        self.mode = None
+        self.report_path = None
+        self.timings = instrumentation.Timings(operation, {"language": language})
+
+    def open(self, result: dict) -> bool:
+        config, run_id = self.config, self.run_id
+        # Define per-language settings
+        if self.language == 'python':
+            self.filename = f"{run_id}_script.py"
+        elif self.language == 'cpp':
+            self.filename = f"{run_id}_main.cpp"
+        else:
+            result["error"] = f"Unsupported language: {self.language}"
+            logger.warning(f"Unsupported language request: {self.language} for run_id: {run_id}")
+            return False
+
+        try:
+            self.backend = backends.get_backend(config, self.language, self.trusted)
+        except ValueError as e:
+            result["error"] = str(e)
+            logger.error(f"Misconfigured execution backend for run_id {run_id}: {e}")
+            return False
+        self.sandbox = self.backend.acquire(self.language, result, self.timings)
+        if self.sandbox is None:
+            return False
+        result["metrics"]["backend"] = self.backend.name
+        pool_outcome = f" (pool {result['metrics']['pool']})" if "pool" in result["metrics"] else ""
+        logger.info(f"Dispatching run_id: {run_id} to {self.backend.name} sandbox {self.sandbox.short_id}{pool_outcome}")
+        return True
+
+    def program_command(self, run_metrics: dict, mode: str = None):
+        """Returns (cmd, None) to run the program, or (None, (exit_code, stdout, stderr)) if compilation failed.
+
+        `mode` runs the program instrumented: "profile" or "memory".
+        """
+        config = self.config
+        self.mode = mode
+        self.report_path = f"{SANDBOX_WORKDIR}/{self.run_id}.{mode}.json" if mode else None
+        if self.language == 'python':
+            with self.timings.span("copy_source"):
+                self.sandbox.put_files({self.filename: self.code.encode('utf-8')})
+            script_path = f"{SANDBOX_WORKDIR}/{self.filename}"
+            if mode == "profile":
+                return ["python", "-c", _harness_source("profile.py"), script_path, self.report_path,
+                        str(config.PROFILE_SAMPLE_INTERVAL_US)], None
+            if mode == "memory":
+                return ["python", "-c", _harness_source("memory.py"), script_path, self.report_path,
+                        str(config.MEMORY_SAMPLE_INTERVAL_MS), str(config.MEMORY_MAX_SITES)], None
+            return ["python", script_path], None
+        # Compile (or reuse a cached binary) in its own exec so runtime_ms covers only the program
+        with self.timings.span("compile"):
+            self.binary_path, compile_failure = _build_cpp(self.sandbox, self.code, self.filename, self.run_id, self.backend,
+                                                           config, run_metrics, mode=mode)
+        if not self.binary_path:
+            return None, compile_failure
+        if mode == "profile":
+            return ["env", f"PROFILE_OUT={self.report_path}", f"PROFILE_INTERVAL_US={config.PROFILE_SAMPLE_INTERVAL_US}", self.binary_path], None
+        if mode == "memory":
+            return ["env", f"MEMORY_OUT={self.report_path}", f"MEMORY_INTERVAL_US={config.MEMORY_SAMPLE_INTERVAL_MS * 1000}", self.binary_path], None
+        return [self.binary_path], None
+
+    def _symbolize(self, addresses: list) -> dict:
+        # In the sandbox, where the binary and the toolchain that built it live (-i: inlined frames too)
+        exit_code, symbols_bytes, stderr_bytes = self.sandbox.exec_run(
+            ["addr2line", "-a", "-f", "-C", "-i", "-e", self.binary_path], timeout_seconds=30,
+            stdin="\n".join(addresses).encode('ascii'),
+        )
+        if exit_code != 0:
+            raise RuntimeError(f"addr2line failed: {stderr_bytes.decode('utf-8', errors='replace').strip()[:500]}")
+        return profiler.parse_addr2line(symbols_bytes.decode('utf-8', errors='replace'))
+
+    def collect_report(self) -> dict:
+        """Reads the raw report written by the last instrumented run and turns it into its result section."""
+        exit_code, raw_bytes, _ = self.sandbox.exec_run(["cat", self.report_path], timeout_seconds=10)
+        if exit_code != 0 or not raw_bytes:
+            return {"error": f"No {self.mode} report was written: the program did not exit normally (crash, signal or timeout)."}
+        raw = json.loads(raw_bytes)
+        if self.language == 'python':
+            return profiler.python_profile(raw, self.config) if self.mode == "profile" else profiler.python_memory(raw, self.config)
+        # On a compile-cache hit the debug info names the source of the run that built the binary
+        is_submission = lambda path: path.endswith("_main.cpp")
+        if self.mode == "profile":
+            return profiler.cpp_profile(raw, self._symbolize(profiler.cpp_addresses(raw)), is_submission, self.config)
+        return profiler.cpp_memory(raw, self._symbolize(profiler.cpp_memory_addresses(raw)), is_submission, self.config)
+
+    def close(self):
+        if self.sandbox:
+            with self.timings.span("sandbox_release"):
+                self.backend.release(self.sandbox, self.dirty)
+        self.timings.finish()
+
+
+def _killed_by(exit_code: int, elapsed: float, timeout_seconds: int):
+    """"timeout" for a SIGKILL from `timeout`, "oom" for any other SIGKILL (usually the memory limit), else None."""
+    if exit_code != 137:
+        return None
+    return "timeout" if elapsed >= timeout_seconds - 0.5 else "oom"
+
+
+def _describe_exit(result: dict, exit_code: int, elapsed: float, timeout_seconds: int, stage: str, config) -> bool:
+    """Turns a non-zero exit into a user-facing `result["error"]` prefix. Returns True if the sandbox is now dirty."""
+    if _killed_by(exit_code, elapsed, timeout_seconds) == "timeout":
+        result["error"] = f"{stage} timed out after {timeout_seconds} seconds."
+        logger.warning(f"{stage} timed out for run_id {result.get('run_id')}")
+        return True
+    if exit_code == 0:
+        return False
+    error_prefix = f"{stage} failed with exit code {exit_code}."
+    if result["error"]:
+        result["error"] = f"{error_prefix}\n{result['error']}"
+    else:
+        result["error"] = error_prefix
+
+    # Add specific error messages based on common exit codes
+    if exit_code == 137: # Often OOM Killer or SIGKILL (the timeout case returned above)
+         result["error"] += f" Process likely killed due to memory limit ({config.DOCKER_MEM_LIMIT})."
+         return True
+    elif exit_code == 139: # Segmentation Fault
+         result["error"] += " Process likely caused a Segmentation Fault."
+    elif exit_code == 127: # Command not found
+         result["error"] += " Command not found within the container (check image/path)."
+    return False
+
+
+def _handle_run_exception(e: Exception, session: RunSession, result: dict):
+    session.dirty = True # Whatever happened, don't trust the sandbox for another run
+    if isinstance(e, RunCancelled):
+        result["error"] = "Run cancelled."
+        logger.info(f"Run {session.run_id} cancelled by the client.")
+    elif isinstance(e, docker.errors.APIError):
+        result["error"] = f"Docker API error: {e}"
+        logger.error(f"Docker API Error for run {session.run_id}: {e}", exc_info=True)
+    else:
+        result["error"] = f"An unexpected error occurred during execution setup: {e}"
+        logger.error(f"Unexpected Runner Error for run {session.run_id}: {e}", exc_info=True)
+    if session.sandbox and isinstance(e, (docker.errors.APIError, OSError)): # OSError includes lost daemon connections
+        session.backend.report_failure(session.sandbox, e)
+
+
+def _new_result(run_id: str) -> dict:
+    return {
         "output": "",
         "error": "",
         "metrics": {
             "runtime_ms": -1,
-            "cpu_used": "N/A", # Requires complex polling not implemented here
-            "mem_used": "N/A", # Peak memory from stats
+            "cpu_used": "N/A", # CPU time and utilisation from the telemetry sampler
+            "mem_used": "N/A", # Peak memory from the telemetry sampler
             "time_complexity": "N/A",
             "space_complexity": "N/A"
         },
+        "exit_code": None, # Set once the program (or compiler) has run
         "run_id": run_id
     }
-    temp_dir = config.TEMP_CODE_DIR
-    # No need for os.makedirs here if Config.validate() ensures it exists
-    host_filepath = None
-    container = None
-    client = None
+
+
+def execute_code(code: str, language: str, config: object, on_output=None, stdin: str = None,
+                 profile: bool = False, memory: bool = False, timings: bool = False, trusted: bool = False, cancelled=None) -> dict:
+    """Runs a submission in a sandbox and returns output, errors and metrics.
+
+    With `on_output`, the program's stdout/stderr are forwarded as they are produced via
+    `on_output(stream_name, text)` instead of being collected into the result. `stdin` is
+    passed to the program's standard input. With `profile`, the program runs under the profiler
+    (cProfile for Python, an instrumented build for C++, both plus stack sampling) and the result
+    gets a `profile` section; with `memory`, allocations are traced (tracemalloc for Python, a
+    malloc/new shim for C++) and the result gets a `memory` section with the peak, the top
+    allocation sites and a heap timeline (see core/profiler.py). Either way runtime_ms includes
+    the instrumentation's overhead. The two modes are exclusive.
+
+    Output is captured in one pass with bounded memory (core/output_capture.py): beyond
+    OUTPUT_HEAD_BYTES + OUTPUT_TAIL_BYTES per stream the middle is left out, `metrics["output"]`
+    has the byte counts and a `truncated` flag, and a program that writes more than
+    OUTPUT_LIMIT_BYTES in total is stopped.
+
+    Every stage is timed and counted in the process-wide metrics (core/instrumentation.py); with
+    `timings` (or TIMINGS_IN_RESPONSE) the per-stage breakdown is also returned as `timings`.
+    `trusted` callers run on the TRUSTED_EXECUTION_BACKEND_* backends (see core/backends.py).
+    `cancelled` is polled while the program runs; once it returns True the program is killed and
+    the run ends with "Run cancelled.".
+    """
+    run_id = str(uuid.uuid4())
+    logger.info(f"Starting execution run_id: {run_id} for language: {language}")
+    result = _new_result(run_id)
+    if profile and memory:
+        result["error"] = "Profile and memory modes cannot be combined in one run."
+        return result
+    mode = "profile" if profile else "memory" if memory else None
+    session = RunSession(code, language, config, run_id, trusted=trusted)
+    stdin_bytes = stdin.encode('utf-8') if stdin is not None else None
+    # Streamed output goes to the client as it arrives and is only counted here
+    capture = output_capture.OutputCapture.from_config(config, _output_forwarder(on_output) if on_output else None)
 
     try:
-        # Define per-language settings
-        if language == 'python':
-            image_name = config.DOCKER_PYTHON_IMAGE
-            filename = f"{run_id}_script.py"
-            cmd = ["python", f"/app/{filename}"]
-            mount_mode = 'ro'
-        elif language == 'cpp':
-            image_name = config.DOCKER_CPP_IMAGE
-            filename = f"{run_id}_main.cpp"
-            # Use -O2 optimization flag for C++ compilation
-            cmd = ["sh", "-c", f"g++ /app/{filename} -std=c++17 -O2 -o /app/a.out && /app/a.out"]
-            mount_mode = 'rw' # Need write access in /app for compilation output 'a.out'
-        else:
-            result["error"] = f"Unsupported language: {language}"
-            logger.warning(f"Unsupported language request: {language} for run_id: {run_id}")
+        if not session.open(result):
             return result
+        sandbox = session.sandbox
 
-        host_filepath = os.path.join(temp_dir, filename)
-        container_mount_path = "/app" # Hardcoded working dir inside container
+        start_time = time.monotonic()
+        cmd, compile_failure = session.program_command(result["metrics"], mode=mode)
+        if compile_failure:
+            exit_code, stdout_bytes, stderr_bytes = compile_failure
+            elapsed = time.monotonic() - start_time
+        else:
+            # Run the submission inside the sandbox, sampling CPU and memory while it runs
+            with session.timings.span("telemetry_start"):
+                sampler = _start_telemetry(sandbox, config)
+            start_time = time.monotonic()
+            try:
+                if on_output:
+                    result["streamed"] = True
+                    # Line-buffer the program's output so chunks reach the client as they are printed
+                    if language == 'python':
+                        exit_code = _exec_captured(sandbox, cmd, config, capture, cancelled, environment={"PYTHONUNBUFFERED": "1"},
+                                                   stdin=stdin_bytes)
+                    else:
+                        exit_code = _exec_captured(sandbox, ["stdbuf", "-oL", "-eL"] + cmd, config, capture, cancelled, stdin=stdin_bytes)
+                else:
+                    exit_code = _exec_captured(sandbox, cmd, config, capture, cancelled, stdin=stdin_bytes)
+                if capture.limit_exceeded:
+                    exit_code = 137 # SIGKILLed: by the local backend right away, in a container when it is discarded
+                stdout_bytes, stderr_bytes = capture.stdout(), capture.stderr()
+            finally:
+                elapsed = time.monotonic() - start_time
+                session.timings.record("execute", elapsed)
+                with session.timings.span("telemetry_stop"):
+                    telemetry = sampler.stop(sole_tenant=not sandbox.pooled) if sampler else None
+            result["metrics"]["runtime_ms"] = round(elapsed * 1000)
+            result["metrics"]["output"] = capture.stats()
+            if telemetry:
+                _apply_telemetry(result["metrics"], telemetry)
+        result["exit_code"] = exit_code
+        instrumentation.count("runs_total", {"language": language, "exit_code": str(exit_code),
+                                             "stage": "compile" if compile_failure else "execute"})
+        killed_by = "output_limit" if capture.limit_exceeded else _killed_by(exit_code, elapsed, config.DOCKER_TIMEOUT_SECONDS)
+        if killed_by:
+            counter = {"timeout": "run_timeouts_total", "oom": "run_oom_kills_total", "output_limit": "run_output_limit_kills_total"}[killed_by]
+            instrumentation.count(counter, {"language": language})
+        logger.info(f"Sandbox {sandbox.short_id} finished run_id {run_id}. ExitCode: {exit_code}, Runtime: {result['metrics']['runtime_ms']}ms")
 
-        # Write code to temporary file
-        try:
-            with open(host_filepath, 'w', encoding='utf-8') as f:
-                f.write(code)
-            logger.debug(f"Code written to temporary file: {host_filepath}")
-        except IOError as e:
-             result["error"] = f"Failed to write code to temporary file: {e}"
-             logger.error(f"IOError writing {host_filepath}: {e}", exc_info=True)
-             return result
+        result["output"] = stdout_bytes.decode('utf-8', errors='replace').strip()
+        result["error"] = stderr_bytes.decode('utf-8', errors='replace').strip()
+        stage = "Compilation" if compile_failure else "Execution"
+        if capture.limit_exceeded:
+            session.dirty = True # The abandoned process may still be running in the container
+            limit = f"Execution stopped: the program wrote more than {metrics.format_bytes(config.OUTPUT_LIMIT_BYTES)} of output."
+            result["error"] = f"{limit}\n{result['error']}" if result["error"] else limit
+            logger.warning(f"Run {run_id} exceeded the output limit ({capture.total} bytes)")
+        elif _describe_exit(result, exit_code, elapsed, config.DOCKER_TIMEOUT_SECONDS, stage, config):
+            session.dirty = True
+        if mode and not compile_failure:
+            try:
+                with session.timings.span("collect_report"):
+                    result[mode] = session.collect_report()
+            except Exception as e:
+                logger.warning(f"Could not collect the {mode} report for run_id {run_id}: {e}", exc_info=True)
+                result[mode] = {"error": f"Could not read the {mode} report: {e}"}
 
+    except Exception as e:
+        _handle_run_exception(e, session, result)
+
+    finally:
+        # --- Cleanup ---
+        session.close()
+        logger.info(f"Finished execution run_id: {run_id}")
+
+    if timings or config.TIMINGS_IN_RESPONSE:
+        result["timings"] = session.timings.to_dict()
+    return result
+
+
+def _harness_source(name: str) -> str:
+    with open(os.path.join(HARNESS_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def _prepare_harness(sandbox, language: str, name: str, config):
+    """Returns (harness_cmd, environment) for core/harness/<name>.*, building the C version in C++ sandboxes.
+
+    Raises RuntimeError if the harness cannot be built.
+    """
+    if language == 'python':
+        # Fixed hash seed: dict/set iteration order (and so timing) stays the same across runs
+        return ["python", "-c", _harness_source(f"{name}.py")], {"PYTHONHASHSEED": "0"}
+    source_path, binary_path = f"{SANDBOX_WORKDIR}/{name}_harness.c", f"{SANDBOX_WORKDIR}/{name}_harness"
+    exit_code, _, stderr_bytes = sandbox.exec_run(
+        ["sh", "-c", f'printf "%s" "$HARNESS_SOURCE" > {source_path} && gcc -O2 -o {binary_path} {source_path}'],
+        config.DOCKER_TIMEOUT_SECONDS,
+        environment={"HARNESS_SOURCE": _harness_source(f"{name}.c")},
+    )
+    if exit_code != 0:
+        raise RuntimeError(f"Could not build the {name} harness: {stderr_bytes.decode('utf-8', errors='replace').strip()}")
+    return [binary_path], None
+
+
+def _benchmark_batches(sandbox, harness: list, environment, cmd: list, runs: int, warmups: int, config) -> dict:
+    """Drives the in-sandbox harness until `runs` timed samples exist and the median's CI is tight enough.
+
+    Each harness exec is one batch; batches stay short enough for the Docker client's socket timeout.
+    Once `runs` samples exist and the CI half-width is still above BENCHMARK_TARGET_CI_PCT, the sample
+    count is doubled, up to BENCHMARK_MAX_RUNS or the BENCHMARK_TIME_BUDGET_SECONDS budget.
+    """
+    per_run_timeout = config.DOCKER_TIMEOUT_SECONDS
+    max_batch_seconds = max(5, docker_client.client_timeout(config) - per_run_timeout - 5)
+    deadline = time.monotonic() + config.BENCHMARK_TIME_BUDGET_SECONDS
+    bench = {"warmup_ns": [], "times_ns": [], "cpu_ns": [], "exit_code": 0, "batches": 0, "truncated": False}
+    batch_runs = runs
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            bench["truncated"] = len(bench["times_ns"]) < runs
+            break
+        budget = min(remaining, max_batch_seconds)
+        batch_warmups = warmups if bench["batches"] == 0 else 0
+        exit_code, stdout_bytes, stderr_bytes = sandbox.exec_run(
+            harness + [str(batch_warmups), str(batch_runs), f"{budget:.3f}", str(per_run_timeout)] + cmd,
+            int(budget) + per_run_timeout + 5,
+            environment=environment,
+        )
+        bench["batches"] += 1
+        if exit_code != 0:
+            raise RuntimeError(f"Benchmark harness exited with code {exit_code}: {stderr_bytes.decode('utf-8', errors='replace').strip()[:500]}")
+        report = json.loads(stdout_bytes)
+        for key in ("warmup_ns", "times_ns", "cpu_ns"):
+            bench[key].extend(report[key])
+        if report["exit_code"] != 0:
+            bench["exit_code"], bench["failed_ns"] = report["exit_code"], report.get("failed_ns", 0)
+            break
+        collected = len(bench["times_ns"])
+        if collected >= config.BENCHMARK_MAX_RUNS:
+            break
+        if collected < runs:
+            batch_runs = runs - collected # The batch ran out of time; finish the requested runs
+        elif collected >= 2 and metrics.summarize_samples(bench["times_ns"])["ci_rel_pct"] <= config.BENCHMARK_TARGET_CI_PCT:
+            break
+        else:
+            batch_runs = min(collected, config.BENCHMARK_MAX_RUNS - collected)
+    return bench
 
-        # Initialize Docker client
-        try:
-             client = docker.from_env(timeout=10) # Add timeout for client connection
-             client.ping() # Verify connection
-             logger.info("Docker client connected successfully.")
-        except Exception as e:
-             result["error"] = f"Failed to connect to Docker: {e}"
-             logger.error(f"Docker connection error: {e}", exc_info=True)
-             if host_filepath and os.path.exists(host_filepath): os.remove(host_filepath)
-             return result
 
+def benchmark_code(code: str, language: str, config: object, runs: int = None, warmups: int = None) -> dict:
+    """Benchmark mode: runs the program `warmups` times untimed, then at least `runs` timed times,
+    all in one sandbox (compiled once), and reports the distribution of run times.
 
-        # Check and pull image if necessary
+    Timing happens inside the sandbox (core/harness/bench.*) with a monotonic nanosecond clock
+    around spawn and wait, so it excludes docker exec and container overhead. Program output is
+    discarded. Results go under metrics["benchmark"] in milliseconds: min/median/mean/p95/stdev,
+    a bootstrap 95% CI of the median and `ci_rel_pct`, its half-width relative to the median.
+    More runs are added until that is within BENCHMARK_TARGET_CI_PCT (2.5% by default, so a 5%
+    change falls outside the interval). The sandbox's CPU quota (DOCKER_CPUS) is enforced in 100 ms
+    periods; a program that gets throttled has stalls in its timings, reported as a warning.
+    """
+    run_id = str(uuid.uuid4())
+    runs = max(2, min(int(runs or config.BENCHMARK_RUNS), config.BENCHMARK_MAX_RUNS))
+    warmups = max(0, min(int(config.BENCHMARK_WARMUPS if warmups is None else warmups), config.BENCHMARK_MAX_RUNS))
+    logger.info(f"Starting benchmark run_id: {run_id} for language: {language} ({warmups} warmups, {runs} runs)")
+    result = _new_result(run_id)
+    session = RunSession(code, language, config, run_id, operation="benchmark")
+
+    try:
+        if not session.open(result):
+            return result
+        sandbox = session.sandbox
+
+        cmd, compile_failure = session.program_command(result["metrics"])
+        if compile_failure:
+            exit_code, _, stderr_bytes = compile_failure
+            result["exit_code"] = exit_code
+            result["error"] = stderr_bytes.decode('utf-8', errors='replace').strip()
+            _describe_exit(result, exit_code, 0, config.DOCKER_TIMEOUT_SECONDS, "Compilation", config)
+            return result
+
+        harness, environment = _prepare_harness(sandbox, language, "bench", config)
+        sampler = _start_telemetry(sandbox, config)
         try:
-            client.images.get(image_name)
-            logger.debug(f"Docker image found locally: {image_name}")
-        except docker.errors.ImageNotFound:
-            logger.info(f"Pulling Docker image: {image_name}")
-            try:
-                client.images.pull(image_name)
-                logger.info(f"Successfully pulled image: {image_name}")
-            except docker.errors.APIError as e:
-                 result["error"] = f"Failed to pull Docker image '{image_name}': {e}"
-                 logger.error(f"Error pulling image {image_name}: {e}", exc_info=True)
-                 if host_filepath and os.path.exists(host_filepath): os.remove(host_filepath)
-                 return result
-        except Exception as e:
-             result["error"] = f"Docker image check error for '{image_name}': {e}"
-             logger.error(f"Error checking image {image_name}: {e}", exc_info=True)
-             if host_filepath and os.path.exists(host_filepath): os.remove(host_filepath)
-             return result
-
-        # Define container configuration
-        # Mount the single file for Python, or the whole dir for C++ to allow compilation output
-        volumes_config = {}
-        if language == 'python':
-             volumes_config[host_filepath] = {'bind': f'{container_mount_path}/{filename}', 'mode': mount_mode}
-        elif language == 'cpp':
-             # Mount the directory containing the source file, allowing 'a.out' creation
-             volumes_config[temp_dir] = {'bind': container_mount_path, 'mode': mount_mode}
-
-        container_config = {
-            "image": image_name,
-            "command": cmd,
-            "volumes": volumes_config,
-            "working_dir": container_mount_path,
-            "mem_limit": config.DOCKER_MEM_LIMIT,
-            "memswap_limit": config.DOCKER_MEM_LIMIT, # Disables swap effectively
-            "cpus": config.DOCKER_CPUS,
-            "network_disabled": True,
-            "log_config": {"type": "json-file", "config": {"max-size": "1m"}},
-            "remove": False, # Remove manually after getting logs/stats
-            "detach": True,
-            "read_only": (language == 'python'), # Filesystem read-only for Python only
-            "security_opt": ["no-new-privileges"],
-            # Consider "user": "1001:1001" for python, "1002:1002" for cpp if UIDs match Dockerfile
+            bench = _benchmark_batches(sandbox, harness, environment, cmd, runs, warmups, config)
+        finally:
+            telemetry = sampler.stop(sole_tenant=not sandbox.pooled) if sampler else None
+
+        result["exit_code"] = bench["exit_code"]
+        if bench["exit_code"] != 0:
+            _, _, stderr_tail = sandbox.exec_run(["sh", "-c", "tail -c 4000 /tmp/bench_stderr >&2"], timeout_seconds=5)
+            result["error"] = stderr_tail.decode('utf-8', errors='replace').strip()
+            if _describe_exit(result, bench["exit_code"], bench["failed_ns"] / 1e9, config.DOCKER_TIMEOUT_SECONDS, "Benchmark run", config):
+                session.dirty = True
+        if not bench["times_ns"]:
+            if not result["error"]:
+                result["error"] = "Benchmark produced no timed runs within the time budget."
+            return result
+
+        times_ms = [t / 1e6 for t in bench["times_ns"]]
+        summary = {key: round(value, 3) if isinstance(value, float) else value
+                   for key, value in metrics.summarize_samples(times_ms).items()}
+        warnings = []
+        if summary["ci_rel_pct"] > config.BENCHMARK_TARGET_CI_PCT:
+            warnings.append(f"Timings are noisy: the median is only known to within ±{summary['ci_rel_pct']}% after {summary['n']} runs.")
+        if bench["truncated"]:
+            warnings.append(f"Time budget of {config.BENCHMARK_TIME_BUDGET_SECONDS}s ran out after {summary['n']} of {runs} runs.")
+        if telemetry and telemetry.get("throttled_periods"):
+            warnings.append(f"CPU quota throttling (DOCKER_CPUS={config.DOCKER_CPUS}) hit {telemetry['throttled_periods']} times; "
+                            "runs longer than the quota include throttle stalls.")
+        result["metrics"]["runtime_ms"] = summary["median"]
+        result["metrics"]["benchmark"] = {
+            **summary,
+            "warmups": len(bench["warmup_ns"]),
+            "requested_runs": runs,
+            "batches": bench["batches"],
+            "cpu_median_ms": round(statistics.median(bench["cpu_ns"]) / 1e6, 3),
+            "target_ci_pct": config.BENCHMARK_TARGET_CI_PCT,
+            "stable": summary["ci_rel_pct"] <= config.BENCHMARK_TARGET_CI_PCT,
+            "samples_ms": [round(t, 3) for t in times_ms],
+            "warnings": warnings,
         }
+        if telemetry:
+            _apply_telemetry(result["metrics"], telemetry)
+        logger.info(f"Benchmark run_id {run_id}: median {summary['median']} ms over {summary['n']} runs (±{summary['ci_rel_pct']}%)")
 
-        # Run the container
-        logger.info(f"Starting container for run_id: {run_id}")
-        start_time = time.time()
-        container = client.containers.run(**container_config)
-        logger.debug(f"Container {container.short_id} started for run_id: {run_id}")
+    except Exception as e:
+        _handle_run_exception(e, session, result)
 
+    finally:
+        session.close()
 
-        # Wait for container completion and handle results/timeouts
-        try:
-            exit_info = container.wait(timeout=config.DOCKER_TIMEOUT_SECONDS)
-            end_time = time.time()
-            result["metrics"]["runtime_ms"] = round((end_time - start_time) * 1000)
-            exit_code = exit_info.get("StatusCode", -1)
-            logger.info(f"Container {container.short_id} finished. ExitCode: {exit_code}, Runtime: {result['metrics']['runtime_ms']}ms")
-
-            # Retrieve logs (critical to do this *after* wait)
-            stdout_logs = container.logs(stdout=True, stderr=False).decode('utf-8', errors='replace').strip()
-            stderr_logs = container.logs(stdout=False, stderr=True).decode('utf-8', errors='replace').strip()
-
-            result["output"] = stdout_logs
-            result["error"] = stderr_logs
-
-            if exit_code != 0:
-                error_prefix = f"Execution failed with exit code {exit_code}."
-                if result["error"]:
-                    result["error"] = f"{error_prefix}\n{result['error']}"
-                else:
-                    result["error"] = error_prefix
+    return result
 
-                # Add specific error messages based on common exit codes
-                if exit_code == 137: # Often OOM Killer or SIGKILL
-                     if (end_time - start_time) >= config.DOCKER_TIMEOUT_SECONDS - 0.5: # Check if close to timeout
-                          result["error"] += f" Process likely killed due to timeout ({config.DOCKER_TIMEOUT_SECONDS}s)."
-                     else:
-                          result["error"] += f" Process likely killed due to memory limit ({config.DOCKER_MEM_LIMIT})."
-                elif exit_code == 139: # Segmentation Fault
-                     result["error"] += " Process likely caused a Segmentation Fault."
-                elif exit_code == 127: # Command not found
-                     result["error"] += " Command not found within the container (check image/path)."
 
+CASE_DIR = f"{SANDBOX_WORKDIR}/cases"
+PASSING_VERDICTS = ("passed", "completed") # "completed": exited 0 and the case had no expected output
+
+
+def _case_result(report: dict) -> dict:
+    return {
+        "index": report["index"],
+        "verdict": report["verdict"],
+        "exit_code": report["exit_code"],
+        "runtime_ms": round(report["time_ns"] / 1e6, 3),
+        "cpu_ms": round(report["cpu_ns"] / 1e6, 3),
+        "peak_rss_bytes": report["maxrss_kb"] * 1024,
+        "stdout": report["stdout"],
+        "stderr": report["stderr"],
+        "output_truncated": report["truncated"],
+    }
+
+
+def run_testcases(code: str, language: str, config: object, cases: list, stop_on_failure: bool = False,
+                  case_timeout: int = None, timeout: int = None) -> dict:
+    """Batch mode: compiles once and runs the program against every case in a single sandbox.
+
+    `cases` is a list of {"stdin": str, "expected": str or None}. The cases are copied into the
+    sandbox in one tar stream and run by core/harness/cases.* with a `case_timeout` per case
+    (at most DOCKER_TIMEOUT_SECONDS) and `timeout` overall (at most BATCH_TIME_BUDGET_SECONDS).
+    Output is compared with `expected`, ignoring trailing whitespace. Returns the usual result
+    plus `cases` (verdict, exit code, runtime, CPU time, peak RSS and the first
+    BATCH_OUTPUT_LIMIT_BYTES of stdout/stderr for each case) and `summary`. With `stop_on_failure`
+    the cases after the first failing one are reported as "skipped", as are cases the time
+    budget did not reach.
+    """
+    run_id = str(uuid.uuid4())
+    case_timeout = max(1, min(int(case_timeout or config.DOCKER_TIMEOUT_SECONDS), config.DOCKER_TIMEOUT_SECONDS))
+    budget = max(1, min(int(timeout or config.BATCH_TIME_BUDGET_SECONDS), config.BATCH_TIME_BUDGET_SECONDS))
+    logger.info(f"Starting batch run_id: {run_id} for language: {language} ({len(cases)} cases)")
+    result = _new_result(run_id)
+    result["cases"], result["summary"] = [], None
+    session = RunSession(code, language, config, run_id, operation="batch")
+    reports, stopped = [], "error"
+
+    try:
+        if not session.open(result):
+            return result
+        sandbox = session.sandbox
+
+        cmd, compile_failure = session.program_command(result["metrics"])
+        if compile_failure:
+            exit_code, _, stderr_bytes = compile_failure
+            result["exit_code"] = exit_code
+            result["error"] = stderr_bytes.decode('utf-8', errors='replace').strip()
+            _describe_exit(result, exit_code, 0, config.DOCKER_TIMEOUT_SECONDS, "Compilation", config)
+            return result
+
+        files = {}
+        for i, case in enumerate(cases):
+            files[f"cases/{i}.in"] = (case.get("stdin") or "").encode('utf-8')
+            if case.get("expected") is not None:
+                files[f"cases/{i}.expected"] = case["expected"].encode('utf-8')
+        sandbox.put_files(files)
+        harness, environment = _prepare_harness(sandbox, language, "cases", config)
+
+        # The harness prints one JSON line per finished case
+        pending = bytearray()
+        def on_chunk(stream_name, data):
+            nonlocal stopped
+            if stream_name != "stdout":
+                return
+            pending.extend(data)
+            while b"\n" in pending:
+                line, _, rest = bytes(pending).partition(b"\n")
+                pending[:] = rest
+                report = json.loads(line.decode('utf-8', errors='replace'))
+                if report.get("done"):
+                    stopped = report["stopped"]
+                else:
+                    reports.append(report)
+
+        sampler = _start_telemetry(sandbox, config)
+        start_time = time.monotonic()
+        try:
+            exit_code = sandbox.exec_stream(
+                harness + [CASE_DIR, str(len(cases)), str(case_timeout), str(budget), "1" if stop_on_failure else "0",
+                           str(config.BATCH_OUTPUT_LIMIT_BYTES)] + cmd,
+                budget + case_timeout + 10,
+                on_chunk,
+                environment=environment,
+            )
+        finally:
+            elapsed = time.monotonic() - start_time
+            telemetry = sampler.stop(sole_tenant=not sandbox.pooled) if sampler else None
+        if telemetry:
+            _apply_telemetry(result["metrics"], telemetry)
+        if exit_code != 0 or stopped == "error":
+            session.dirty = True
+            result["error"] = f"Test-case harness stopped unexpectedly (exit code {exit_code})."
+            if exit_code == 137 and elapsed >= budget:
+                result["error"] = f"Batch timed out after {budget} seconds."
 
-            # Attempt to get final stats for peak memory
-            try:
-                 stats = container.stats(stream=False)
-                 mem_usage = stats.get('memory_stats', {}).get('max_usage') # Peak usage
-                 if mem_usage is not None:
-                      result["metrics"]["mem_used"] = f"{mem_usage / (1024*1024):.2f} MiB"
-                 else:
-                      # Fallback to final usage if max_usage not available
-                      mem_usage = stats.get('memory_stats', {}).get('usage')
-                      if mem_usage is not None:
-                          result["metrics"]["mem_used"] = f"{mem_usage / (1024*1024):.2f} MiB (Final)"
-                      else:
-                           result["metrics"]["mem_used"] = "N/A"
-                 logger.debug(f"Container {container.short_id} memory usage: {result['metrics']['mem_used']}")
-
-            except Exception as stats_err:
-                 logger.warning(f"Could not retrieve container stats for {container.short_id}: {stats_err}")
-                 result["metrics"]["mem_used"] = "Error"
-
-
-        except (docker.errors.ContainerError) as container_err:
-             # Error during container execution reported by Docker daemon
-             end_time = time.time()
-             result["metrics"]["runtime_ms"] = round((end_time - start_time) * 1000)
-             result["error"] = f"Container execution error: {str(container_err)}"
-             logger.error(f"ContainerError for run_id {run_id}: {container_err}", exc_info=True)
-             if container: # Try to get logs even if wait fails
-                 try:
-                     err_logs = container.logs(stderr=True, stdout=False).decode('utf-8', errors='replace').strip()
-                     if err_logs: result["error"] += "\n--- Container Logs ---\n" + err_logs
-                 except: pass # Ignore errors getting logs here
-
-        except Exception as wait_err: # Catches timeout from container.wait() or other wait issues
-             end_time = time.time()
-             elapsed = end_time - start_time
-             result["metrics"]["runtime_ms"] = round(elapsed * 1000)
-             logger.warning(f"Exception during container wait for {container.short_id}: {wait_err}", exc_info=True)
-             # Check if it was likely a timeout
-             if elapsed >= config.DOCKER_TIMEOUT_SECONDS - 0.1: # Allow slight timing variation
-                 result["error"] = f"Execution timed out after {config.DOCKER_TIMEOUT_SECONDS} seconds."
-                 logger.warning(f"Execution timed out for run_id {run_id}")
-                 if container:
-                     try:
-                         logger.info(f"Stopping timed-out container {container.short_id}")
-                         container.stop(timeout=1)
-                     except Exception as stop_err:
-                         logger.error(f"Error stopping timed-out container {container.short_id}: {stop_err}")
-             else:
-                # Some other error during wait
-                result["error"] = f"Error waiting for container results: {wait_err}"
-                if container: # Try get logs
-                     try:
-                        err_logs = container.logs(stderr=True, stdout=False).decode('utf-8', errors='replace').strip()
-                        if err_logs: result["error"] += "\n--- Container Logs ---\n" + err_logs
-                     except: pass
-
-
-    except docker.errors.APIError as e:
-        result["error"] = f"Docker API error: {e}"
-        logger.error(f"Docker API Error for run {run_id}: {e}", exc_info=True)
     except Exception as e:
-        result["error"] = f"An unexpected error occurred during execution setup: {e}"
-        logger.error(f"Unexpected Runner Error for run {run_id}: {e}", exc_info=True)
+        _handle_run_exception(e, session, result)
 
     finally:
-        # --- Cleanup ---
-        if container:
-            try:
-                container.remove(force=True)
-                logger.debug(f"Container {container.short_id} removed for run_id: {run_id}")
-            except docker.errors.NotFound:
-                logger.debug(f"Container {container.short_id} already removed.")
-            except Exception as final_remove_err:
-                logger.warning(f"Warning: Error during final container removal {container.short_id}: {final_remove_err}")
-
-        if host_filepath and os.path.exists(host_filepath):
-            try:
-                os.remove(host_filepath)
-                logger.debug(f"Removed temporary source file: {host_filepath}")
-                # Also remove compiled C++ executable if it exists
-                if language == 'cpp':
-                     cpp_executable_path = os.path.join(temp_dir, 'a.out')
-                     if os.path.exists(cpp_executable_path):
-                         os.remove(cpp_executable_path)
-                         logger.debug(f"Removed temporary executable: {cpp_executable_path}")
-            except OSError as e:
-                logger.warning(f"Warning: Could not remove temporary file(s) for run_id {run_id}: {e}")
+        session.close()
 
-        logger.info(f"Finished execution run_id: {run_id}")
+    result["cases"] = [_case_result(report) for report in reports]
+    result["cases"] += [{"index": i, "verdict": "skipped"} for i in range(len(reports), len(cases))]
+    verdicts = {}
+    for case in result["cases"]:
+        verdicts[case["verdict"]] = verdicts.get(case["verdict"], 0) + 1
+    passed = sum(verdicts.get(verdict, 0) for verdict in PASSING_VERDICTS)
+    result["summary"] = {
+        "total": len(cases),
+        "passed": passed,
+        "failed": len(reports) - passed,
+        "skipped": len(cases) - len(reports),
+        "verdicts": verdicts,
+        "all_passed": passed == len(cases),
+        "stopped": stopped,
+    }
+    if reports:
+        result["metrics"]["runtime_ms"] = round(sum(report["time_ns"] for report in reports) / 1e6, 3)
+        result["exit_code"] = 0 if result["summary"]["all_passed"] else 1
+        result["output"] = f"{passed}/{len(cases)} cases passed."
+    logger.info(f"Finished batch run_id {run_id}: {passed}/{len(cases)} passed (stopped: {stopped})")
+    return result
+
+
+def _size_series(options: dict, config) -> list:
+    """Input sizes for complexity analysis: explicit `sizes`, or a geometric series start * factor^k.
 
-    return result
\ No newline at end of file
+    At most COMPLEXITY_MAX_STEPS sizes, none above COMPLEXITY_MAX_SIZE; the series stops at the
+    first size past it. The options are validated by the /run route.
+    """
+    if options.get("sizes"):
+        sizes = sorted({int(n) for n in options["sizes"] if 0 < int(n) <= config.COMPLEXITY_MAX_SIZE})
+        return sizes[:config.COMPLEXITY_MAX_STEPS]
+    start = int(options.get("start", config.COMPLEXITY_START_SIZE))
+    factor = float(options.get("factor", 2))
+    steps = min(int(options.get("steps", config.COMPLEXITY_STEPS)), config.COMPLEXITY_MAX_STEPS)
+    sizes, size = set(), float(start)
+    for _ in range(steps):
+        if size > config.COMPLEXITY_MAX_SIZE:
+            break
+        sizes.add(max(1, round(size)))
+        size *= factor
+    return sorted(sizes)
+
+
+def _scaling_warning(kind: str, fit: dict, target_size: int, limit: float, unit_scale: float, unit: str):
+    predicted = metrics.predict_complexity(fit, target_size)
+    if predicted is None or predicted > limit:
+        shown = "overflow" if predicted is None else f"~{predicted / unit_scale:,.1f} {unit}"
+        return (f"{kind} grows as {fit['model']}: at n={target_size:,} the fitted curve predicts {shown}, "
+                f"above the sandbox limit of {limit / unit_scale:,.1f} {unit}.")
+    return None
+
+
+def analyze_complexity(code: str, language: str, config: object, options: dict = None) -> dict:
+    """Complexity-analysis mode: runs the program across a geometric series of input sizes and fits
+    runtime and peak memory against the candidate growth models in metrics.estimate_complexity().
+
+    The code marks the input size with a placeholder token (`size_param`, default "__N__") that is
+    replaced by each size. Every size is run `repeats` times and the fastest run is kept. Stops at
+    the first failing size or when COMPLEXITY_TIME_BUDGET_SECONDS is spent. Returns the result of
+    the largest completed run with `time_complexity`/`space_complexity` filled in and the raw
+    measurements, fits and scaling warnings under metrics["complexity"].
+    """
+    options = options or {}
+    placeholder = options.get("size_param") or "__N__"
+    if placeholder not in code:
+        return {"output": "", "error": f"Complexity analysis needs the input size marked in the code with '{placeholder}'.",
+                "metrics": {}, "exit_code": None, "run_id": None}
+    sizes = _size_series(options, config)
+    if len(sizes) < 3:
+        return {"output": "", "error": "Complexity analysis needs at least 3 distinct input sizes.",
+                "metrics": {}, "exit_code": None, "run_id": None}
+    repeats = max(1, min(int(options.get("repeats", config.COMPLEXITY_REPEATS)), 5))
+    deadline = time.monotonic() + config.COMPLEXITY_TIME_BUDGET_SECONDS
+
+    measured_sizes, runtimes, memories = [], [], []
+    last_result, stopped_early = None, None
+    for n in sizes:
+        if time.monotonic() > deadline:
+            stopped_early = f"Time budget of {config.COMPLEXITY_TIME_BUDGET_SECONDS}s spent before n={n}."
+            break
+        sized_code = code.replace(placeholder, str(n))
+        best_runtime, peak_memory, failed = None, 0, None
+        for _ in range(repeats):
+            run = execute_code(sized_code, language, config)
+            if run.get("exit_code") != 0:
+                failed = run
+                break
+            best_runtime = run["metrics"]["runtime_ms"] if best_runtime is None else min(best_runtime, run["metrics"]["runtime_ms"])
+            telemetry = run["metrics"].get("telemetry", {})
+            peak_memory = max(peak_memory, telemetry.get("peak_mem_bytes") or telemetry.get("peak_rss_bytes") or 0)
+            last_result = run
+        if failed:
+            stopped_early = f"Run failed at n={n}: {failed['error'][:200]}"
+            if last_result is None:
+                last_result = failed
+            break
+        measured_sizes.append(n)
+        runtimes.append(best_runtime)
+        memories.append(peak_memory)
+
+    if last_result is None:
+        return {"output": "", "error": f"Complexity analysis did not complete any run. {stopped_early}",
+                "metrics": {}, "exit_code": None, "run_id": None}
+    result = last_result
+    time_fit = metrics.estimate_complexity(measured_sizes, runtimes)
+    space_fit = metrics.estimate_complexity(measured_sizes, memories) if any(memories) else None
+    target_size = int(options.get("target_size", config.COMPLEXITY_TARGET_SIZE))
+    warnings = []
+    if time_fit:
+        result["metrics"]["time_complexity"] = f"{time_fit['model']} (confidence {time_fit['confidence']:.0%})"
+        warnings.append(_scaling_warning("Runtime", time_fit, target_size, config.DOCKER_TIMEOUT_SECONDS * 1000, 1000, "s"))
+    if space_fit:
+        result["metrics"]["space_complexity"] = f"{space_fit['model']} (confidence {space_fit['confidence']:.0%})"
+        warnings.append(_scaling_warning("Memory", space_fit, target_size, metrics.parse_size(config.DOCKER_MEM_LIMIT), 1024 * 1024, "MiB"))
+    if not time_fit:
+        result["metrics"]["time_complexity"] = "N/A (fewer than 3 sizes completed)"
+    result["metrics"]["complexity"] = {
+        "sizes": measured_sizes,
+        "runtime_ms": runtimes,
+        "peak_mem_bytes": memories,
+        "time": time_fit,
+        "space": space_fit,
+        "target_size": target_size,
+        "warnings": [warning for warning in warnings if warning],
+        "stopped_early": stopped_early,
+    }
+    return result
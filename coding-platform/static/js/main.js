@@ -10,6 +10,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const runButton = document.getElementById('run-button');
     const optimizeButton = document.getElementById('optimize-button');
     const languageSelect = document.getElementById('language-select');
+    const complexityCheckbox = document.getElementById('complexity-checkbox');
+    const benchmarkCheckbox = document.getElementById('benchmark-checkbox');
+    const profileCheckbox = document.getElementById('profile-checkbox');
+    const profileArea = document.getElementById('profile-area');
+    const memoryCheckbox = document.getElementById('memory-checkbox');
+    const memoryArea = document.getElementById('memory-area');
     const outputArea = document.getElementById('output-area');
     const geminiGenerateButton = document.getElementById('gemini-generate-button');
     const geminiPrompt = document.getElementById('gemini-prompt');
@@ -22,9 +28,12 @@ document.addEventListener('DOMContentLoaded', () => {
     const metricMem = document.getElementById('metric-mem');
     const metricTimeComp = document.getElementById('metric-time-comp');
     const metricSpaceComp = document.getElementById('metric-space-comp');
+    const metricBenchmark = document.getElementById('metric-benchmark');
 
     // --- State ---
     let isBusy = false; // General flag for backend operations (run, generate, optimize)
+    const JOB_POLL_INTERVAL_MS = 500; // How often to poll /jobs/<id> for queued (non-streamed) runs
+    let hotLineMarkers = []; // ACE marker IDs for the last profile's hot lines
 
     // --- Check essential elements ---
     if (!runButton) console.error("[main.js] Run button not found!");
@@ -113,24 +122,125 @@ document.addEventListener('DOMContentLoaded', () => {
         setBusyState(true, runButton, 'Running...');
         updateOutputArea(`Running ${language} code...\nPlease wait...`, false, true);
         clearMetrics("Running...");
+        clearHotLines();
         if (typeof switchTab === 'function') switchTab('output-tab');
 
+        if (complexityCheckbox && complexityCheckbox.checked) {
+            runComplexityAnalysis(code, language);
+            return;
+        }
+        if (benchmarkCheckbox && benchmarkCheckbox.checked) {
+            runBenchmark(code, language);
+            return;
+        }
+
+        const profile = Boolean(profileCheckbox && profileCheckbox.checked);
+        const memory = Boolean(memoryCheckbox && memoryCheckbox.checked) && !profile; // The server runs one mode at a time
+        let streamedText = "";
+        let sawOutput = false;
+        const appendOutput = (text) => {
+            if (!sawOutput) { streamedText = ""; sawOutput = true; }
+            streamedText += text;
+            updateOutputArea(streamedText);
+        };
+
+        fetch('/run/stream', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
+            body: JSON.stringify({ code: code, language: language, profile: profile, memory: memory }),
+        })
+        .then(response => {
+            // Validation errors and 429s come back as plain JSON
+            if (!response.ok) return handleFetchResponse(response);
+            return readEventStream(response, (event, data) => {
+                if (event === 'queued') {
+                    console.log(`[main.js] Run queued as job ${data.job_id}`);
+                    if (data.position > 0) updateOutputArea(`Running ${language} code...\nQueued (position ${data.position + 1})...`, false, true);
+                } else if (event === 'stdout' || event === 'stderr') {
+                    appendOutput(data.text);
+                } else if (event === 'result') {
+                    console.log("[main.js] Run Result:", data);
+                    processStreamResult(data, sawOutput ? streamedText : "");
+                    if (data.profile) {
+                        renderProfile(data.profile);
+                        if (!data.profile.error && typeof switchTab === 'function') switchTab('profile-tab');
+                    }
+                    if (data.memory) {
+                        renderMemory(data.memory);
+                        if (!data.memory.error && typeof switchTab === 'function') switchTab('memory-tab');
+                    }
+                } else if (event === 'error') {
+                    throw new Error(data.error);
+                }
+            });
+        })
+        .catch(error => {
+            console.error('[main.js] Error running code:', error);
+            updateOutputArea(`Execution Error: ${error.message}\nCheck server logs for details.`, true);
+            clearMetrics("Execution failed.");
+            if (typeof switchTab === 'function') switchTab('output-tab');
+        })
+        .finally(() => {
+            setBusyState(false, runButton, 'Run Code');
+        });
+    }
+
+    function runComplexityAnalysis(code, language) {
+        // Runs many sizes, so it goes through the job queue instead of the output stream
+        updateOutputArea(`Analyzing ${language} code complexity...\nRunning at increasing input sizes (__N__), this can take a while...`, false, true);
         fetch('/run', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+            body: JSON.stringify({ code: code, language: language, complexity: {} }),
+        })
+        .then(handleFetchResponse)
+        .then(job => pollJob(job.job_id))
+        .then(data => {
+            console.log("[main.js] Complexity Result:", data);
+            processRunResult(data);
+            const complexity = data.metrics?.complexity;
+            if (complexity?.warnings?.length) {
+                updateOutputArea(outputArea.textContent + "\n\nScaling warnings:\n-----------------\n" + complexity.warnings.join("\n"), Boolean(data.error));
+            }
+            if (typeof switchTab === 'function') switchTab('metrics-tab');
+        })
+        .catch(error => {
+            console.error('[main.js] Error analyzing complexity:', error);
+            updateOutputArea(`Complexity Analysis Error: ${error.message}`, true);
+            clearMetrics("Analysis failed.");
+        })
+        .finally(() => {
+            setBusyState(false, runButton, 'Run Code');
+        });
+    }
+
+    function runBenchmark(code, language) {
+        // Repeated runs take a while, so this also goes through the job queue
+        updateOutputArea(`Benchmarking ${language} code...\nWarming up, then timing repeated runs (program output is discarded)...`, false, true);
+        fetch('/benchmark', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
             body: JSON.stringify({ code: code, language: language }),
         })
         .then(handleFetchResponse)
+        .then(job => pollJob(job.job_id))
         .then(data => {
-            console.log("[main.js] Run Result:", data);
+            console.log("[main.js] Benchmark Result:", data);
             processRunResult(data);
-            if (typeof switchTab === 'function') switchTab('output-tab');
+            const bench = data.metrics?.benchmark;
+            if (bench) {
+                let summary = `Benchmark: ${bench.n} runs after ${bench.warmups} warmups\n` +
+                    `min ${bench.min} ms | median ${bench.median} ms | mean ${bench.mean} ms | p95 ${bench.p95} ms | stdev ${bench.stdev} ms\n` +
+                    `95% CI of the median: ${bench.ci_low} - ${bench.ci_high} ms (±${bench.ci_rel_pct}%)`;
+                if (bench.warnings?.length) summary += "\n\nWarnings:\n---------\n" + bench.warnings.join("\n");
+                updateOutputArea(data.error ? `${outputArea.textContent}\n\n${summary}` : summary, Boolean(data.error));
+            }
+            if (typeof switchTab === 'function') switchTab(bench ? 'metrics-tab' : 'output-tab');
         })
         .catch(error => {
-            console.error('[main.js] Error running code:', error);
-            updateOutputArea(`Execution Error: ${error.message}\nCheck server logs for details.`, true);
-            clearMetrics("Execution failed.");
-            if (typeof switchTab === 'function') switchTab('output-tab');
+            console.error('[main.js] Error benchmarking code:', error);
+            updateOutputArea(`Benchmark Error: ${error.message}`, true);
+            clearMetrics("Benchmark failed.");
         })
         .finally(() => {
             setBusyState(false, runButton, 'Run Code');
@@ -153,24 +263,61 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         setBusyState(true, optimizeButton, 'Optimizing...');
-        showTemporaryMessage("Requesting AI code optimization...", "info");
+        updateGeminiOutput("// Requesting AI code optimization...", false, true);
 
-        fetch('/optimize', {
+        let candidateText = "";
+        let verifyJobId = null;
+        let streamError = null;
+        fetch('/optimize/stream', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
             body: JSON.stringify({ code: code, language: language }),
         })
-        .then(handleFetchResponse)
+        .then(response => {
+            if (!response.ok) return handleFetchResponse(response);
+            // The candidate streams into the AI Coder tab; the editor only changes once it is accepted
+            if (typeof switchTab === 'function') switchTab('gemini-tab');
+            return readEventStream(response, (event, data) => {
+                if (event === 'analysis') {
+                    console.log("[main.js] Static analysis:", data);
+                    if (data.findings?.length) updateGeminiOutput(`// Requesting AI code optimization (static analysis flagged ${data.findings.length} likely hotspot(s))...`, false, true);
+                } else if (event === 'delta') {
+                    candidateText += data.text;
+                    updateGeminiOutput(candidateText);
+                } else if (event === 'done') {
+                    candidateText = data.code;
+                    updateGeminiOutput(candidateText);
+                } else if (event === 'verify') {
+                    verifyJobId = data.job_id;
+                    updateGeminiOutput(candidateText + "\n\n// Verifying: running and benchmarking against your code...", false, true);
+                } else if (event === 'error') {
+                    streamError = data.error;
+                }
+            });
+        })
+        .then(() => {
+            if (streamError) return { error: streamError };
+            if (verifyJobId) return pollJob(verifyJobId);
+            return { optimized_code: candidateText };
+        })
         .then(data => {
             console.log("[main.js] Optimize Result:", data);
-            if (data.optimized_code && !data.optimized_code.startsWith("Error:")) {
+            if (data.verification) updateGeminiOutput(`${data.candidate_code}\n\n// ${data.verification.reason}`);
+            if (data.error) {
+                showTemporaryMessage(data.error, "error");
+            } else if (data.verification && !data.accepted) {
+                // The candidate was slower, differed in output or could not be checked; keep the user's code
+                showTemporaryMessage(`Kept your original code. ${data.verification.reason}`, "warning");
+                if (data.verification.output_diff) console.log("[main.js] Output diff (original vs optimized):\n" + data.verification.output_diff);
+            } else if (data.optimized_code && !data.optimized_code.startsWith("Error:")) {
                  if (!checkEditor()) return; // Re-check editor before setting value
                 const currentCursorPosition = editor.getCursorPosition();
                 editor.setValue(data.optimized_code, -1); // Replace editor content, cursor to start
                 // Try to restore cursor position (might not be perfect after code change)
                 try { editor.moveCursorToPosition(currentCursorPosition); } catch(e) { console.warn("Couldn't restore cursor position after optimize."); }
                 editor.clearSelection();
-                showTemporaryMessage("Code optimized by AI and updated in editor.", "success");
+                const verified = data.verification ? ` ${data.verification.reason}` : "";
+                showTemporaryMessage(`Code optimized by AI and updated in editor.${verified}`, "success");
             } else {
                  // Handle cases where AI returns an error string or empty data
                  const errorMessage = data.optimized_code || "Optimization failed: No optimized code returned by AI.";
@@ -206,21 +353,27 @@ document.addEventListener('DOMContentLoaded', () => {
         updateGeminiOutput("// Generating code with AI, please wait...", false, true);
         if (typeof switchTab === 'function') switchTab('gemini-tab');
 
-        fetch('/generate', {
+        let generatedText = "";
+        fetch('/generate/stream', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json', 'Accept': 'application/json' },
+            headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
             body: JSON.stringify({ prompt: prompt, language: language }),
         })
-        .then(handleFetchResponse)
-        .then(data => {
-            console.log("[main.js] AI Generation Result:", data);
-            if (data.generated_code && !data.generated_code.startsWith("Error:")) {
-                 updateGeminiOutput(data.generated_code);
-                 // Could add a "Copy to Editor" button here
-            } else {
-                 const errorMessage = data.generated_code || "// Failed to generate code. Empty response from AI.";
-                 updateGeminiOutput(errorMessage, true);
-            }
+        .then(response => {
+            if (!response.ok) return handleFetchResponse(response);
+            // Code is shown as the model writes it
+            return readEventStream(response, (event, data) => {
+                if (event === 'delta') {
+                    generatedText += data.text;
+                    updateGeminiOutput(generatedText);
+                } else if (event === 'done') {
+                    console.log("[main.js] AI Generation Result:", data);
+                    updateGeminiOutput(data.code || "// Failed to generate code. Empty response from AI.", !data.code);
+                    // Could add a "Copy to Editor" button here
+                } else if (event === 'error') {
+                    updateGeminiOutput(data.error, true);
+                }
+            });
         })
         .catch(error => {
             console.error('[main.js] Error generating code:', error);
@@ -246,13 +399,48 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         if (!response.ok) {
-            const errorMsg = data?.error || response.statusText || `HTTP error ${response.status}`;
+            let errorMsg = data?.error || response.statusText || `HTTP error ${response.status}`;
+            if (data?.retry_after) errorMsg += ` (retry in ${data.retry_after}s)`;
             console.error(`[main.js] Fetch error ${response.status}: ${errorMsg}`);
             throw new Error(errorMsg);
         }
         return data;
     }
 
+    async function pollJob(jobId) {
+        // Polls /jobs/<id> until the job finishes and resolves with its result
+        while (true) {
+            const job = await fetch(`/jobs/${jobId}`, { headers: { 'Accept': 'application/json' } }).then(handleFetchResponse);
+            if (job.status === 'done') return job.result;
+            if (job.status === 'failed') throw new Error(job.error || "Job failed on the server.");
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        }
+    }
+
+    async function readEventStream(response, onEvent) {
+        // Minimal Server-Sent Events parser over a fetch() body (EventSource cannot POST)
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let eventName = 'message';
+                const dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    else if (line.startsWith('data:')) dataLines.push(line.slice(5).trimStart());
+                });
+                if (dataLines.length) onEvent(eventName, JSON.parse(dataLines.join('\n')));
+            }
+        }
+    }
+
     function setBusyState(busy, buttonElement = null, busyText = 'Working...') {
         isBusy = busy;
         // Disable all major action buttons when busy
@@ -299,6 +487,176 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    function processStreamResult(data, streamedText) {
+        // Output was already rendered as it arrived; append the final status and update metrics
+        let outputContent = streamedText;
+        if (data.error) {
+            outputContent += (outputContent ? "\n\nError:\n------\n" : "Error:\n------\n") + data.error;
+        }
+        if (!outputContent) {
+            outputContent = "Execution finished successfully with no output.";
+        }
+        updateOutputArea(outputContent + formatAnalysis(data.analysis), Boolean(data.error));
+
+        if (data.metrics) {
+            updateMetrics(data.metrics);
+        } else {
+            clearMetrics("N/A");
+        }
+    }
+
+    function formatAnalysis(analysis) {
+        // Static analyzer findings (core/analyzer.py) as a section appended to the run output
+        if (!analysis?.findings?.length) return "";
+        const lines = analysis.findings.map(f =>
+            `Line ${f.line}${f.loop_depth ? ` (loop depth ${f.loop_depth})` : ""} [${f.severity}]: ${f.message}`);
+        if (analysis.truncated) lines.push("...");
+        return "\n\nStatic analysis:\n----------------\n" + lines.join("\n");
+    }
+
+    function renderProfile(profile) {
+        // Function table, hot lines and a collapsed-stacks download for a profiled run (core/profiler.py)
+        if (!profileArea) return;
+        profileArea.replaceChildren();
+        const addText = (tag, text, className) => {
+            const el = document.createElement(tag);
+            el.textContent = text;
+            if (className) el.className = className;
+            profileArea.appendChild(el);
+            return el;
+        };
+        if (profile.error) {
+            addText('pre', profile.error, 'error');
+            return;
+        }
+        addText('p', `${profile.profiler}: ${profile.total_ms} ms profiled, ${profile.samples} samples every ${profile.sample_interval_us} µs` +
+            (profile.truncated ? " (truncated)" : ""));
+
+        const table = document.createElement('table');
+        table.className = 'profile-table';
+        const header = table.insertRow();
+        ["Function", "Line", "Calls", "Self (ms)", "Cumulative (ms)", "Self %"].forEach(title => {
+            const th = document.createElement('th');
+            th.textContent = title;
+            header.appendChild(th);
+        });
+        profile.functions.forEach(f => {
+            const row = table.insertRow();
+            const calls = f.primitive_calls !== undefined && f.primitive_calls !== f.calls ? `${f.calls}/${f.primitive_calls}` : f.calls;
+            const where = f.file === "<submission>" ? (f.line ?? "") : (f.file ?? "built-in");
+            [f.function, where, calls, f.self_ms, f.cumulative_ms, f.self_pct].forEach(value => {
+                row.insertCell().textContent = value;
+            });
+        });
+        addText('h3', "Functions");
+        profileArea.appendChild(table);
+
+        addText('h3', "Hot lines (sampled)");
+        addText('pre', profile.hot_lines.length
+            ? profile.hot_lines.map(l => `Line ${l.line} (${l.function}): ${l.samples} samples, ${l.pct}%`).join("\n")
+            : "No samples landed in your code (the run was too short or spent its time in libraries).");
+        markHotLines(profile.hot_lines);
+
+        if (profile.collapsed_stacks) {
+            const button = addText('button', `Download collapsed stacks (${profile.stack_unit}, for flame graph tools)`);
+            button.addEventListener('click', () => {
+                const link = document.createElement('a');
+                link.href = URL.createObjectURL(new Blob([profile.collapsed_stacks + "\n"], { type: 'text/plain' }));
+                link.download = 'profile.folded';
+                link.click();
+                URL.revokeObjectURL(link.href);
+            });
+        }
+    }
+
+    function renderMemory(report) {
+        // Peak, allocation sites and heap timeline for a memory-traced run (core/profiler.py)
+        if (!memoryArea) return;
+        memoryArea.replaceChildren();
+        const addText = (tag, text, className) => {
+            const el = document.createElement(tag);
+            el.textContent = text;
+            if (className) el.className = className;
+            memoryArea.appendChild(el);
+            return el;
+        };
+        const size = bytes => bytes >= 1048576 ? `${(bytes / 1048576).toFixed(2)} MiB` : bytes >= 1024 ? `${(bytes / 1024).toFixed(1)} KiB` : `${bytes} B`;
+        if (report.error) {
+            addText('pre', report.error, 'error');
+            return;
+        }
+        let summary = `${report.tracer}: peak ${size(report.peak_bytes)}, ${size(report.final_bytes)} still allocated at exit`;
+        if (report.allocations !== undefined) {
+            summary += ` (${report.allocations} allocations totalling ${size(report.allocated_bytes)}, ${report.leaked_blocks} blocks never freed)`;
+        }
+        addText('p', summary);
+
+        const points = report.timeline || [];
+        if (points.length > 1) {
+            addText('h3', `Heap over time (${report.timeline_unit})`);
+            const width = 600, height = 120;
+            const maxT = points[points.length - 1][0] || 1, maxBytes = Math.max(...points.map(p => p[2]), 1);
+            const svg = document.createElementNS("http://www.w3.org/2000/svg", "svg");
+            svg.setAttribute("viewBox", `0 0 ${width} ${height}`);
+            svg.setAttribute("class", "memory-timeline");
+            [[1, "live"], [2, "peak"]].forEach(([column, className]) => {
+                const line = document.createElementNS("http://www.w3.org/2000/svg", "polyline");
+                line.setAttribute("points", points.map(p => `${(p[0] / maxT * width).toFixed(1)},${(height - p[column] / maxBytes * height).toFixed(1)}`).join(" "));
+                line.setAttribute("class", className);
+                svg.appendChild(line);
+            });
+            memoryArea.appendChild(svg);
+        }
+
+        const siteTable = (title, sites) => {
+            addText('h3', title);
+            const table = document.createElement('table');
+            table.className = 'profile-table';
+            const header = table.insertRow();
+            ["Site", "Line", "Bytes", "Blocks"].forEach(text => {
+                const th = document.createElement('th');
+                th.textContent = text;
+                header.appendChild(th);
+            });
+            sites.forEach(site => {
+                const row = table.insertRow();
+                const where = site.file === "<submission>" ? "your code" : (site.file ?? "");
+                [site.function ? `${site.function} (${where})` : where, site.line ?? "", size(site.bytes), site.count].forEach(value => {
+                    row.insertCell().textContent = value;
+                });
+            });
+            memoryArea.appendChild(table);
+        };
+        if (report.sites_scope === "live") {
+            if (report.peak_sites) siteTable(`Live allocations near the peak (${size(report.peak_snapshot_bytes)} traced)`, report.peak_sites);
+            siteTable("Live allocations at exit", report.final_sites);
+        } else {
+            siteTable("Allocation sites (whole run)", report.sites);
+        }
+        markHotLines(((report.sites_scope === "live" ? report.peak_sites || report.final_sites : report.sites) || [])
+            .filter(site => site.file === "<submission>" && site.line)
+            .map(site => ({ line: site.line, pct: Math.round(site.bytes / Math.max(report.peak_bytes, 1) * 100),
+                            text: `${size(site.bytes)} in ${site.count} blocks` })));
+    }
+
+    function markHotLines(hotLines) {
+        // Gutter annotations plus a full-line highlight for each hot line ({line, pct, function or text}) of the submission
+        clearHotLines();
+        if (typeof editor === 'undefined' || !editor || !hotLines.length) return;
+        const Range = ace.require("ace/range").Range;
+        hotLineMarkers = hotLines.map(l => editor.session.addMarker(new Range(l.line - 1, 0, l.line - 1, 1), "hot-line", "fullLine"));
+        editor.session.setAnnotations(hotLines.map(l => ({
+            row: l.line - 1, column: 0, type: l.pct >= 20 ? "warning" : "info", text: l.text || `${l.pct}% of samples (${l.function})`,
+        })));
+    }
+
+    function clearHotLines() {
+        if (typeof editor === 'undefined' || !editor || !hotLineMarkers.length) return;
+        hotLineMarkers.forEach(id => editor.session.removeMarker(id));
+        hotLineMarkers = [];
+        editor.session.clearAnnotations(); // The syntax worker re-annotates on the next edit
+    }
+
     function updateOutputArea(text, isError = false, isLoading = false) {
         if (!outputArea) return;
         outputArea.textContent = text; // Use textContent for pre to preserve whitespace/newlines
@@ -327,11 +685,13 @@ document.addEventListener('DOMContentLoaded', () => {
         updateSpan(metricMem, formatMetric(metrics?.mem_used)); // Should be peak mem from runner
         updateSpan(metricTimeComp, formatMetric(metrics?.time_complexity)); // Placeholder
         updateSpan(metricSpaceComp, formatMetric(metrics?.space_complexity)); // Placeholder
+        const bench = metrics?.benchmark;
+        updateSpan(metricBenchmark, bench ? `median ${bench.median} ms (95% CI ${bench.ci_low}-${bench.ci_high} ms, n=${bench.n})` : 'N/A');
     }
 
     function clearMetrics(message = 'N/A') {
         const isLoading = message === "Running...";
-        const spans = [metricRuntime, metricCpu, metricMem, metricTimeComp, metricSpaceComp];
+        const spans = [metricRuntime, metricCpu, metricMem, metricTimeComp, metricSpaceComp, metricBenchmark];
         spans.forEach(span => {
             if(span) {
                 span.textContent = message;